@@ -1,50 +1,36 @@
 import streamlit as st
-import heapq
-import math
+import os
+import datetime
+import time
 import logic
 import data
-
-# --- 1. 計算ヘルパー関数 ---
-def calculate_distance_km(lat1, lon1, lat2, lon2):
-    km_per_lat = 111.0
-    km_per_lon = 91.0
-    dy = (lat1 - lat2) * km_per_lat
-    dx = (lon1 - lon2) * km_per_lon
-    return math.sqrt(dx**2 + dy**2)
-
-def calculate_walking_time(dist_km):
-    speed_kmh = 4.0
-    return (dist_km / speed_kmh) * 60
-
-def get_connecting_line_name(station1, station2):
-    if station1 == station2: return "移動なし"
-    for line_name, stations in data.TOKYO_LINES.items():
-        if station1 in stations and station2 in stations:
-            idx1 = stations.index(station1)
-            idx2 = stations.index(station2)
-            if abs(idx1 - idx2) == 1: return line_name
-            if line_name in ["JR山手線", "都営大江戸線"]:
-                if (idx1 == 0 and idx2 == len(stations)-1) or \
-                   (idx1 == len(stations)-1 and idx2 == 0):
-                    return line_name
-    return "徒歩"
-
-# app.py の format_route_display 関数
-
-def format_route_display(path, graph):
+import graph
+import gtfs
+import matrix
+import meeting
+import cache
+import warmup
+import isochrone
+import disruption
+import querylog
+import slowlog
+import clusters
+
+# --- 1. 経路表示ヘルパー ---
+def format_route_display(path, station_graph):
     if not path: return ""
     if len(path) == 1: return f"🏁 {path[0]} (移動なし)"
 
     segments = []
     
     current_start = path[0]
-    current_line = get_connecting_line_name(path[0], path[1])
-    current_time = graph[path[0]].get(path[1], 0)
+    current_line = graph.get_connecting_line_name(path[0], path[1])
+    current_time = station_graph[path[0]].get(path[1], 0)
     
     for i in range(1, len(path) - 1):
         u, v = path[i], path[i+1]
-        next_line = get_connecting_line_name(u, v)
-        weight = graph[u].get(v, 0)
+        next_line = graph.get_connecting_line_name(u, v)
+        weight = station_graph[u].get(v, 0)
         
         if next_line != current_line:
             segments.append({
@@ -82,135 +68,11 @@ def format_route_display(path, graph):
             
     return "  \n".join(lines)
 
-# --- 2. グラフ構築 ---
-def build_graph():
-    graph = {}
-    STOP_PENALTY = 1.0 
-    
-    # デフォルト設定（データがない路線用）
-    DEFAULT_CONF = {"speed_kmh": 40.0, "interval_min": 8}
-
-    for line_name, stations in data.TOKYO_LINES.items():
-        # その路線の設定を取得
-        conf = data.LINE_CONFIG.get(line_name, DEFAULT_CONF)
-        speed = conf["speed_kmh"]
-
-        for i in range(len(stations) - 1):
-            st1, st2 = stations[i], stations[i+1]
-            if st1 not in graph: graph[st1] = {}
-            if st2 not in graph: graph[st2] = {}
-            
-            travel_time = 3.0
-            if st1 in data.STATION_LOCATIONS and st2 in data.STATION_LOCATIONS:
-                loc1 = data.STATION_LOCATIONS[st1]
-                loc2 = data.STATION_LOCATIONS[st2]
-                dist_km = calculate_distance_km(loc1[0], loc1[1], loc2[0], loc2[1])
-                
-                # 時間 = (距離 * 1.2 / 時速) * 60 + 停車ロス
-                calc_time = (dist_km * 1.2 / speed) * 60 + STOP_PENALTY
-                travel_time = max(calc_time, 1.0)
-            
-            graph[st1][st2] = min(graph[st1].get(st2, float('inf')), travel_time)
-            graph[st2][st1] = min(graph[st2].get(st1, float('inf')), travel_time)
-
-        # 環状線（山手線・大江戸線）の接続
-        if line_name in ["JR山手線", "都営大江戸線"]:
-            first, last = stations[0], stations[-1]
-            if first not in graph: graph[first] = {}
-            if last not in graph: graph[last] = {}
-            
-            travel_time = 3.0
-            if first in data.STATION_LOCATIONS and last in data.STATION_LOCATIONS:
-                loc1 = data.STATION_LOCATIONS[first]
-                loc2 = data.STATION_LOCATIONS[last]
-                dist_km = calculate_distance_km(loc1[0], loc1[1], loc2[0], loc2[1])
-                calc_time = (dist_km * 1.2 / speed) * 60 + STOP_PENALTY
-                travel_time = max(calc_time, 1.0)
-
-            graph[first][last] = min(graph[first].get(last, float('inf')), travel_time)
-            graph[last][first] = min(graph[last].get(first, float('inf')), travel_time)
-
-    # (B) 徒歩ルート（ここは変更なし）
-    station_names_with_loc = list(data.STATION_LOCATIONS.keys())
-    MAX_WALK_DIST_KM = 0.8
-
-    for i in range(len(station_names_with_loc)):
-        for j in range(i + 1, len(station_names_with_loc)):
-            s1 = station_names_with_loc[i]
-            s2 = station_names_with_loc[j]
-            if s1 not in graph or s2 not in graph: continue
-
-            loc1 = data.STATION_LOCATIONS[s1]
-            loc2 = data.STATION_LOCATIONS[s2]
-            dist = calculate_distance_km(loc1[0], loc1[1], loc2[0], loc2[1])
-            
-            if dist <= MAX_WALK_DIST_KM and dist > 0:
-                walk_time = calculate_walking_time(dist)
-                current_weight = graph[s1].get(s2, float('inf'))
-                if walk_time < current_weight:
-                    graph[s1][s2] = walk_time
-                    graph[s2][s1] = walk_time
-    return graph
-
-# --- 3. ダイクストラ法 ---
-def get_shortest_path(graph, start_node, end_node):
-    if start_node == end_node: return 0, [start_node]
-    
-    # 優先度付きキュー: (経過時間, 現在地, 経路リスト, 直前の路線名)
-    queue = [(0, start_node, [start_node], None)]
-    
-    # 訪問済み記録: (ノード, 到着した路線) -> 最短時間
-    visited = {}
-    
-    # デフォルト設定（データがない路線用）
-    DEFAULT_CONF = {"speed_kmh": 40.0, "interval_min": 8}
-
-    while queue:
-        cost, current_node, path, prev_line = heapq.heappop(queue)
-        
-        if current_node == end_node: return cost, path
-        
-        state_key = (current_node, prev_line)
-        if state_key in visited and visited[state_key] <= cost:
-            continue
-        visited[state_key] = cost
-
-        if current_node in graph:
-            for neighbor, weight in graph[current_node].items():
-                next_line = get_connecting_line_name(current_node, neighbor)
-                added_cost = 0
-                
-                # --- 乗り換えロジック (Level 2) ---
-                if prev_line is not None and next_line != prev_line:
-                    # 次に乗る路線のデータを取得
-                    conf = data.LINE_CONFIG.get(next_line, DEFAULT_CONF)
-                    interval = conf["interval_min"]
-                    
-                    # 待ち時間コスト = 平均待ち時間(間隔/2) + ホーム移動(2分)
-                    wait_cost = (interval / 2.0) + 2.0
-                    
-                    # 1. 電車同士の乗り換え
-                    if prev_line != "徒歩" and next_line != "徒歩":
-                        added_cost = wait_cost
-                    
-                    # 2. 徒歩から電車への乗り換え
-                    elif prev_line == "徒歩" and next_line != "徒歩":
-                        added_cost = wait_cost
-                        
-                    # 3. 電車から徒歩へ（待ち時間なし）
-                    else:
-                        added_cost = 0
-                # -------------------------------
-                
-                new_cost = cost + weight + added_cost
-                heapq.heappush(queue, (new_cost, neighbor, path + [neighbor], next_line))
-
-    return float('inf'), []
-
-# --- 4. UI ---
-def station_selector(label, key_prefix):
-    # --- 1. 全駅のリストアップと整形 ---
+# --- 2. UI ---
+@st.cache_resource
+def station_options():
     # 選択肢リストを作成: [{"display": "蒲田 【JR京浜東北線】", "raw": "蒲田", "line": "JR京浜東北線", "reading": "かまた"}, ...]
+    # （入力のたびに作り直さないよう、プロセスで1回だけ）
     all_options = []
     for line, stations in data.TOKYO_LINES.items():
         for s in stations:
@@ -221,6 +83,20 @@ def station_selector(label, key_prefix):
                 "line": line,                 # フィルタ用
                 "reading": reading            # 検索用
             })
+    return all_options
+
+def station_selector(label, key_prefix, allow_coordinates=False):
+    # --- 0. 座標（自宅など）で指定する場合 ---
+    # 近くの駅（logic.access_seeds）まで歩く時間から1回の RAPTOR で探す。時刻表モードでは使えない
+    if allow_coordinates and st.radio(f"{label}: 指定方法", ["駅", "緯度・経度"], horizontal=True,
+                                      key=f"{key_prefix}_kind") == "緯度・経度":
+        col1, col2 = st.columns([1, 1])
+        lat = col1.number_input(f"{label}: 緯度", 35.0, 36.5, 35.681, step=0.001, format="%.5f", key=f"{key_prefix}_lat")
+        lon = col2.number_input(f"{label}: 経度", 139.0, 140.5, 139.767, step=0.001, format="%.5f", key=f"{key_prefix}_lon")
+        return (float(lat), float(lon))
+
+    # --- 1. 全駅のリストアップと整形 ---
+    all_options = station_options()
 
     # --- 2. 検索・絞り込みUI ---
     # コンテナを使って視覚的にグループ化
@@ -282,132 +158,429 @@ def station_selector(label, key_prefix):
     
     return selected_station
 
+# --- 3. GTFS 時刻表（任意）と検索ヘルパー ---
+# 環境変数 HUB_FINDER_GTFS に GTFS zip のパスがあれば、実際の時刻表で経路を探す
+GTFS_PATH = os.environ.get("HUB_FINDER_GTFS")
+
+@st.cache_resource
+def load_timetable(path, service_date):
+    return gtfs.load_gtfs(path, service_date=service_date)
+
+def format_departure(route):
+    # 時刻表モードの結果だけ出発時刻を持つ
+    if route.departure_time is None: return ""
+    sec = route.departure_time
+    return f" （{sec // 3600:02d}:{sec % 3600 // 60:02d} 発）"
+
+# 結果のディスクキャッシュ（再起動しても残る）。HUB_FINDER_CACHE で置き場所を変えられる
+CACHE_PATH = os.environ.get("HUB_FINDER_CACHE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "hub_finder_cache.sqlite3"))
+
+@st.cache_resource
+def load_result_cache():
+    return cache.ResultCache(CACHE_PATH)
+
+@st.cache_resource
+def load_slow_log():
+    # HUB_FINDER_SLOW_LOG を設定したときだけ、遅い検索の入力・内訳・cProfile を保存する（slowlog.py で集計）
+    return slowlog.from_env()
+
+@st.cache_resource
+def load_query_log():
+    # HUB_FINDER_QUERY_LOG を設定したときだけ、クエリを匿名化して記録する（replay.py で負荷試験に使う）
+    return querylog.from_env()
+
+@st.cache_resource
+def load_disruptions():
+    # 運行障害（プロセスで1つ）。登録すると経路探索はすぐに、所要時間行列はバックグラウンドで反映される
+    return disruption.DisruptionManager()
+
+@st.cache_resource
+def start_warmup():
+    # サーバー起動後の最初の実行で1回だけ、バックグラウンドで共有データを作り始める
+    return warmup.WarmUp(warmup.hot_stations(load_result_cache()), network=load_disruptions().base).start()
+
+@st.cache_resource
+def load_time_matrix():
+    # 全駅間の所要時間行列（プロセスごとに1回だけ作る。障害の反映は DisruptionManager が行う）
+    return matrix.build_time_matrix(network=load_disruptions().base)
+
+def get_time_matrix():
+    # ウォームアップが終わっていればその行列を使い、まだならその場で作る
+    warm = start_warmup()
+    time_matrix = warm.matrix if warm.matrix is not None else load_time_matrix()
+    return load_disruptions().track(time_matrix)
+
+@st.cache_resource
+def load_isochrones(version=0):
+    # 駅ごとの到達圏（10/20/30/45/60分）のビット集合（運行障害で行列が変わったら version が変わって作り直す）
+    return isochrone.IsochroneIndex(get_time_matrix())
+
+@st.cache_resource
+def load_candidate_stations():
+    # 到達圏の駅の選択肢（ウォームアップのグラフがまだなら1回だけ作る。入力のたびには作らない）
+    warm = start_warmup()
+    station_graph = warm.graph if warm.graph is not None else graph.build_graph()
+    return sorted(station_graph.keys())
+
+@st.cache_resource
+def load_clusters():
+    # 駅のエリア分けとエリア間の所要時間の下界（平常時の路線網で作る。運行障害中も下界のまま使える）
+    return clusters.ClusterIndex(network=load_disruptions().base)
+
+def load_profile_store():
+    # 大人数モード用のプロファイル置き場（行列の行・列をそのまま使うので作るのは軽い）
+    time_matrix = get_time_matrix()
+    return meeting.ProfileStore(time_matrix.stations, matrix=time_matrix)
+
+def find_member_routes(m, candidate, timetable=None, departure_window=None, profile=None, upper_bound=None):
+    """1人分の往路・復路の最短ルート（どちらか到達不能、または往復で upper_bound 分を超えるなら None）"""
+    # 1. 往路の計算 (現在地 -> 集合場所)
+    departure_sec = None
+    if timetable is not None and m["current"] != candidate:
+        chosen = logic.best_departure(profile.get(candidate))
+        if chosen is None: return None
+        departure_sec = chosen.departure_time
+    elif departure_window is not None:
+        departure_sec = departure_window[0]
+    # 運行障害を反映したネットワーク（障害がなければ平常時のもの）
+    network = load_disruptions().network
+    outward_routes = load_slow_log().find_routes_raptor(m["current"], candidate, timetable=timetable, departure_time=departure_sec,
+                                              upper_bound=upper_bound, network=network)
+    if not outward_routes: return None
+    best_outward = min(outward_routes, key=lambda x: x.total_time)
+    if upper_bound is not None: upper_bound -= best_outward.total_time
+
+    # 2. 復路の計算 (集合場所 -> 次の予定)
+    # 時刻表モードでは集合場所に着いた時刻から復路を探す
+    return_routes = load_slow_log().find_routes_raptor(candidate, m["next"], timetable=timetable, departure_time=best_outward.arrival_time,
+                                             upper_bound=upper_bound, network=network)
+    if not return_routes: return None
+    best_return = min(return_routes, key=lambda x: x.total_time)
+
+    return meeting.MemberRoutes(m["name"], best_outward, best_return)
+
+def segment_label(line):
+    # 座標の出発地・目的地と駅の間は "徒歩" の区間になる
+    return "🚶 **(徒歩)**" if line == "徒歩" else f"🚃 **【{line}】**"
+
+def format_member_details(mr):
+    # 往路の表示作成
+    out_lines = []
+    for seg in mr.outward.path_details:
+        wait_str = f"(待 `{int(seg.wait)}分` )" if seg.wait > 0 else ""
+        out_lines.append(f"{segment_label(seg.line)} （{seg.start} → {seg.end}） `{int(seg.time)}分`{wait_str}")
+        out_lines.append("↓")
+    if out_lines: out_lines.pop() # 最後の↓を取る
+
+    # 復路の表示作成
+    ret_lines = []
+    for seg in mr.return_route.path_details:
+        wait_str = f"(待 `{int(seg.wait)}分` )" if seg.wait > 0 else ""
+        ret_lines.append(f"{segment_label(seg.line)} （{seg.start} → {seg.end}） `{int(seg.time)}分`{wait_str}")
+        ret_lines.append("↓")
+    if ret_lines: ret_lines.pop() # 最後の↓を取る
+
+    total_m_time = mr.outward.total_time + mr.return_route.total_time
+
+    # フォーマットに流し込み
+    return (
+        f"##### 👤 {mr.name} `{int(total_m_time)}分`\n\n"
+        f"**往路** `{int(mr.outward.total_time)}分`{format_departure(mr.outward)}\n\n"
+        f"{'  \n'.join(out_lines)}\n\n"
+        f"**復路** `{int(mr.return_route.total_time)}分`\n\n"
+        f"{'  \n'.join(ret_lines)}"
+    )
+
 st.title("🚉 Hub Finder")
 st.markdown("全員の集合に最適な駅を計算します。")
 
-station_graph = build_graph()
-all_candidate_stations = sorted(list(station_graph.keys()))
+warm = start_warmup()
+all_candidate_stations = load_candidate_stations()
 
-st.sidebar.header("参加者設定")
-num_members = st.sidebar.number_input("参加人数", 2, 5, 2)
+# この人数を超えたら大人数モード（同じ出発・行き先のメンバーをまとめて集計する）
+LARGE_GROUP_THRESHOLD = 5
+# 時刻表モードは候補ごとに経路探索するので、人数の上限は従来どおり
+MAX_MEMBERS = LARGE_GROUP_THRESHOLD if GTFS_PATH else 200
 
-members_data = []
-for i in range(num_members):
+if not warm.ready:
+    # ウォームアップ中も検索はできる（その場で計算するので少し遅い）
+    st.sidebar.progress(warm.progress, text=f"準備中: {warm.stage}")
+
+st.sidebar.header("参加者設定")
+num_members = st.sidebar.number_input("参加人数", 2, MAX_MEMBERS, 2)
+
+timetable = None
+departure_window = None
+if GTFS_PATH:
+    timetable = load_timetable(GTFS_PATH, datetime.date.today())
+    # 出発可能な時間帯（メンバーごとにこの中で最適な出発時刻を選ぶ）
+    dep_from = st.sidebar.time_input("出発時刻（から）", datetime.time(18, 0))
+    dep_to = st.sidebar.time_input("出発時刻（まで）", datetime.time(19, 0))
+    departure_window = (dep_from.hour * 3600 + dep_from.minute * 60,
+                        max(dep_to.hour * 3600 + dep_to.minute * 60, dep_from.hour * 3600 + dep_from.minute * 60))
+
+max_minutes = None
+hierarchy = None
+if timetable is None:
+    # 「誰も N 分以上かからない場所」を探すときの上限（到達圏で候補を先に絞る）
+    cap_choice = st.sidebar.selectbox("1人あたりの往復時間の上限", ["なし", 30, 45, 60, 90, 120])
+    if cap_choice != "なし": max_minutes = cap_choice
+
+    # エリア → 駅の2段階探索（所要時間行列を使わず、下界の良いエリアの駅だけ経路探索する）
+    method = st.sidebar.selectbox("探索方法", ["所要時間行列", "エリア → 駅の2段階"])
+    if method != "所要時間行列":
+        hierarchy = {
+            "refine": st.sidebar.slider("調べるエリアの数", 1, 10, 3, help="少ないほど速いが、最適な駅を取りこぼすことがある"),
+            "guarantee": st.sidebar.checkbox("最適解を保証", help="下界で除外できるまでエリアを調べ続ける"),
+        }
+
+    with st.sidebar.expander("🗺️ 到達圏を見る"):
+        iso_station = st.selectbox("駅", all_candidate_stations, key="iso_station")
+        for band, stations in load_isochrones(load_disruptions().version).isochrone(iso_station).items():
+            st.markdown(f"**{band}分以内** （+{len(stations)}駅） " + "、".join(stations))
+
+# 運行障害（運休・遅延）の登録。経路探索には次の検索からすぐ反映される（時刻表モードは時刻表のまま）
+if timetable is None:
+    disruptions = load_disruptions()
+    with st.sidebar.expander("🚧 運行障害" + (f"（{len(disruptions.active)}件）" if disruptions.active else "")):
+        d_line = st.selectbox("路線", list(data.TOKYO_LINES.keys()), key="disruption_line")
+        d_stations = data.TOKYO_LINES[d_line]
+        d_from = st.selectbox("区間（から）", d_stations, key="disruption_from")
+        d_to = st.selectbox("区間（まで）", d_stations, index=len(d_stations) - 1, key="disruption_to")
+        d_kind = st.radio("種類", ["運休", "遅延"], horizontal=True, key="disruption_kind")
+        d_minutes = st.number_input("遅れ（分）", 1, 120, 10, key="disruption_minutes") if d_kind == "遅延" else None
+        if st.button("登録", key="disruption_add"):
+            if d_from == d_to:
+                st.error("区間の両端に別の駅を選んでください")
+            elif d_kind == "運休":
+                disruptions.close(d_line, d_from, d_to)
+            else:
+                disruptions.delay(d_line, d_from, d_to, d_minutes)
+        for n, d in enumerate(disruptions.active):
+            c1, c2 = st.columns([3, 1])
+            c1.markdown(f"- {d.describe()}")
+            if c2.button("解除", key=f"disruption_clear_{n}"):
+                disruptions.clear(d)
+                st.rerun()
+        if not disruptions.ready:
+            st.caption(f"所要時間行列に反映中（{disruptions.stage}）")
+
+# --- 4. 入力・検索・結果の fragment ---
+# 駅の入力1文字ごとにスクリプト全体（全メンバーの入力欄・検索）が走らないよう、
+# メンバーごとの入力欄、検索ボタン、結果表示をそれぞれ st.fragment にして、操作した部分だけ再実行する。
+# fragment の間の受け渡しは st.session_state（f"m{i}_member" と "search_results"）で行う。
+@st.fragment
+def member_block(i, allow_coordinates):
     st.subheader(f"👤 メンバー {i+1}")
-    c_st = station_selector("現在地", f"m{i}_curr")
-    n_st = station_selector("次の予定", f"m{i}_next")
-    members_data.append({"name": f"メンバー{i+1}", "current": c_st, "next": n_st})
+    c_st = station_selector("現在地", f"m{i}_curr", allow_coordinates=allow_coordinates)
+    n_st = station_selector("次の予定", f"m{i}_next", allow_coordinates=allow_coordinates)
+    st.session_state[f"m{i}_member"] = {"name": f"メンバー{i+1}", "current": c_st, "next": n_st}
     st.markdown("---")
 
-# --- ボタンエリア（横並び） ---
-col1, col2 = st.columns(2)
-# use_container_width=True でボタンをカラムいっぱいに広げて押しやすくする
-pressed_efficiency = col1.button("🚀 効率重視で検索\n(合計時間 最小)", use_container_width=True)
-pressed_fairness = col2.button("⚖️ 公平重視で検索\n(最大時間 最小)", use_container_width=True)
-
-# app.py のボタン押下後の処理ブロックを修正
-
-# --- ボタン押下後の処理（往路・復路の両方を計算する修正版） ---
-if pressed_efficiency or pressed_fairness:
+def run_search(members_data, objective, timetable, departure_window, max_minutes, hierarchy=None):
+    """集合場所を探して、経路の詳細（文字列）つきの上位の結果を返す"""
     results = []
-    progress_bar = st.progress(0)
-    candidate_stations = list(data.STATION_LOCATIONS.keys())
-    
-    for idx, candidate in enumerate(candidate_stations):
-        member_results = []
-        is_reachable = True
-        
-        for m in members_data:
-            # 1. 往路の計算 (現在地 -> 集合場所)
-            outward_routes = logic.find_routes_raptor(m["current"], candidate)
-            # 2. 復路の計算 (集合場所 -> 次の予定)
-            return_routes = logic.find_routes_raptor(candidate, m["next"])
-            
-            if not outward_routes or not return_routes:
-                is_reachable = False
-                break
-            
-            # それぞれ最短ルートを選択
-            best_outward = min(outward_routes, key=lambda x: x["total_time"])
-            best_return = min(return_routes, key=lambda x: x["total_time"])
-            
-            member_results.append({
-                "name": m["name"],
-                "outward": best_outward,
-                "return": best_return
-            })
-
-        if is_reachable:
-            # 往復合計時間を算出
-            times = [r["outward"]["total_time"] + r["return"]["total_time"] for r in member_results]
-            sum_time = sum(times)
-            max_time = max(times)
-            
-            details_text = []
-            for mr in member_results:
-                # 往路の表示作成
-                out_lines = []
-                for seg in mr["outward"]["path_details"]:
-                    wait_str = f"(待 `{int(seg['wait'])}分` )" if seg['wait'] > 0 else ""
-                    out_lines.append(f"🚃 **【{seg['line']}】** （{seg['start']} → {seg['end']}） `{int(seg['time'])}分`{wait_str}")
-                    out_lines.append("↓")
-                if out_lines: out_lines.pop() # 最後の↓を取る
-                
-                # 復路の表示作成
-                ret_lines = []
-                for seg in mr["return"]["path_details"]:
-                    wait_str = f"(待 `{int(seg['wait'])}分` )" if seg['wait'] > 0 else ""
-                    ret_lines.append(f"🚃 **【{seg['line']}】** （{seg['start']} → {seg['end']}） `{int(seg['time'])}分`{wait_str}")
-                    ret_lines.append("↓")
-                if ret_lines: ret_lines.pop() # 最後の↓を取る
-                
-                total_m_time = mr["outward"]["total_time"] + mr["return"]["total_time"]
-                
-                # フォーマットに流し込み
-                # フォーマットに流し込み
-                details_text.append(
-                    f"##### 👤 {mr['name']} `{int(total_m_time)}分`\n\n"
-                    f"**往路** `{int(mr['outward']['total_time'])}分`\n\n"
-                    f"{'  \n'.join(out_lines)}\n\n"
-                    f"**復路** `{int(mr['return']['total_time'])}分`\n\n"
-                    f"{'  \n'.join(ret_lines)}"
-                )
-
-            results.append({
-                "station": candidate,
-                "total_time": sum_time,
-                "max_time": max_time,
-                "details": details_text
-            })
-            
-        if idx % 10 == 0:
-            progress_bar.progress(min((idx + 1) / len(candidate_stations), 1.0))
-            
-    progress_bar.progress(1.0)
+    num_members = len(members_data)
+    if not all(m["current"] and m["next"] for m in members_data):
+        # 駅が選ばれていないメンバーがいる（"(候補なし)"）。キャッシュのキーも作れないので探さない
+        return results
+    # 運行障害中の結果は保存しない（保存済みの結果も平常時のものなので使わない）
+    disrupted = bool(load_disruptions().active)
+    if timetable is None and not load_disruptions().ready:
+        # 所要時間行列への反映は数秒で終わるので、待ってから行列を使う（間に合わなければ反映済みの分だけで探す）
+        with st.spinner("運行障害を所要時間行列に反映しています..."):
+            load_disruptions().join(timeout=10)
+    search_started = time.perf_counter()
+    cache_hit = False
+
+    slow_log = load_slow_log()
+    # 遅い検索の記録用の入力（メンバー名は残さない）。内訳は "ranking" と find_routes_raptor の時間
+    slow_inputs = {"objective": objective, "max_minutes": max_minutes,
+                   "members": [[logic.place_key(m["current"]), logic.place_key(m["next"])] for m in members_data]}
+    with slow_log.capture("meeting", slow_inputs):
+        if timetable is None and max_minutes is not None:
+            query_mode = "capped"
+            # 到達圏のビット集合の AND で候補を絞り、残りだけ所要時間行列で採点する
+            with slow_log.stage("ranking"):
+                ranking, cap_stats = meeting.capped_meeting(get_time_matrix(), load_isochrones(load_disruptions().version),
+                                                            members_data, max_minutes,
+                                                            k=3, objective=objective, candidates=data.STATION_LOCATIONS)
+            for rank, r in enumerate(ranking):
+                # 大人数のときは1位だけ経路の詳細を出す
+                r.details = []
+                if rank == 0 or num_members <= LARGE_GROUP_THRESHOLD:
+                    r.details = [format_member_details(find_member_routes(m, r.station)) for m in members_data]
+                results.append(r)
+            st.caption(f"上限 {max_minutes} 分: 到達圏で {cap_stats['filtered']} / {cap_stats['candidates']} 駅に絞り込み、"
+                       f"{cap_stats['feasible']} 駅が条件を満たす")
+        elif timetable is None and hierarchy is not None:
+            query_mode = "hierarchical"
+            # 下界の良いエリアから開いて、中の駅だけ RAPTOR で採点する（つまみが違えば結果も違うのでキーに含める）
+            result_cache = load_result_cache()
+            key = cache.query_key(members_data, objective, k=3,
+                                  mode=f"hierarchical-{hierarchy['refine']}-{int(hierarchy['guarantee'])}")
+            ranking = result_cache.get_ranking(key) if not disrupted else None
+            cache_hit = ranking is not None
+            if ranking is None:
+                with slow_log.stage("ranking"):
+                    ranking, h_stats = meeting.hierarchical_meeting(load_clusters(), members_data, k=3, objective=objective,
+                                                                    candidates=data.STATION_LOCATIONS,
+                                                                    network=load_disruptions().network, **hierarchy)
+                if not disrupted: result_cache.put_ranking(key, ranking)
+                st.caption(f"{h_stats['refined']} / {h_stats['clusters']} エリアの {h_stats['evaluated']} 駅を評価"
+                           + ("（最適解）" if h_stats["proven"] else "（調べていないエリアにより良い駅がある可能性あり）"))
+            else:
+                st.caption("保存済みの結果を表示しています")
+            for rank, r in enumerate(ranking):
+                r.details = []
+                if rank == 0 or num_members <= LARGE_GROUP_THRESHOLD:
+                    r.details = [format_member_details(find_member_routes(m, r.station)) for m in members_data]
+                results.append(r)
+        elif timetable is None and num_members > LARGE_GROUP_THRESHOLD:
+            query_mode = "large"
+            # 同じメンバー構成・目的関数のランキングはディスクキャッシュから返す
+            result_cache = load_result_cache()
+            key = cache.query_key(members_data, objective, k=3, mode="large")
+            ranking = result_cache.get_ranking(key) if not disrupted else None
+            cache_hit = ranking is not None
+            if ranking is None:
+                with slow_log.stage("ranking"):
+                    ranking, _ = meeting.large_group_meeting(load_profile_store(), members_data, k=3, objective=objective,
+                                                             candidates=data.STATION_LOCATIONS)
+                if not disrupted: result_cache.put_ranking(key, ranking)
+            # 同じ出発・行き先のメンバーは経路も同じなので、まとめて1回だけ表示する
+            member_groups = {}
+            for m in members_data:
+                member_groups.setdefault((m["current"], m["next"]), []).append(m["name"])
+            for rank, r in enumerate(ranking):
+                r.details = []
+                if rank == 0:
+                    for (current, nxt), names in member_groups.items():
+                        group = {"name": "・".join(names), "current": current, "next": nxt}
+                        r.details.append(format_member_details(find_member_routes(group, r.station)))
+                results.append(r)
+            st.caption(f"{len(members_data)}人（出発・行き先の組み合わせ {len(member_groups)} 通り）で集計")
+        elif timetable is None:
+            query_mode = "ta"
+            # 全駅間の所要時間行列から、閾値アルゴリズムで上位の候補だけを評価する
+            result_cache = load_result_cache()
+            key = cache.query_key(members_data, objective, k=3, mode="ta")
+            ranking = result_cache.get_ranking(key) if not disrupted else None
+            cache_hit = ranking is not None
+            if ranking is None:
+                with slow_log.stage("ranking"):
+                    ranking, ta_stats = meeting.top_k_meeting(get_time_matrix(), members_data, k=3, objective=objective,
+                                                              candidates=data.STATION_LOCATIONS)
+                if not disrupted: result_cache.put_ranking(key, ranking)
+                st.caption(f"評価した候補駅: {ta_stats['touched']} / {ta_stats['candidates']}")
+            else:
+                st.caption("保存済みの結果を表示しています")
+            for r in ranking:
+                # 経路の詳細は上位の候補だけ RAPTOR で復元する
+                member_results = [find_member_routes(m, r.station) for m in members_data]
+                r.details = [format_member_details(mr) for mr in member_results]
+                results.append(r)
+        else:
+            query_mode = "timetable"
+            progress_bar = st.progress(0)
+            live_ranking = st.empty()
+            candidate_stations = list(data.STATION_LOCATIONS.keys())
+
+            # 前回の検索がまだ走っていたら止める（条件を変えて押し直したときに CPU を使い続けないように）
+            previous = st.session_state.get("search_token")
+            if previous is not None: previous.cancel()
+            token = meeting.CancelToken()
+            st.session_state["search_token"] = token
+
+            # 時刻表モード: メンバーごとに rRAPTOR を1回だけ回し、全候補駅への (出発 → 到着) プロファイルを得る
+            member_profiles = {}
+            with slow_log.stage("find_profile_raptor"):
+                for m in members_data:
+                    member_profiles[m["name"]] = logic.find_profile_raptor(timetable, m["current"], *departure_window)
+
+            def evaluate(candidate, bound):
+                # bound: 今の3位の値。合計なら残りの持ち時間、最大なら1人あたりの上限として経路探索を打ち切る
+                member_results = []
+                spent = 0.0
+                for m in members_data:
+                    budget = None if bound is None else (bound - spent if objective == "sum" else bound)
+                    mr = find_member_routes(m, candidate, timetable, departure_window, member_profiles[m["name"]], budget)
+                    if mr is None: return None
+                    spent += mr.outward.total_time + mr.return_route.total_time
+                    member_results.append(mr)
+                # 往復合計時間を算出（詳細の文字列は上位に残ったものだけ最後に作る）
+                times = [r.outward.total_time + r.return_route.total_time for r in member_results]
+                return meeting.MeetingResult(candidate, sum(times), max(times), details=member_results)
+
+            # 候補を評価しながら、その時点の上位3件を表示し続ける
+            for ranking, done, total in meeting.stream_meeting(evaluate, candidate_stations, k=3,
+                                                               objective=objective, cancel=token):
+                progress_bar.progress(done / total, text=f"{done} / {total} 駅を評価")
+                live_ranking.markdown("  \n".join(
+                    f"{rank + 1}. **{r.station}** 合計 `{r.total_time:.1f}分` / 最大 `{r.max_time:.1f}分`"
+                    for rank, r in enumerate(ranking)))
+                results = ranking
+            live_ranking.empty()
+            for r in results:
+                r.details = [format_member_details(mr) for mr in r.details]
+            if st.session_state.get("search_token") is token:
+                del st.session_state["search_token"]
+        slow_inputs["mode"] = query_mode
     # --- 以降、結果表示（ベスト駅のSuccess表示等）は前回と同じ ---
-
-    # --- 結果表示（以前と同じ）---
+    query_log = load_query_log()
+    if query_log is not None and all(m["current"] and m["next"] for m in members_data):
+        query_log.record(query_mode, members_data, objective, time.perf_counter() - search_started, cache_hit,
+                         max_minutes, options=hierarchy if query_mode == "hierarchical" else None)
+    return results
+
+@st.fragment
+def search_panel(num_members, timetable, departure_window, max_minutes, hierarchy):
+    # --- ボタンエリア（横並び） ---
+    col1, col2 = st.columns(2)
+    # use_container_width=True でボタンをカラムいっぱいに広げて押しやすくする
+    pressed_efficiency = col1.button("🚀 効率重視で検索\n(合計時間 最小)", use_container_width=True)
+    pressed_fairness = col2.button("⚖️ 公平重視で検索\n(最大時間 最小)", use_container_width=True)
+
+    if pressed_efficiency or pressed_fairness:
+        members_data = [st.session_state[f"m{i}_member"] for i in range(num_members)]
+        objective = "sum" if pressed_efficiency else "max"
+        results = run_search(members_data, objective, timetable, departure_window, max_minutes, hierarchy)
+        st.session_state["search_results"] = {"results": results, "members": members_data}
+        st.session_state["result_order"] = "効率重視" if pressed_efficiency else "公平重視"
+    results_panel(num_members)
+
+@st.fragment
+def results_panel(num_members):
+    # 並べ替えはこの中だけ再実行する（経路探索はやり直さない）
+    search = st.session_state.get("search_results")
+    if search is None: return
+    results = search["results"]
     if results:
-        if pressed_efficiency:
-            results.sort(key=lambda x: x["total_time"])
-            mode_name = "効率重視"
+        if [st.session_state.get(f"m{i}_member") for i in range(num_members)] != search["members"]:
+            st.caption("入力が前回の検索から変わっています（もう一度検索すると反映されます）")
+        mode_name = st.radio("並べ替え", ["効率重視", "公平重視"], horizontal=True, key="result_order")
+        if mode_name == "効率重視":
+            results = sorted(results, key=lambda x: x.total_time)
         else:
-            results.sort(key=lambda x: (x["max_time"], x["total_time"]))
-            mode_name = "公平重視"
+            results = sorted(results, key=lambda x: (x.max_time, x.total_time))
 
         best = results[0]
         
-        st.success(f"👑 最適な集合場所: **{best['station']}** ({mode_name})")
+        st.success(f"👑 最適な集合場所: **{best.station}** ({mode_name})")
         
         col1, col2 = st.columns(2)
-        col1.metric("全員の移動時間合計", f"{best['total_time']:.1f} 分")
-        col2.metric("最大移動時間", f"{best['max_time']:.1f} 分")
+        col1.metric("全員の移動時間合計", f"{best.total_time:.1f} 分")
+        col2.metric("最大移動時間", f"{best.max_time:.1f} 分")
         
         with st.expander("詳細経路を見る", expanded=True):
-            st.markdown(f"### 📍 集合場所: {best['station']}")
+            st.markdown(f"### 📍 集合場所: {best.station}")
             st.markdown("---")
-            for d in best["details"]:
+            for d in best.details:
                 st.markdown(d)
                 st.markdown("---")
     else:
-        st.error("経路が見つかりませんでした。")
\ No newline at end of file
+        st.error("経路が見つかりませんでした。")
+
+for i in range(num_members):
+    member_block(i, allow_coordinates=timetable is None)
+search_panel(num_members, timetable, departure_window, max_minutes, hierarchy)
@@ -0,0 +1,147 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import Counter
+import numpy as np
+import data
+import edges
+import logic
+import meeting
+
+# --- 1. 路線データの指紋 ---
+# 路線・駅の座標・所要時間の係数が変わると所要時間も変わる。保存する行はすべてこの指紋を主キーに含み、
+# 読むときは今の指紋の行だけを使う（古い指紋の行は LRU で消える）
+def network_fingerprint():
+    payload = json.dumps([data.LINE_CONFIG, data.TOKYO_LINES, data.STATION_LOCATIONS, edges.RAPTOR_MODEL.key(),
+                          logic.ACCESS_MAX_KM, logic.ACCESS_LIMIT], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+def query_key(members, objective, k=3, mode=""):
+    """
+    集合場所クエリの正規化キー。名前やメンバーの並び順は結果に影響しないので、
+    (現在地, 次の予定) の組をソートしたものと目的関数だけで決める。
+    """
+    pairs = sorted((logic.place_key(m["current"]), logic.place_key(m["next"])) for m in members)
+    return json.dumps({"mode": mode, "objective": objective, "k": k, "members": pairs}, ensure_ascii=False)
+
+
+# --- 2. SQLite による永続キャッシュ ---
+# 指紋の列がない前の形式の表（profiles / rankings）は、まだ動いている古いワーカーのためにそのまま残す
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS profile_vectors (
+    fingerprint TEXT, direction TEXT, station TEXT, max_transfers INTEGER,
+    vector BLOB, nbytes INTEGER, last_used REAL,
+    PRIMARY KEY (fingerprint, direction, station, max_transfers)
+);
+CREATE TABLE IF NOT EXISTS meeting_rankings (
+    fingerprint TEXT, key TEXT, payload TEXT, nbytes INTEGER, last_used REAL,
+    PRIMARY KEY (fingerprint, key)
+);
+"""
+
+class ResultCache:
+    """
+    出発駅ごとの到着プロファイル（logic.STATION_NAMES 順の float32 ベクトル）と、
+    集合場所ランキングをディスクに保存する。再起動後の最初の利用者も計算を待たずに済む。
+
+    - WAL モードなので、複数の Streamlit ワーカーが同時に読んでもブロックしない
+    - 合計サイズが max_bytes を超えたら、最後に使った時刻が古いものから消す
+    - 行はすべて路線データの指紋つきで保存し、今の指紋の行だけを読む（ローリングデプロイで
+      新旧のワーカーが同じファイルを使っても、別の路線データの結果を混ぜない）
+    """
+    def __init__(self, path, max_bytes=64 * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.fingerprint = network_fingerprint()
+        # sqlite3 の接続はスレッドをまたいで使えないので、スレッドごとに開く
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        with conn:
+            conn.executescript(_SCHEMA)
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _touch(self, table, where, params):
+        # 読み込みのたびに最終利用時刻を更新する（書き込みが混んでいたら諦める: LRU の精度より応答優先）
+        try:
+            with self._conn() as conn:
+                conn.execute(f"UPDATE {table} SET last_used = ? WHERE fingerprint = ? AND {where}",
+                             (time.time(), self.fingerprint, *params))
+        except sqlite3.OperationalError:
+            pass
+
+    def _evict(self, conn):
+        total = conn.execute(
+            "SELECT (SELECT COALESCE(SUM(nbytes), 0) FROM profile_vectors)"
+            " + (SELECT COALESCE(SUM(nbytes), 0) FROM meeting_rankings)"
+        ).fetchone()[0]
+        if total <= self.max_bytes: return
+        # 2つの表をまとめて古い順に並べ、超過分がなくなるまで消す
+        rows = conn.execute(
+            "SELECT 'profile_vectors', rowid, nbytes, last_used FROM profile_vectors "
+            "UNION ALL SELECT 'meeting_rankings', rowid, nbytes, last_used FROM meeting_rankings ORDER BY last_used"
+        ).fetchall()
+        for table, rowid, nbytes, _ in rows:
+            if total <= self.max_bytes: break
+            conn.execute(f"DELETE FROM {table} WHERE rowid = ?", (rowid,))
+            total -= nbytes
+
+    # 到着プロファイル（direction は "out" = その駅から全駅へ, "in" = 全駅からその駅へ）
+    def get_profile(self, direction, station, max_transfers=4):
+        row = self._conn().execute(
+            "SELECT vector FROM profile_vectors WHERE fingerprint = ? AND direction = ? AND station = ? AND max_transfers = ?",
+            (self.fingerprint, direction, station, max_transfers)
+        ).fetchone()
+        if row is None: return None
+        self._touch("profile_vectors", "direction = ? AND station = ? AND max_transfers = ?", (direction, station, max_transfers))
+        return np.frombuffer(row[0], dtype=np.float32)
+
+    def put_profile(self, direction, station, vector, max_transfers=4):
+        blob = np.ascontiguousarray(vector, dtype=np.float32).tobytes()
+        with self._conn() as conn:
+            conn.execute("INSERT OR REPLACE INTO profile_vectors VALUES (?, ?, ?, ?, ?, ?, ?)",
+                         (self.fingerprint, direction, station, max_transfers, blob, len(blob), time.time()))
+            self._evict(conn)
+
+    # 集合場所ランキング（meeting.MeetingResult のうち details 以外）
+    def get_ranking(self, key):
+        row = self._conn().execute("SELECT payload FROM meeting_rankings WHERE fingerprint = ? AND key = ?",
+                                   (self.fingerprint, key)).fetchone()
+        if row is None: return None
+        self._touch("meeting_rankings", "key = ?", (key,))
+        return [meeting.MeetingResult(r["station"], r["total_time"], r["max_time"],
+                                      [tuple(t) for t in r["times"]] if r["times"] is not None else None)
+                for r in json.loads(row[0])]
+
+    def put_ranking(self, key, ranking):
+        payload = json.dumps([{"station": r.station, "total_time": r.total_time, "max_time": r.max_time,
+                               "times": r.times} for r in ranking], ensure_ascii=False)
+        with self._conn() as conn:
+            conn.execute("INSERT OR REPLACE INTO meeting_rankings VALUES (?, ?, ?, ?, ?)",
+                         (self.fingerprint, key, payload, len(payload.encode("utf-8")), time.time()))
+            self._evict(conn)
+
+    def hot_stations(self, limit=30):
+        """保存済みのクエリに出てくる回数が多い駅（ウォームアップ用）"""
+        counts = Counter()
+        for (key,) in self._conn().execute("SELECT key FROM meeting_rankings WHERE fingerprint = ?", (self.fingerprint,)):
+            for current, nxt in json.loads(key)["members"]:
+                counts[current] += 1
+                counts[nxt] += 1
+        # 座標（"@緯度,経度"）はウォームアップの対象にしない
+        return [s for s, _ in counts.most_common() if not s.startswith("@")][:limit]
+
+    def nbytes(self):
+        return self._conn().execute(
+            "SELECT (SELECT COALESCE(SUM(nbytes), 0) FROM profile_vectors)"
+            " + (SELECT COALESCE(SUM(nbytes), 0) FROM meeting_rankings)"
+        ).fetchone()[0]
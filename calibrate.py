@@ -0,0 +1,266 @@
+import argparse
+import sys
+import time
+import numpy as np
+import pandas as pd
+import data
+import edges
+import logic
+import matrix
+
+# --- LINE_CONFIG の自動調整 ---
+# 使い方: python calibrate.py trips.csv --out line_config.py --report report.txt
+# trips.csv は「出発駅, 到着駅, 実測の所要時間(分)」の3列（ヘッダー行あり、列名は --columns で変えられる）。
+#
+# RAPTOR Lite の所要時間は、経路を固定すると路線ごとの (1/時速, 運転間隔) について線形になる:
+#   所要時間 = Σ_路線 60 × 乗車距離 × (1/時速) + Σ_路線 0.5 × 途中の乗車回数 × 運転間隔 + 定数
+#   （定数 = 駅間ごとの 0.5 分 + 座標のない駅間の既定値 + 乗り換えごとの 2 分）
+# そこで今の設定で全駅間の経路を1回だけ調べて係数の行列を作り、実測値との重み付き最小二乗で解く。
+# 設定が変わると経路も変わりうるので、これを --iterations 回くり返す。
+# 実測データは (出発, 到着) の組ごとに件数・合計・二乗和へまとめてから解くので、何百万件でも行列は駅数² 以下。
+
+MIN_SPEED, MAX_SPEED = 10.0, 130.0
+MIN_INTERVAL, MAX_INTERVAL = 1, 30
+
+# --- 1. 実測データの読み込みと集計 ---
+def load_observations(path, columns=("origin", "destination", "minutes"), stations=None):
+    """
+    CSV を読み、駅番号の配列 (origins, destinations) と所要時間の配列を返す。
+    駅名は category 型で読むので、文字列の照合は駅の種類数ぶんしか行わない。
+    戻り値: (origins, destinations, minutes, dropped)  dropped は駅名が不明・所要時間が欠けていて捨てた件数
+    """
+    stations = logic.STATION_NAMES if stations is None else stations
+    index = {s: i for i, s in enumerate(stations)}
+    origin_col, dest_col, minutes_col = columns
+    df = pd.read_csv(path, usecols=list(columns), dtype={origin_col: "category", dest_col: "category"})
+    ids = []
+    for col in (origin_col, dest_col):
+        lookup = np.array([index.get(name.strip(), -1) for name in df[col].cat.categories] + [-1], dtype=np.intp)
+        ids.append(lookup[df[col].cat.codes.to_numpy()])  # 欠損 (code = -1) は最後の -1 を引く
+    minutes = pd.to_numeric(df[minutes_col], errors="coerce").to_numpy(dtype=np.float64)
+    keep = (ids[0] >= 0) & (ids[1] >= 0) & np.isfinite(minutes) & (ids[0] != ids[1])
+    return ids[0][keep], ids[1][keep], minutes[keep], int((~keep).sum())
+
+class Observations:
+    """(出発, 到着) の組 p = 出発 × 駅数 + 到着 ごとの 件数・合計・二乗和"""
+    def __init__(self, origins, destinations, minutes, n_stations):
+        self.n_stations = n_stations
+        pair = origins * n_stations + destinations
+        size = n_stations * n_stations
+        counts = np.bincount(pair, minlength=size)
+        self.pairs = np.flatnonzero(counts)
+        self.counts = counts[self.pairs].astype(np.float64)
+        self.sums = np.bincount(pair, weights=minutes, minlength=size)[self.pairs]
+        self.sumsq = np.bincount(pair, weights=minutes * minutes, minlength=size)[self.pairs]
+        self.n_records = len(minutes)
+
+    @property
+    def means(self):
+        return self.sums / self.counts
+
+    def squared_errors(self, predictions):
+        """組ごとの Σ(実測 - 予測)²（予測が inf の組は nan）"""
+        with np.errstate(invalid="ignore"):
+            return self.sumsq - 2 * predictions * self.sums + self.counts * predictions ** 2
+
+
+# --- 2. 経路を固定したときの係数の行列 ---
+def config_network(line_config):
+    """line_config で所要時間を計算した東京のネットワーク（駅の並びは logic.STATION_NAMES と同じ）"""
+    return logic.Network(data.TOKYO_LINES, line_config, data.STATION_LOCATIONS, name="calibration",
+                         stations=logic.STATION_NAMES)
+
+class Design:
+    """
+    観測のある組ごとの係数。distance[p, l] = 路線 l に乗る距離(km)、boards[p, l] = 路線 l に途中で乗る回数、
+    constant[p] = 設定によらない時間（分）、reachable[p] = 今の設定で経路があるか。
+    予測値 = 60 × distance @ (1/時速) + 0.5 × boards @ 間隔 + constant
+    """
+    def __init__(self, network, obs, max_transfers=4, model=edges.RAPTOR_MODEL):
+        n_lines = len(network.routes)
+        table = network.edge_table
+        hop_dist = table.distances(model.haversine)
+        # 路線ごとの始発駅からの累積距離と、座標のない駅間の累積数（環状線の両端区間は RAPTOR では使わない）
+        cum_dist, cum_unknown = [], []
+        for l_idx in range(n_lines):
+            start, end = table.line_offsets[l_idx], table.line_offsets[l_idx + 1]
+            d = hop_dist[start:end][~table.hop_ring[start:end]]
+            known = ~np.isnan(d)
+            cum_dist.append(np.concatenate(([0.0], np.cumsum(np.where(known, d * model.detour, 0.0)))).tolist())
+            cum_unknown.append([0] + np.cumsum(~known).tolist())
+
+        n = obs.n_stations
+        origins, dests = np.divmod(obs.pairs, n)
+        self.distance = np.zeros((len(obs.pairs), n_lines))
+        self.boards = np.zeros((len(obs.pairs), n_lines))
+        self.constant = np.zeros(len(obs.pairs))
+        self.reachable = np.zeros(len(obs.pairs), dtype=bool)
+        # 出発駅ごとに1回だけ探索し、その出発駅の組の行をまとめて埋める
+        order = np.argsort(origins, kind="stable")
+        bounds = np.flatnonzero(np.diff(origins[order])) + 1
+        for rows in np.split(order, bounds):
+            rides = logic.find_rides(network.station_names[origins[rows[0]]], max_transfers, network)
+            for p in rows:
+                legs = rides.get(int(dests[p]))
+                if legs is None: continue
+                self.reachable[p] = True
+                const = 2.0 * (len(legs) - 1)  # 乗り換えごとの待ち時間の定数部分
+                for j, (r_idx, b, a) in enumerate(legs):
+                    hops = abs(a - b)
+                    unknown = abs(cum_unknown[r_idx][a] - cum_unknown[r_idx][b])
+                    self.distance[p, r_idx] += abs(cum_dist[r_idx][a] - cum_dist[r_idx][b])
+                    const += model.stop_penalty * (hops - unknown) + model.default_hop * unknown
+                    # legs は到着駅側から並ぶので、最後の要素が出発駅での（待ち時間なしの）乗車
+                    if j < len(legs) - 1: self.boards[p, r_idx] += 1
+                self.constant[p] = const
+
+    def predict(self, speeds, intervals):
+        return 60.0 * self.distance @ (1.0 / speeds) + 0.5 * self.boards @ intervals + self.constant
+
+    def uses(self):
+        """uses[p, l] = 組 p の経路が路線 l に乗るか"""
+        return (self.distance > 0) | (self.boards > 0)
+
+
+# --- 3. 重み付き最小二乗 ---
+def fit(design, obs, speeds, intervals, min_records=30, ridge=1e-3):
+    """
+    組ごとの件数を重みにした最小二乗で (1/時速, 間隔) を解く。
+    その路線に乗る実測が min_records 件に満たない路線は今の値のまま固定する。
+    ridge は今の値からの相対的なずれへの罰則（データの少ない路線が極端な値に飛ばないように）。
+    戻り値: (新しい時速, 新しい間隔, 路線ごとの件数)
+    """
+    ok = design.reachable
+    w = obs.counts[ok]
+    support = w @ design.uses()[ok]
+    free = support >= min_records
+    theta0 = np.concatenate((1.0 / speeds, intervals))
+    A = np.hstack((60.0 * design.distance[ok], 0.5 * design.boards[ok]))
+    y = obs.means[ok] - design.constant[ok]
+    free_cols = np.concatenate((free, free))
+    # 固定する路線の分は右辺に移す
+    y = y - A[:, ~free_cols] @ theta0[~free_cols]
+    A = A[:, free_cols]
+    # 列を今の値で割って相対変化で解く（時速と間隔の桁の違いをならす）
+    scale = theta0[free_cols]
+    sw = np.sqrt(w)[:, None]
+    lhs = np.vstack((A * scale * sw, np.sqrt(ridge * w.sum()) * np.eye(A.shape[1])))
+    rhs = np.concatenate((y * sw[:, 0], np.sqrt(ridge * w.sum()) * np.ones(A.shape[1])))
+    rel, *_ = np.linalg.lstsq(lhs, rhs, rcond=None)
+    theta = theta0.copy()
+    theta[free_cols] = rel * scale
+    n = len(speeds)
+    with np.errstate(divide="ignore"):
+        new_speeds = np.clip(1.0 / theta[:n], MIN_SPEED, MAX_SPEED)
+    new_intervals = np.clip(theta[n:], MIN_INTERVAL, MAX_INTERVAL)
+    return np.where(free, new_speeds, speeds), np.where(free, new_intervals, intervals), support
+
+def calibrate(obs, line_config=None, iterations=2, max_transfers=4, min_records=30, ridge=1e-3, log=None):
+    """
+    line_config（省略時は data.LINE_CONFIG）から始めて、経路の固定 → 最小二乗 を iterations 回くり返す。
+    戻り値: (新しい LINE_CONFIG, 路線ごとの件数 {路線名: 件数})
+    """
+    config = {line: dict(conf) for line, conf in (line_config or data.LINE_CONFIG).items()}
+    lines = list(data.TOKYO_LINES)
+    for line in lines: config.setdefault(line, dict(edges.DEFAULT_CONF))
+    support = np.zeros(len(lines))
+    for it in range(iterations):
+        t0 = time.perf_counter()
+        design = Design(config_network(config), obs, max_transfers)
+        speeds = np.array([config[l]["speed_kmh"] for l in lines], dtype=np.float64)
+        intervals = np.array([config[l]["interval_min"] for l in lines], dtype=np.float64)
+        speeds, intervals, support = fit(design, obs, speeds, intervals, min_records, ridge)
+        for l, line in enumerate(lines):
+            config[line] = {"speed_kmh": round(float(speeds[l]), 1), "interval_min": int(round(intervals[l]))}
+        if log is not None:
+            print(f"  反復 {it + 1}: 経路の係数 {len(obs.pairs)} 組、{time.perf_counter() - t0:.2f} 秒", file=log)
+    return config, dict(zip(lines, support.tolist()))
+
+
+# --- 4. 出力と誤差レポート ---
+def format_config(config, before, support, min_records=30):
+    """data.py の LINE_CONFIG と同じ書き方（変更前後をコメントに残す）"""
+    rows = ["LINE_CONFIG = {"]
+    for line, conf in config.items():
+        old = before.get(line, edges.DEFAULT_CONF)
+        if support.get(line, 0) < min_records:
+            note = "(実測データなし、現在値を維持)"
+        else:
+            note = f"(現在 {old['speed_kmh']} → 変更 {conf['speed_kmh'] - old['speed_kmh']:+.1f}"
+            if conf["interval_min"] != old["interval_min"]:
+                note += f"、間隔 {old['interval_min']} → {conf['interval_min']}"
+            note += ")"
+        rows.append(f'    "{line}": {{"speed_kmh": {conf["speed_kmh"]}, "interval_min": {conf["interval_min"]}}},  # {note}')
+    rows.append("}")
+    return "\n".join(rows) + "\n"
+
+def error_report(obs, before, after, max_transfers=4, out=sys.stdout):
+    """
+    変更前後の設定で所要時間行列を作り（logic.find_arrival_times_batch の一括探索）、
+    全実測との誤差を全体と路線ごと（変更後の経路でその路線に乗る実測）に出す。
+    """
+    preds, stats = {}, {}
+    for label, config in (("変更前", before), ("変更後", after)):
+        times = matrix.build_time_matrix(max_transfers=max_transfers, network=config_network(config)).times
+        preds[label] = times.reshape(-1)[obs.pairs].astype(np.float64)
+    reachable = np.isfinite(preds["変更前"]) & np.isfinite(preds["変更後"])
+    uses = Design(config_network(after), obs, max_transfers).uses()
+
+    print(f"実測 {obs.n_records} 件 / 出発・到着の組 {len(obs.pairs)} 組"
+          f"（どちらかの設定で到達できない組 {int((~reachable).sum())} 組は除外）", file=out)
+    print(f"{'':<8}{'RMSE':>8}{'MAE':>8}{'偏り':>8}", file=out)
+    for label, pred in preds.items():
+        c, s = obs.counts[reachable], obs.sums[reachable]
+        sq = obs.squared_errors(pred)[reachable]
+        # MAE は組ごとの平均との差で近似（同じ組の実測のばらつきは含まない）
+        mae = np.sum(c * np.abs(s / c - pred[reachable])) / c.sum()
+        bias = np.sum(pred[reachable] * c - s) / c.sum()
+        stats[label] = sq
+        print(f"{label:<8}{np.sqrt(sq.sum() / c.sum()):>8.2f}{mae:>8.2f}{bias:>+8.2f}", file=out)
+
+    print(f"\n{'路線':<16}{'件数':>10}{'RMSE 変更前':>12}{'RMSE 変更後':>12}  設定", file=out)
+    c = obs.counts[reachable]
+    u = uses[reachable]
+    line_counts = c @ u
+    for l, line in enumerate(data.TOKYO_LINES):
+        if line_counts[l] == 0: continue
+        rmse = {label: np.sqrt(sq @ u[:, l] / line_counts[l]) for label, sq in stats.items()}
+        b, a = before.get(line, edges.DEFAULT_CONF), after[line]
+        print(f"{line:<16}{int(line_counts[l]):>10}{rmse['変更前']:>12.2f}{rmse['変更後']:>12.2f}"
+              f"  {b['speed_kmh']}km/h {b['interval_min']}分 → {a['speed_kmh']}km/h {a['interval_min']}分", file=out)
+
+def main():
+    parser = argparse.ArgumentParser(description="実測の所要時間から LINE_CONFIG の時速・運転間隔を合わせる")
+    parser.add_argument("csv", help="出発駅, 到着駅, 所要時間(分) の CSV")
+    parser.add_argument("--columns", default="origin,destination,minutes", help="CSV の列名（カンマ区切りで3つ）")
+    parser.add_argument("--iterations", type=int, default=2, help="経路の固定 → 最小二乗 のくり返し回数")
+    parser.add_argument("--min-records", type=int, default=30, help="これより実測の少ない路線は今の値のまま")
+    parser.add_argument("--ridge", type=float, default=1e-3, help="今の値からの相対的なずれへの罰則")
+    parser.add_argument("--max-transfers", type=int, default=4)
+    parser.add_argument("--out", help="新しい LINE_CONFIG の書き出し先（省略時は標準出力）")
+    parser.add_argument("--report", help="誤差レポートの書き出し先（省略時は標準出力）")
+    args = parser.parse_args()
+
+    t0 = time.perf_counter()
+    origins, dests, minutes, dropped = load_observations(args.csv, tuple(args.columns.split(",")))
+    obs = Observations(origins, dests, minutes, len(logic.STATION_NAMES))
+    print(f"読み込み: {obs.n_records} 件（駅名不明・欠損で除外 {dropped} 件）{time.perf_counter() - t0:.2f} 秒",
+          file=sys.stderr)
+
+    config, support = calibrate(obs, iterations=args.iterations, max_transfers=args.max_transfers,
+                                min_records=args.min_records, ridge=args.ridge, log=sys.stderr)
+    text = format_config(config, data.LINE_CONFIG, support, args.min_records)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f: f.write(text)
+    else:
+        print(text)
+
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            error_report(obs, data.LINE_CONFIG, config, args.max_transfers, out=f)
+    else:
+        error_report(obs, data.LINE_CONFIG, config, args.max_transfers)
+    print(f"合計 {time.perf_counter() - t0:.2f} 秒", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+import numpy as np
+import logic
+
+# --- 駅のエリア分け（クラスタ）とエリア間の所要時間の下界 ---
+# 駅の座標を k-means でエリアに分け、エリア a のどこかからエリア b のどこかまでの最短所要時間
+# lower[a, b] を持つ。エリアごとに「エリア内の全駅から同時に出発する」多始点 RAPTOR を1回ずつ回すだけなので
+# （logic.find_arrival_times_multi）、全駅間の行列を作らずにエリア数 × 駅数の探索で済む。
+# 運休・遅延は所要時間を長くするだけなので、平常時のネットワークで作った下界は運行障害中も下界のまま正しい。
+
+def kmeans(points, k, iterations=25, seed=0):
+    """
+    points (n, 2) を k 個に分ける（k-means++ で初期化して Lloyd 法）。戻り値: 各点のクラスタ番号。
+    """
+    rng = np.random.default_rng(seed)
+    n = len(points)
+    k = max(1, min(k, n))
+    centers = [points[rng.integers(n)]]
+    dist = np.sum((points - centers[0]) ** 2, axis=1)
+    for _ in range(k - 1):
+        # 遠い点ほど選ばれやすく（k-means++）
+        centers.append(points[rng.choice(n, p=dist / dist.sum())] if dist.sum() > 0 else points[rng.integers(n)])
+        dist = np.minimum(dist, np.sum((points - centers[-1]) ** 2, axis=1))
+    centers = np.array(centers)
+    labels = np.zeros(n, dtype=np.intp)
+    sq = np.sum(points ** 2, axis=1)[:, None]
+    for it in range(iterations):
+        # |p - c|^2 = |p|^2 - 2 p・c + |c|^2（(n, k, 2) の一時配列を作らない）
+        d = sq - 2.0 * points @ centers.T + np.sum(centers ** 2, axis=1)[None, :]
+        new_labels = d.argmin(axis=1)
+        if it > 0 and np.array_equal(new_labels, labels): break
+        labels = new_labels
+        for c in range(k):
+            mine = points[labels == c]
+            if len(mine): centers[c] = mine.mean(axis=0)
+    # 空のクラスタを詰める
+    _, labels = np.unique(labels, return_inverse=True)
+    return labels
+
+class ClusterIndex:
+    """
+    stations        : 駅名（network.station_names の順）
+    cluster_of[s]   : 駅 s のエリア番号（座標のない駅はそれぞれ1駅だけのエリア）
+    members[c]      : エリア c の駅名のリスト
+    lower[a, b]     : エリア a の駅からエリア b の駅への所要時間の最小値（分, float32）。a == b なら 0
+    n_clusters を省略すると √駅数 個（エリアの数と1エリアの駅数がつり合う）。
+    """
+    def __init__(self, network=None, n_clusters=None, max_transfers=4, seed=0):
+        net = network or logic.DEFAULT_NETWORK
+        self.network = net
+        self.stations = net.station_names
+        self.index = net.station_index
+        self.max_transfers = max_transfers
+        located = [s for s, name in enumerate(self.stations) if name in net.locations]
+        points = np.array([[net.locations[self.stations[s]][0] * 111.0, net.locations[self.stations[s]][1] * 91.0]
+                           for s in located])  # logic.calculate_distance_km と同じ km 換算
+        self._located = np.array(located, dtype=np.intp)
+        self._points = points.reshape(-1, 2)
+        k = n_clusters or int(round(np.sqrt(len(located))))
+        self.cluster_of = np.full(len(self.stations), -1, dtype=np.intp)
+        if located: self.cluster_of[located] = kmeans(points, k, seed=seed)
+        unlocated = np.flatnonzero(self.cluster_of < 0)
+        n = int(self.cluster_of.max(initial=-1)) + 1
+        self.cluster_of[unlocated] = np.arange(n, n + len(unlocated))
+        self.n_clusters = n + len(unlocated)
+        self.members = [[] for _ in range(self.n_clusters)]
+        for s, c in enumerate(self.cluster_of): self.members[c].append(self.stations[s])
+
+        # lower[a, b]: エリア a から出る多始点探索の結果を、着いた駅のエリアごとに最小にまとめる
+        order = np.argsort(self.cluster_of, kind="stable")
+        starts = np.searchsorted(self.cluster_of[order], np.arange(self.n_clusters))
+        self.lower = np.empty((self.n_clusters, self.n_clusters), dtype=np.float32)
+        for a in range(self.n_clusters):
+            times = logic.find_arrival_times_multi(self.members[a], max_transfers, net)
+            self.lower[a] = np.minimum.reduceat(times[order], starts)
+
+    @property
+    def nbytes(self):
+        return self.lower.nbytes + self.cluster_of.nbytes
+
+    def _entries(self, place):
+        """[(エリア番号, そのエリアの駅まで歩く分), ...]（駅なら [(エリア, 0)]、座標なら近くの駅のエリア）"""
+        entries = {}
+        for s_id, walk in logic.access_seeds(place, self.network).items():
+            c = int(self.cluster_of[s_id])
+            if walk < entries.get(c, np.inf): entries[c] = walk
+        return list(entries.items())
+
+    def _direct_walks(self, place):
+        """
+        座標から歩くだけで行けるエリア: (n_clusters,) の歩く分の最小値（なければ inf）。
+        access_seeds は近い駅を ACCESS_LIMIT 駅までしか使わないので、それより遠い駅へ直接歩く
+        経路（logic.direct_walk）の分も下界に入れておく。
+        """
+        bound = np.full(self.n_clusters, np.inf, dtype=np.float32)
+        if not logic.is_coordinate(place) or not len(self._located): return bound
+        d = np.hypot(self._points[:, 0] - place[0] * 111.0, self._points[:, 1] - place[1] * 91.0)
+        near = d <= logic.ACCESS_MAX_KM
+        np.minimum.at(bound, self.cluster_of[self._located[near]], logic.walk_minutes(d[near]))
+        return bound
+
+    def outward_bounds(self, origin):
+        """origin から各エリアの駅までの所要時間の下界 (n_clusters,)"""
+        bound = self._direct_walks(origin)
+        for c, walk in self._entries(origin): np.minimum(bound, self.lower[c] + walk, out=bound)
+        return bound
+
+    def inward_bounds(self, dest):
+        """各エリアの駅から dest までの所要時間の下界 (n_clusters,)"""
+        bound = self._direct_walks(dest)
+        for c, walk in self._entries(dest): np.minimum(bound, self.lower[:, c] + walk, out=bound)
+        return bound
@@ -0,0 +1,203 @@
+import threading
+import time
+import weakref
+import numpy as np
+import logic
+import matrix
+
+# --- 運行障害（運休・遅延）の反映 ---
+# 例: 東西線 東陽町〜西船橋 が運休
+#   manager = DisruptionManager()
+#   manager.close("東西線", "東陽町", "西船橋")
+# 1. その場で「障害を反映したネットワーク」を作って manager.network に持つ（平常時のネットワークと駅の並びは同じ）。
+#    logic のグローバルは書き換えないので、障害を反映したい探索は network=manager.network を渡す
+# 2. 所要時間行列はバックグラウンドで manager.network から作り直して差し替え、プロファイル置き場は捨て直す
+#    （一括 RAPTOR で全駅の行列を作り直しても数十ミリ秒なので、影響のある行だけを探す索引は持たない）
+
+class Disruption:
+    """
+    1つの路線の区間 start〜end の運行障害。closed=True なら運休、False なら delay 分の遅れ
+    （区間全体を通して delay 分。区間の一部だけ乗る場合は駅間の数で按分する）。
+    hops は平常時の路線での区間の番号（i 番目と i+1 番目の駅の間が i）。
+    """
+    __slots__ = ("line", "start", "end", "closed", "delay", "route", "hops")
+
+    def __init__(self, line, start, end, closed=True, delay=0.0, network=None):
+        net = network or logic.DEFAULT_NETWORK
+        self.line = line
+        self.start = start
+        self.end = end
+        self.closed = closed
+        self.delay = delay
+        self.route = next((r for r, route in enumerate(net.routes) if route.line_name == line), None)
+        if self.route is None:
+            raise ValueError(f"路線がありません: {line}")
+        stations = net.routes[self.route].stations
+        pairs = [(i, j) for i, a in enumerate(stations) if a == start for j, b in enumerate(stations) if b == end]
+        if not pairs or start == end:
+            raise ValueError(f"{line} に {start}〜{end} の区間がありません")
+        # 同じ駅を2回通る路線では、いちばん短い区間を選ぶ
+        i, j = min(pairs, key=lambda p: abs(p[0] - p[1]))
+        self.hops = range(min(i, j), max(i, j))
+
+    def describe(self):
+        return f"{self.line} {self.start}〜{self.end} " + ("運休" if self.closed else f"{self.delay:g}分遅れ")
+
+def disrupted_network(base, disruptions):
+    """
+    base に運行障害を反映したネットワーク。運休区間で路線を区切り（2駅以上残る部分だけ路線として残す）、
+    遅延区間は駅間の所要時間に足す。駅の並び（駅番号）は base と同じ。
+    """
+    if not disruptions: return base
+    routes = []
+    for r_idx, route in enumerate(base.routes):
+        mine = [d for d in disruptions if d.route == r_idx]
+        if not mine:
+            routes.append(route)
+            continue
+        hop_times = np.diff(route.cum_times)
+        open_hop = np.ones(len(hop_times), dtype=bool)
+        for d in mine:
+            if d.closed: open_hop[d.hops.start:d.hops.stop] = False
+            else: hop_times[d.hops.start:d.hops.stop] += d.delay / len(d.hops)
+        conf = {"speed_kmh": route.speed_kmh, "interval_min": route.interval}
+        # 開いている区間が続く部分ごとに1本の路線にする
+        start = 0
+        for stop in list(np.flatnonzero(~open_hop)) + [len(hop_times)]:
+            if stop > start:
+                cum = np.concatenate(([0.0], np.cumsum(hop_times[start:stop])))
+                routes.append(logic.Route(route.line_name, route.stations[start:stop + 1], conf, cum.tolist()))
+            start = stop + 1
+    name = base.name + " (運行障害 " + ", ".join(d.describe() for d in disruptions) + ")"
+    return logic.Network(base.lines, base.line_config, base.locations, name=name, table=base.edge_table,
+                         routes=routes, stations=base.station_names)
+
+
+# --- 2. 障害の登録とバックグラウンドでの反映 ---
+class DisruptionManager:
+    """
+    運行障害の一覧を持ち、変わるたびに network（障害を反映したネットワーク）を作り直して、
+    登録された所要時間行列 (track) とプロファイル置き場 (track_profiles) をバックグラウンドで作り直す。
+    version は行列の書き換えが終わるたびに増える（到達圏など、行列から作ったものを作り直す目印）。
+    """
+    def __init__(self, base=None, max_transfers=4):
+        self.base = base or logic.DEFAULT_NETWORK
+        self.max_transfers = max_transfers
+        self.network = self.base
+        self.version = 0
+        self.stage = "待機中"
+        self.error = None
+        self.elapsed = None
+        self._disruptions = []
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._idle = threading.Event()
+        self._idle.set()
+        self._matrices = weakref.WeakSet()
+        self._stores = weakref.WeakSet()
+        self._thread = None
+
+    @property
+    def active(self):
+        return tuple(self._disruptions)
+
+    @property
+    def ready(self):
+        """行列・プロファイルまで今の障害を反映し終わっているか（探索そのものは登録した時点で反映済み）"""
+        return self._idle.is_set()
+
+    def close(self, line, start, end):
+        """区間を運休にする"""
+        return self._add(Disruption(line, start, end, closed=True, network=self.base))
+
+    def delay(self, line, start, end, minutes):
+        """区間の所要時間を minutes 分延ばす"""
+        return self._add(Disruption(line, start, end, closed=False, delay=float(minutes), network=self.base))
+
+    def clear(self, disruption=None):
+        """障害を解除する（省略すると全部）"""
+        with self._lock:
+            self._disruptions = [] if disruption is None else [d for d in self._disruptions if d is not disruption]
+        self._changed()
+
+    def _add(self, disruption):
+        with self._lock:
+            self._disruptions.append(disruption)
+        self._changed()
+        return disruption
+
+    def _changed(self):
+        with self._lock:
+            # 探索は network=self.network を渡した呼び出しから反映される
+            self.network = disrupted_network(self.base, self._disruptions)
+            self._generation += 1
+            self._idle.clear()
+        self._start()
+        self._wake.set()
+
+    def track(self, time_matrix):
+        """所要時間行列を障害に合わせて更新する対象にする（何度呼んでもよい）"""
+        with self._lock:
+            if time_matrix in self._matrices: return time_matrix
+            self._matrices.add(time_matrix)
+            if self._disruptions: self._idle.clear()
+        if self._disruptions:
+            self._start()
+            self._wake.set()
+        return time_matrix
+
+    def track_profiles(self, store):
+        """meeting.ProfileStore を障害に合わせて捨て直す対象にする"""
+        self._stores.add(store)
+        if self._disruptions:
+            self._start()
+            self._wake.set()
+        return store
+
+    def join(self, timeout=None):
+        """行列の作り直しが終わるまで待つ"""
+        return self._idle.wait(timeout)
+
+    def _start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="hub-finder-disruption", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wake.wait()
+            self._wake.clear()
+            with self._lock:
+                generation = self._generation
+                network = self.network
+                disruptions = list(self._disruptions)
+            started = time.perf_counter()
+            try:
+                done = self._refresh(generation, network, disruptions)
+            except Exception as e:  # 反映に失敗しても探索は止めない（行列が平常時の値のままになるだけ）
+                self.error = e
+                self.stage = "失敗"
+                done = True
+            with self._lock:
+                if done and generation == self._generation:
+                    self.elapsed = time.perf_counter() - started
+                    self._idle.set()
+
+    def _refresh(self, generation, network, disruptions):
+        """行列を今のネットワークで作り直して差し替える。途中で障害が変わったら False を返す（次の周回でやり直す）"""
+        stations = network.station_names
+        # 障害中はディスクにある平常時のプロファイルを使わない（解除したら空に戻す）
+        bypass = [(d, s) for d in ("out", "in") for s in stations] if disruptions else []
+        for store in list(self._stores):
+            store.invalidate(stations, stations, bypass_disk=bypass, network=network)
+
+        for time_matrix in list(self._matrices):
+            if generation != self._generation: return False
+            self.stage = "所要時間行列"
+            values = matrix.build_time_matrix(time_matrix.stations, self.max_transfers, network=network).times
+            if generation != self._generation: return False
+            time_matrix.replace_rows(list(range(len(time_matrix.stations))), values)
+        self.version += 1
+        self.stage = "完了"
+        return True
@@ -0,0 +1,143 @@
+import numpy as np
+import data
+
+# --- 1. 所要時間のモデル ---
+# 距離 → 所要時間の換算式。RAPTOR と最短経路グラフは昔から係数が違うので、
+# それぞれの既定値をそのまま残し（結果を変えない）、同じ表から計算する。
+class CostModel:
+    """
+    駅間の所要時間(分) = max(距離 * detour / 時速 * 60 + stop_penalty, min_hop)
+    座標のない区間は default_hop、徒歩は walk_speed_kmh で max_walk_km 以内の駅どうしだけ。
+    haversine=True なら距離を大円距離で計算する（既定は緯度1度=111km, 経度1度=91km の平面近似）。
+    """
+    __slots__ = ("detour", "stop_penalty", "min_hop", "default_hop", "walk_speed_kmh", "max_walk_km",
+                 "ring_lines", "haversine")
+
+    def __init__(self, detour=1.0, stop_penalty=0.5, min_hop=0.5, default_hop=2.0,
+                 walk_speed_kmh=4.0, max_walk_km=0.8, ring_lines=(), haversine=False):
+        self.detour = detour
+        self.stop_penalty = stop_penalty
+        self.min_hop = min_hop
+        self.default_hop = default_hop
+        self.walk_speed_kmh = walk_speed_kmh
+        self.max_walk_km = max_walk_km
+        self.ring_lines = tuple(ring_lines)
+        self.haversine = haversine
+
+    def key(self):
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+# logic.py (RAPTOR) の係数
+RAPTOR_MODEL = CostModel()
+# graph.py (ダイクストラ / ALT) の係数: 線路の曲がりを 1.2 倍で見込み、環状線は両端もつなぐ
+GRAPH_MODEL = CostModel(detour=1.2, stop_penalty=1.0, min_hop=1.0, default_hop=3.0,
+                        ring_lines=("JR山手線", "都営大江戸線"))
+
+DEFAULT_CONF = {"speed_kmh": 40.0, "interval_min": 8}
+EARTH_RADIUS_KM = 6371.0
+
+
+# --- 2. 距離の一括計算 ---
+def planar_distance_km(lat1, lon1, lat2, lon2):
+    """logic / graph の calculate_distance_km と同じ平面近似（配列でもスカラーでも可）"""
+    dy = (lat1 - lat2) * 111.0
+    dx = (lon1 - lon2) * 91.0
+    return np.sqrt(dx**2 + dy**2)
+
+def haversine_distance_km(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = (np.radians(v) for v in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+
+
+# --- 3. 駅間の所要時間表 ---
+class EdgeTable:
+    """
+    全路線の隣接駅区間（環状線の両端を含む）を1本の配列に並べ、距離と所要時間を NumPy で一度に計算する。
+    hop_src[e], hop_dst[e]: 区間 e の両端の駅番号（stations の添字）
+    line_offsets[l]:line_offsets[l+1] が路線 l の区間（駅の並び順、環状線の両端区間は最後）
+    所要時間はモデルごとに1回だけ計算して持っておく（クエリのたびに計算し直さない）。
+    """
+    def __init__(self, lines=None, locations=None, line_config=None):
+        self.lines = data.TOKYO_LINES if lines is None else lines
+        locations = data.STATION_LOCATIONS if locations is None else locations
+        line_config = data.LINE_CONFIG if line_config is None else line_config
+
+        self.line_names = list(self.lines)
+        self.stations = list(dict.fromkeys(s for stations in self.lines.values() for s in stations))
+        self.index = {s: i for i, s in enumerate(self.stations)}
+        self.lat = np.array([locations[s][0] if s in locations else np.nan for s in self.stations])
+        self.lon = np.array([locations[s][1] if s in locations else np.nan for s in self.stations])
+
+        src, dst, line_of, ring = [], [], [], []
+        self.line_offsets = [0]
+        for l_idx, (line_name, stations) in enumerate(self.lines.items()):
+            ids = [self.index[s] for s in stations]
+            src += ids[:-1]
+            dst += ids[1:]
+            ring += [False] * (len(ids) - 1)
+            if len(ids) > 2:
+                # 環状線の両端区間（使うかどうかはモデルの ring_lines で決める）
+                src.append(ids[-1])
+                dst.append(ids[0])
+                ring.append(True)
+            line_of += [l_idx] * (len(src) - len(line_of))
+            self.line_offsets.append(len(src))
+        self.hop_src = np.array(src, dtype=np.intp)
+        self.hop_dst = np.array(dst, dtype=np.intp)
+        self.hop_line = np.array(line_of, dtype=np.intp)
+        self.hop_ring = np.array(ring, dtype=bool)
+        self.line_speed = np.array([line_config.get(l, DEFAULT_CONF)["speed_kmh"] for l in self.line_names])
+
+        self._distances = {}
+        self._hop_times = {}
+        self._walks = {}
+
+    def distances(self, haversine=False):
+        """全区間の距離(km)。座標のない区間は nan"""
+        if haversine not in self._distances:
+            f = haversine_distance_km if haversine else planar_distance_km
+            self._distances[haversine] = f(self.lat[self.hop_src], self.lon[self.hop_src],
+                                           self.lat[self.hop_dst], self.lon[self.hop_dst])
+        return self._distances[haversine]
+
+    def hop_times(self, model):
+        """全区間の所要時間(分)"""
+        key = model.key()
+        if key not in self._hop_times:
+            dist = self.distances(model.haversine)
+            t = (dist * model.detour / self.line_speed[self.hop_line]) * 60 + model.stop_penalty
+            t = np.where(np.isnan(dist), model.default_hop, np.maximum(t, model.min_hop))
+            self._hop_times[key] = t
+        return self._hop_times[key]
+
+    def cumulative_times(self, line_name, model):
+        """路線の始発駅からの累積所要時間（環状線の両端区間は含まない）。駅 a→b の所要時間は |cum[b] - cum[a]|"""
+        l_idx = self.line_names.index(line_name)
+        start, end = self.line_offsets[l_idx], self.line_offsets[l_idx + 1]
+        hops = self.hop_times(model)[start:end][~self.hop_ring[start:end]]
+        return np.concatenate(([0.0], np.cumsum(hops)))
+
+    def walk_edges(self, model):
+        """
+        徒歩でつなぐ駅の組 (src, dst, 所要時間)。全駅の組の距離を1回の配列計算で求め、
+        0 < 距離 <= max_walk_km の組だけ返す（src < dst の向きだけ）。
+        """
+        key = model.key()
+        if key not in self._walks:
+            f = haversine_distance_km if model.haversine else planar_distance_km
+            dist = f(self.lat[:, None], self.lon[:, None], self.lat[None, :], self.lon[None, :])
+            with np.errstate(invalid="ignore"):
+                close = np.triu((dist <= model.max_walk_km) & (dist > 0), k=1)
+            i, j = np.nonzero(close)
+            self._walks[key] = (i, j, dist[i, j] / model.walk_speed_kmh * 60)
+        return self._walks[key]
+
+_SHARED = None
+
+def shared_table():
+    """プロセスで1つだけの表（logic と graph が同じものを使う）"""
+    global _SHARED
+    if _SHARED is None:
+        _SHARED = EdgeTable()
+    return _SHARED
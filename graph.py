@@ -0,0 +1,286 @@
+import heapq
+import itertools
+import math
+import numpy as np
+import data
+import edges
+
+# --- 1. 計算ヘルパー関数 ---
+def calculate_distance_km(lat1, lon1, lat2, lon2):
+    km_per_lat = 111.0
+    km_per_lon = 91.0
+    dy = (lat1 - lat2) * km_per_lat
+    dx = (lon1 - lon2) * km_per_lon
+    return math.sqrt(dx**2 + dy**2)
+
+def calculate_walking_time(dist_km):
+    speed_kmh = 4.0
+    return (dist_km / speed_kmh) * 60
+
+def get_connecting_line_name(station1, station2):
+    if station1 == station2: return "移動なし"
+    for line_name, stations in data.TOKYO_LINES.items():
+        if station1 in stations and station2 in stations:
+            idx1 = stations.index(station1)
+            idx2 = stations.index(station2)
+            if abs(idx1 - idx2) == 1: return line_name
+            if line_name in ["JR山手線", "都営大江戸線"]:
+                if (idx1 == 0 and idx2 == len(stations)-1) or \
+                   (idx1 == len(stations)-1 and idx2 == 0):
+                    return line_name
+    return "徒歩"
+
+# --- 2. グラフ構築 ---
+def build_graph(model=None):
+    """
+    edges の共通の所要時間表から隣接リストを作る（区間・環状線の両端・徒歩をまとめて配列計算済み）。
+    model を省略すると従来どおりの係数（edges.GRAPH_MODEL）。
+    """
+    model = edges.GRAPH_MODEL if model is None else model
+    table = edges.shared_table()
+    names = table.stations
+    graph = {s: {} for s in names}
+
+    # (A) 電車: 同じ駅の組を複数の路線が結ぶときは速いほう
+    use = ~table.hop_ring | np.isin(table.hop_line, [table.line_names.index(l) for l in model.ring_lines
+                                                     if l in table.line_names])
+    times = table.hop_times(model)
+    for u, v, t in zip(table.hop_src[use].tolist(), table.hop_dst[use].tolist(), times[use].tolist()):
+        a, b = names[u], names[v]
+        if t < graph[a].get(b, float('inf')):
+            graph[a][b] = t
+            graph[b][a] = t
+
+    # (B) 徒歩ルート: 電車より速いときだけ上書き
+    for u, v, walk_time in zip(*(x.tolist() for x in table.walk_edges(model))):
+        a, b = names[u], names[v]
+        if walk_time < graph[a].get(b, float('inf')):
+            graph[a][b] = walk_time
+            graph[b][a] = walk_time
+    return graph
+
+# --- 3. ダイクストラ法 ---
+def get_shortest_path(graph, start_node, end_node):
+    if start_node == end_node: return 0, [start_node]
+    
+    # 優先度付きキュー: (経過時間, 現在地, 経路リスト, 直前の路線名)
+    queue = [(0, start_node, [start_node], None)]
+    
+    # 訪問済み記録: (ノード, 到着した路線) -> 最短時間
+    visited = {}
+    
+    # デフォルト設定（データがない路線用）
+    DEFAULT_CONF = {"speed_kmh": 40.0, "interval_min": 8}
+
+    while queue:
+        cost, current_node, path, prev_line = heapq.heappop(queue)
+        
+        if current_node == end_node: return cost, path
+        
+        state_key = (current_node, prev_line)
+        if state_key in visited and visited[state_key] <= cost:
+            continue
+        visited[state_key] = cost
+
+        if current_node in graph:
+            for neighbor, weight in graph[current_node].items():
+                next_line = get_connecting_line_name(current_node, neighbor)
+                added_cost = 0
+                
+                # --- 乗り換えロジック (Level 2) ---
+                if prev_line is not None and next_line != prev_line:
+                    # 次に乗る路線のデータを取得
+                    conf = data.LINE_CONFIG.get(next_line, DEFAULT_CONF)
+                    interval = conf["interval_min"]
+                    
+                    # 待ち時間コスト = 平均待ち時間(間隔/2) + ホーム移動(2分)
+                    wait_cost = (interval / 2.0) + 2.0
+                    
+                    # 1. 電車同士の乗り換え
+                    if prev_line != "徒歩" and next_line != "徒歩":
+                        added_cost = wait_cost
+                    
+                    # 2. 徒歩から電車への乗り換え
+                    elif prev_line == "徒歩" and next_line != "徒歩":
+                        added_cost = wait_cost
+                        
+                    # 3. 電車から徒歩へ（待ち時間なし）
+                    else:
+                        added_cost = 0
+                # -------------------------------
+                
+                new_cost = cost + weight + added_cost
+                heapq.heappush(queue, (new_cost, neighbor, path + [neighbor], next_line))
+
+    return float('inf'), []
+
+# --- 4. ALT (A*, Landmarks, Triangle inequality) 双方向探索 ---
+def _transfer_cost(prev_line, next_line):
+    """get_shortest_path と同じ乗り換えコスト（徒歩へ乗り換える時は待ちなし）"""
+    if prev_line is None or next_line == prev_line or next_line == "徒歩": return 0
+    conf = data.LINE_CONFIG.get(next_line, {"speed_kmh": 40.0, "interval_min": 8})
+    return (conf["interval_min"] / 2.0) + 2.0
+
+def _plain_distances(graph, source):
+    """乗り換えコストなしの最短距離（ランドマークからの下界に使う）"""
+    dist = {source: 0.0}
+    queue = [(0.0, source)]
+    while queue:
+        d, u = heapq.heappop(queue)
+        if d > dist[u]: continue
+        for v, w in graph[u].items():
+            if d + w < dist.get(v, float('inf')):
+                dist[v] = d + w
+                heapq.heappush(queue, (d + w, v))
+    return dist
+
+class LandmarkIndex:
+    """
+    ALT 用の前計算。STATION_LOCATIONS から互いに遠いランドマーク駅を選び、
+    各ランドマークから全駅への距離を持っておく。グラフは無向なので
+    |d(L, t) - d(L, v)| が v → t の下界になる（乗り換えコストは足されるだけなので下界のまま）。
+    """
+    def __init__(self, graph, num_landmarks=8):
+        self.graph = graph
+        # 各辺の路線名（get_connecting_line_name は全路線を走査するので探索中に呼ばない）
+        self.edge_line = {(u, v): get_connecting_line_name(u, v) for u in graph for v in graph[u]}
+
+        located = [s for s in graph if s in data.STATION_LOCATIONS]
+        lat = sum(data.STATION_LOCATIONS[s][0] for s in located) / len(located)
+        lon = sum(data.STATION_LOCATIONS[s][1] for s in located) / len(located)
+        # 1つ目は地理的に中心から一番遠い駅、2つ目以降は既存のランドマークから（グラフ上で）一番遠い駅
+        first = max(located, key=lambda s: calculate_distance_km(lat, lon, *data.STATION_LOCATIONS[s]))
+        self.landmarks = [first]
+        tables = [_plain_distances(graph, first)]
+        while len(self.landmarks) < min(num_landmarks, len(located)):
+            def nearest_landmark(s):
+                return min(t.get(s, float('inf')) for t in tables)
+            nxt = max((s for s in located if s not in self.landmarks and nearest_landmark(s) < float('inf')),
+                      key=nearest_landmark, default=None)
+            if nxt is None: break
+            self.landmarks.append(nxt)
+            tables.append(_plain_distances(graph, nxt))
+
+        # 駅 -> ランドマークごとの距離（到達不能は inf）
+        self.dist = {s: tuple(t.get(s, float('inf')) for t in tables) for s in graph}
+
+    def lower_bound(self, u, v):
+        """u から v までの所要時間の下界"""
+        best = 0.0
+        for du, dv in zip(self.dist[u], self.dist[v]):
+            if du == float('inf') and dv == float('inf'): continue
+            if du == float('inf') or dv == float('inf'): return float('inf')  # 別の連結成分
+            diff = abs(du - dv)
+            if diff > best: best = diff
+        return best
+
+def get_shortest_path_alt(graph, start_node, end_node, index=None, stats=None):
+    """
+    get_shortest_path と同じコスト（乗り換え待ち込み）の最短経路を、ランドマーク下界つきの
+    双方向 A* で求める。状態は get_shortest_path と同じ (駅, その駅に着いた路線)。
+    前向き・後ろ向きとも平均ポテンシャル (π_t - π_s)/2 を使うので、
+    「両側の先頭キーの和 >= 見つかった最良値」で打ち切っても最適性が保たれる。
+    stats (dict) を渡すと確定した状態数などを書き込む。
+    """
+    if start_node == end_node: return 0, [start_node]
+    if start_node not in graph or end_node not in graph: return float('inf'), []
+    if index is None: index = LandmarkIndex(graph)
+    edge_line = index.edge_line
+    INF = float('inf')
+
+    if index.lower_bound(start_node, end_node) == INF: return INF, []
+
+    potential_cache = {}
+    def potential(v):
+        # 前向き用のポテンシャル（後ろ向きは符号を反転して使う）
+        p = potential_cache.get(v)
+        if p is None:
+            p = (index.lower_bound(v, end_node) - index.lower_bound(start_node, v)) / 2.0
+            potential_cache[v] = p
+        return p
+
+    # 状態 (駅, 着いた路線) ごとの距離と親
+    dist_f = {(start_node, None): 0.0}
+    dist_b = {}
+    parent_f = {(start_node, None): None}
+    parent_b = {}
+    tie = itertools.count()  # 路線名 None と文字列を比較しないための順番
+    queue_f = [(potential(start_node), next(tie), start_node, None)]
+    queue_b = []
+    # 後ろ向きの初期状態: end_node に各路線で着いた状態（そこから先のコストは 0）
+    for u in graph[end_node]:
+        state = (end_node, edge_line[(u, end_node)])
+        if state not in dist_b:
+            dist_b[state] = 0.0
+            parent_b[state] = None
+            heapq.heappush(queue_b, (-potential(end_node), next(tie), end_node, state[1]))
+
+    # 各駅に着きうる路線（後ろ向きで「1つ前の状態」を列挙するのに使う）
+    def arriving_lines(u):
+        lines = {edge_line[(x, u)] for x in graph[u]}
+        if u == start_node: lines.add(None)
+        return lines
+
+    best = INF
+    meet = None
+    settled_f, settled_b = set(), set()
+
+    while queue_f and queue_b:
+        if queue_f[0][0] + queue_b[0][0] >= best: break
+
+        if queue_f[0][0] <= queue_b[0][0]:
+            _, _, v, line = heapq.heappop(queue_f)
+            state = (v, line)
+            if state in settled_f: continue
+            settled_f.add(state)
+            g = dist_f[state]
+            if state in dist_b and g + dist_b[state] < best:
+                best, meet = g + dist_b[state], state
+            for w, weight in graph[v].items():
+                next_line = edge_line[(v, w)]
+                nxt = (w, next_line)
+                cost = g + weight + _transfer_cost(line, next_line)
+                if cost < dist_f.get(nxt, INF):
+                    dist_f[nxt] = cost
+                    parent_f[nxt] = state
+                    heapq.heappush(queue_f, (cost + potential(w), next(tie), w, next_line))
+                    if nxt in dist_b and cost + dist_b[nxt] < best:
+                        best, meet = cost + dist_b[nxt], nxt
+        else:
+            _, _, v, line = heapq.heappop(queue_b)
+            state = (v, line)
+            if state in settled_b: continue
+            settled_b.add(state)
+            g = dist_b[state]
+            if state in dist_f and g + dist_f[state] < best:
+                best, meet = g + dist_f[state], state
+            # state = (v, line) に来る直前の状態は (u, 任意の路線)、u-v 間の路線は line
+            for u, weight in graph[v].items():
+                if edge_line[(u, v)] != line: continue
+                for prev_line in arriving_lines(u):
+                    prv = (u, prev_line)
+                    cost = g + weight + _transfer_cost(prev_line, line)
+                    if cost < dist_b.get(prv, INF):
+                        dist_b[prv] = cost
+                        parent_b[prv] = state
+                        heapq.heappush(queue_b, (cost - potential(u), next(tie), u, prev_line))
+                        if prv in dist_f and cost + dist_f[prv] < best:
+                            best, meet = cost + dist_f[prv], prv
+
+    if stats is not None:
+        stats["settled"] = len(settled_f) + len(settled_b)
+        stats["nodes"] = len({s for s, _ in settled_f} | {s for s, _ in settled_b})
+    if meet is None: return INF, []
+
+    # 経路の復元: 前半は parent_f、後半は parent_b を辿る
+    path = []
+    state = meet
+    while state is not None:
+        path.append(state[0])
+        state = parent_f[state]
+    path.reverse()
+    state = parent_b[meet]
+    while state is not None:
+        path.append(state[0])
+        state = parent_b[state]
+    return best, path
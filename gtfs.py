@@ -0,0 +1,135 @@
+import csv
+import io
+import zipfile
+from array import array
+from bisect import bisect_left
+from collections import defaultdict
+from datetime import date
+
+# --- 1. 時刻表データ構造 ---
+# 時刻はすべて「当日0時からの秒数」の整数で扱う（GTFSの 25:10:00 のような24時超えもそのまま）
+
+def parse_gtfs_time(value):
+    """'HH:MM:SS' を秒数に変換（空欄は None）"""
+    value = value.strip()
+    if not value: return None
+    h, m, s = value.split(":")
+    return int(h) * 3600 + int(m) * 60 + int(s)
+
+class TripPattern:
+    """同じ路線・同じ方向・同じ停車駅列を持つ列車の集まり"""
+    def __init__(self, route_id, line_name, direction_id, stations, trips):
+        self.route_id = route_id
+        self.line_name = line_name
+        self.direction_id = direction_id
+        self.stations = stations
+        # trips: [(trip_id, [(arr, dep), ...]), ...] を始発駅の発車時刻順に並べたもの
+        self.trip_ids = [t[0] for t in trips]
+        # 駅ごとの列（stop-major）で持つ: departures[駅idx][列車idx]
+        # 追い越しのないパターンなので、どの駅の列もソート済み → 二分探索できる
+        self.departures = [array("i", (t[1][i][1] for t in trips)) for i in range(len(stations))]
+        self.arrivals = [array("i", (t[1][i][0] for t in trips)) for i in range(len(stations))]
+
+    def earliest_trip(self, stop_idx, ready_time):
+        """ready_time 以降に stop_idx を発車する最初の列車の番号（なければ None）"""
+        col = self.departures[stop_idx]
+        j = bisect_left(col, ready_time)
+        return j if j < len(col) else None
+
+class Timetable:
+    def __init__(self, patterns, transfer_sec=120):
+        self.patterns = patterns
+        # 乗り換え時のホーム移動時間（既存モデルの +2分 に合わせる）
+        self.transfer_sec = transfer_sec
+        # 駅名 -> [(pattern_idx, stop_idx), ...]（logic.STATION_TO_ROUTES と同じ形）
+        self.station_to_patterns = {}
+        for p_idx, p in enumerate(patterns):
+            for s_idx, station in enumerate(p.stations):
+                self.station_to_patterns.setdefault(station, []).append((p_idx, s_idx))
+        # 駅名 <-> 通し番号（経路復元用の配列の添字）
+        self.station_names = list(self.station_to_patterns.keys())
+        self.station_index = {name: i for i, name in enumerate(self.station_names)}
+
+# --- 2. GTFS zip の読み込み ---
+def _read_csv(zf, name):
+    if name not in zf.namelist(): return []
+    with zf.open(name) as f:
+        return list(csv.DictReader(io.TextIOWrapper(f, encoding="utf-8-sig")))
+
+def _active_services(zf, service_date):
+    """calendar.txt / calendar_dates.txt から、指定日に運行する service_id を求める"""
+    weekday = ["monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday"][service_date.weekday()]
+    ymd = service_date.strftime("%Y%m%d")
+    active = set()
+    for row in _read_csv(zf, "calendar.txt"):
+        if row["start_date"] <= ymd <= row["end_date"] and row[weekday] == "1":
+            active.add(row["service_id"])
+    for row in _read_csv(zf, "calendar_dates.txt"):
+        if row["date"] != ymd: continue
+        if row["exception_type"] == "1": active.add(row["service_id"])
+        elif row["exception_type"] == "2": active.discard(row["service_id"])
+    return active
+
+def _split_fifo(trips):
+    """追い越しがあると列がソートされないので、追い越しのない組に分ける"""
+    groups = []
+    for trip in sorted(trips, key=lambda t: t[1][0][1]):
+        for g in groups:
+            last = g[-1][1]
+            if all(a[0] >= b[0] and a[1] >= b[1] for a, b in zip(trip[1], last)):
+                g.append(trip)
+                break
+        else:
+            groups.append([trip])
+    return groups
+
+def load_gtfs(path, service_date=None, transfer_sec=120):
+    """
+    ローカルの GTFS zip を読み込み、路線×方向×停車駅列ごとの時刻表（Timetable）を作る。
+    service_date (datetime.date) を指定するとその日に運行する列車だけを使う。
+    """
+    with zipfile.ZipFile(path) as zf:
+        stops = {row["stop_id"]: row for row in _read_csv(zf, "stops.txt")}
+        routes = {row["route_id"]: row for row in _read_csv(zf, "routes.txt")}
+        trips = {row["trip_id"]: row for row in _read_csv(zf, "trips.txt")}
+
+        if service_date is not None:
+            if isinstance(service_date, str):
+                service_date = date(int(service_date[:4]), int(service_date[4:6]), int(service_date[6:8]))
+            services = _active_services(zf, service_date)
+            trips = {tid: t for tid, t in trips.items() if t["service_id"] in services}
+
+        # のりば単位の stop は親駅の名前にまとめる（data.py と同じ「駅名」で扱うため）
+        def station_name(stop_id):
+            stop = stops[stop_id]
+            parent = stop.get("parent_station")
+            if parent and parent in stops: stop = stops[parent]
+            return stop["stop_name"]
+
+        stop_times = defaultdict(list)
+        for row in _read_csv(zf, "stop_times.txt"):
+            if row["trip_id"] not in trips: continue
+            arr = parse_gtfs_time(row["arrival_time"])
+            dep = parse_gtfs_time(row["departure_time"])
+            if arr is None and dep is None: continue  # 時刻未設定の通過駅
+            if arr is None: arr = dep
+            if dep is None: dep = arr
+            stop_times[row["trip_id"]].append((int(row["stop_sequence"]), station_name(row["stop_id"]), arr, dep))
+
+    # (route_id, direction_id, 停車駅列) ごとに列車をまとめる
+    grouped = defaultdict(list)
+    for trip_id, rows in stop_times.items():
+        if len(rows) < 2: continue
+        rows.sort()
+        trip = trips[trip_id]
+        key = (trip["route_id"], trip.get("direction_id", "0") or "0", tuple(r[1] for r in rows))
+        grouped[key].append((trip_id, [(r[2], r[3]) for r in rows]))
+
+    patterns = []
+    for (route_id, direction_id, stations), route_trips in grouped.items():
+        route = routes.get(route_id, {})
+        line_name = route.get("route_long_name") or route.get("route_short_name") or route_id
+        for group in _split_fifo(route_trips):
+            patterns.append(TripPattern(route_id, line_name, direction_id, list(stations), group))
+
+    return Timetable(patterns, transfer_sec=transfer_sec)
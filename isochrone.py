@@ -0,0 +1,74 @@
+import numpy as np
+import logic
+
+# --- 到達圏（アイソクロン）のビット集合 ---
+# 駅ごとに「b 分以内に行ける駅」「b 分以内に来られる駅」を時間帯 b ごとにビット列で持つ。
+# 1駅・1時間帯あたり ceil(駅数/8) バイトなので、全駅ぶんでも数百 KB。
+BANDS = (10, 20, 30, 45, 60)
+
+class IsochroneIndex:
+    """
+    所要時間行列 (matrix.TravelTimeMatrix) から作る到達圏の索引。
+    outward[i, b] = stations[i] から BANDS[b] 分以内に着く駅のビット列（np.packbits）
+    inward[i, b]  = BANDS[b] 分以内に stations[i] へ着ける駅のビット列
+    """
+    def __init__(self, time_matrix, bands=BANDS):
+        self.stations = time_matrix.stations
+        self.index = time_matrix.index
+        self.bands = tuple(sorted(bands))
+        times = time_matrix.times
+        self.outward = np.stack([np.packbits(times <= b, axis=1) for b in self.bands], axis=1)
+        self.inward = np.stack([np.packbits(times.T <= b, axis=1) for b in self.bands], axis=1)
+
+    @property
+    def nbytes(self):
+        return self.outward.nbytes + self.inward.nbytes
+
+    def band_for(self, minutes):
+        """minutes 以上で最小の時間帯の番号（最大の時間帯を超えるなら None = 絞り込めない）"""
+        for b, band in enumerate(self.bands):
+            if minutes <= band: return b
+        return None
+
+    def _bits(self, table, station, band):
+        if logic.is_coordinate(station):
+            # 座標から b 分以内に行ける駅は、歩いて使う駅のどれかから b 分以内に行ける（ビット列の OR で十分条件を外さない）
+            acc = np.zeros(table.shape[2], dtype=np.uint8)
+            names = logic.DEFAULT_NETWORK.station_names
+            for s_id in logic.access_seeds(station):
+                acc |= self._bits(table, names[s_id], band)
+            return acc
+        i = self.index.get(station)
+        if i is None: return np.zeros(table.shape[2], dtype=np.uint8)
+        return table[i, band]
+
+    def _unpack(self, bits):
+        return np.unpackbits(bits, count=len(self.stations)).astype(bool)
+
+    def isochrone(self, station, direction="out"):
+        """
+        画面用: {時間帯(分): [その時間帯で初めて入る駅, ...]}。
+        direction="out" は station から行ける駅、"in" は station へ来られる駅。
+        """
+        table = self.outward if direction == "out" else self.inward
+        result = {}
+        seen = np.zeros(len(self.stations), dtype=bool)
+        for b, band in enumerate(self.bands):
+            mask = self._unpack(self._bits(table, station, b))
+            result[band] = [self.stations[i] for i in np.flatnonzero(mask & ~seen)]
+            seen |= mask
+        return result
+
+    def candidates_within(self, members, max_minutes):
+        """
+        全員の往路・復路がそれぞれ max_minutes 以内に収まりうる候補の bool 配列。
+        往路+復路 <= max_minutes なら片道もそれ以下なので、max_minutes 以上の時間帯の
+        ビット列の AND は必要条件になる（正確な判定は呼び出し側が所要時間で行う）。
+        """
+        b = self.band_for(max_minutes)
+        if b is None: return np.ones(len(self.stations), dtype=bool)
+        acc = np.full(self.outward.shape[2], 0xFF, dtype=np.uint8)
+        for m in members:
+            acc &= self._bits(self.outward, m["current"], b)
+            acc &= self._bits(self.inward, m["next"], b)
+        return self._unpack(acc)
@@ -1,16 +1,95 @@
 import data
+import edges
 import math
+import numpy as np
+import threading
+import weakref
+from array import array
 from collections import defaultdict # 【追加】エラー防止用
 
 # --- 1. データ構造の最適化 (Report 3.1) ---
 class Route:
-    def __init__(self, line_name, stations):
+    __slots__ = ("line_name", "stations", "speed_kmh", "interval", "cum_times")
+
+    def __init__(self, line_name, stations, conf=None, cum_times=None):
         self.line_name = line_name
         self.stations = stations
         # 設定の取得（なければデフォルト）
-        conf = data.LINE_CONFIG.get(line_name, {"speed_kmh": 40.0, "interval_min": 8})
+        if conf is None:
+            conf = data.LINE_CONFIG.get(line_name, edges.DEFAULT_CONF)
         self.speed_kmh = conf["speed_kmh"]
         self.interval = conf["interval_min"]
+        # 始発駅からの累積所要時間（edges の共通の表から作る。座標計算はクエリ中にしない）
+        if cum_times is None:
+            cum_times = edges.shared_table().cumulative_times(line_name, edges.RAPTOR_MODEL).tolist()
+        self.cum_times = cum_times
+
+# 探索結果のレコード（クエリごとに大量に作るので __slots__ で小さくする）
+class PathSegment:
+    """経路の1区間（1回の乗車）。time / wait は分"""
+    __slots__ = ("line", "start", "end", "time", "wait")
+
+    def __init__(self, line, start, end, time, wait):
+        self.line = line
+        self.start = start
+        self.end = end
+        self.time = time
+        self.wait = wait
+
+class RouteResult:
+    """find_routes_raptor の結果1件。時刻表モードでは departure_time / arrival_time（秒）も持つ"""
+    __slots__ = ("transfers", "total_time", "path_details", "departure_time", "arrival_time")
+
+    def __init__(self, transfers, total_time, path_details, departure_time=None, arrival_time=None):
+        self.transfers = transfers
+        self.total_time = total_time
+        self.path_details = path_details
+        self.departure_time = departure_time
+        self.arrival_time = arrival_time
+
+class RouteParents:
+    """
+    経路復元用の情報。緩和のたびに dict を作らず、ラウンドごとに
+    (直前の乗車駅, 路線, 乗車位置, 降車位置) を駅番号で引く並列の int 配列で持つ。
+    stamp[k][s] == epoch のときだけ値が有効（epoch を進めれば全部未設定になるので、使い回しても O(駅数) の初期化が要らない）。
+    """
+    __slots__ = ("names", "routes", "epoch", "stamp", "prev_station", "route", "board_idx", "alight_idx")
+
+    def __init__(self, names, rounds, routes=None):
+        self.names = names
+        self.routes = routes
+        self.epoch = 1
+        empty = array("i", [-1]) * len(names)
+        self.stamp = [array("i", [0]) * len(names) for _ in range(rounds)]
+        self.prev_station = [array("i", empty) for _ in range(rounds)]
+        self.route = [array("i", empty) for _ in range(rounds)]
+        self.board_idx = [array("i", empty) for _ in range(rounds)]
+        self.alight_idx = [array("i", empty) for _ in range(rounds)]
+
+    def set(self, k, s, prev, route, board_idx, alight_idx):
+        self.stamp[k][s] = self.epoch
+        self.prev_station[k][s] = prev
+        self.route[k][s] = route
+        self.board_idx[k][s] = board_idx
+        self.alight_idx[k][s] = alight_idx
+
+    def has(self, k, s):
+        return self.stamp[k][s] == self.epoch
+
+    def clear(self, k, s):
+        self.stamp[k][s] = 0
+
+    def reset_stamps(self):
+        for stamps in self.stamp:
+            stamps[:] = array("i", [0]) * len(stamps)
+
+    def segment(self, k, s):
+        """ラウンド k で駅 s に着いた区間を PathSegment にする"""
+        route = self.routes[self.route[k][s]]
+        # 1ラウンド目の乗車は出発駅なので待ち時間なし
+        wait = 0 if k == 1 else (route.interval / 2.0) + 2.0
+        return PathSegment(route.line_name, self.names[self.prev_station[k][s]], self.names[s],
+                           calculate_travel_time(route, self.board_idx[k][s], self.alight_idx[k][s]), wait)
 
 def calculate_distance_km(lat1, lon1, lat2, lon2):
     dy = (lat1 - lat2) * 111.0
@@ -18,201 +97,943 @@ def calculate_distance_km(lat1, lon1, lat2, lon2):
     return math.sqrt(dx**2 + dy**2)
 
 def calculate_travel_time(route, start_idx, end_idx):
-    """2駅間の移動時間を座標から計算"""
-    total_time = 0.0
-    stations = route.stations
-    
-    # 駅間を1つずつ足し合わせる
-    step = 1 if end_idx > start_idx else -1
-    for i in range(start_idx, end_idx, step):
-        s1 = stations[i]
-        s2 = stations[i + step]
-        
-        # デフォルト所要時間（座標がない場合の保険）
-        t = 2.0 
-        
-        if s1 in data.STATION_LOCATIONS and s2 in data.STATION_LOCATIONS:
-            loc1 = data.STATION_LOCATIONS[s1]
-            loc2 = data.STATION_LOCATIONS[s2]
-            dist = calculate_distance_km(loc1[0], loc1[1], loc2[0], loc2[1])
-            # 【修正済み】時間 = (距離 / 時速)*60 + 停車ロス(0.5分)
-            t = (dist / route.speed_kmh) * 60 + 0.5
-            
-        total_time += max(t, 0.5)
-    return total_time
-
-# データを「路線オブジェクト」のリストに変換
-ALL_ROUTES = []
-for line, stations in data.TOKYO_LINES.items():
-    ALL_ROUTES.append(Route(line, stations))
-
-# 駅名 -> 所属する路線のインデックスリスト（逆引き辞書）
-STATION_TO_ROUTES = {}
-for r_idx, route in enumerate(ALL_ROUTES):
-    for s_idx, station in enumerate(route.stations):
-        if station not in STATION_TO_ROUTES: STATION_TO_ROUTES[station] = []
-        STATION_TO_ROUTES[station].append((r_idx, s_idx))
+    """2駅間の移動時間（累積所要時間の差。区間ごとの時間は edges.EdgeTable で一度だけ計算済み）"""
+    cum = route.cum_times
+    return abs(cum[end_idx] - cum[start_idx])
+
+class Network:
+    """
+    路線データ（data.TOKYO_LINES / LINE_CONFIG / STATION_LOCATIONS と同じ形）から作った探索用の構造。
+    探索関数は network を省略すると東京の DEFAULT_NETWORK を使う。
+    routes (Route のリスト) を渡すと路線データから作らずにそれを使い、stations を渡すと駅番号をその並びに固定する
+    （運行障害で路線を区切ったネットワークでも、所要時間行列などの駅の並びが変わらないように）。
+    """
+    def __init__(self, lines, line_config, locations, name="tokyo", table=None, routes=None, stations=None):
+        self.name = name
+        self.lines = lines
+        self.line_config = line_config
+        self.locations = locations
+        self.edge_table = table if table is not None else edges.EdgeTable(lines, locations, line_config)
+
+        # データを「路線オブジェクト」のリストに変換
+        if routes is None:
+            routes = [Route(line, stations, line_config.get(line, edges.DEFAULT_CONF),
+                            self.edge_table.cumulative_times(line, edges.RAPTOR_MODEL).tolist())
+                      for line, stations in lines.items()]
+        self.routes = list(routes)
+
+        # 駅名 -> 所属する路線のインデックスリスト（逆引き辞書）
+        station_to_routes = {s: [] for s in stations} if stations is not None else {}
+        for r_idx, route in enumerate(self.routes):
+            for s_idx, station in enumerate(route.stations):
+                if station not in station_to_routes: station_to_routes[station] = []
+                station_to_routes[station].append((r_idx, s_idx))
+        self.station_to_routes = {s: tuple(v) for s, v in station_to_routes.items()}
+
+        # 駅名 <-> 通し番号（一括探索や所要時間行列の並び順）
+        self.station_names = tuple(self.station_to_routes.keys())
+        self.station_index = {s: i for i, s in enumerate(self.station_names)}
+        self.station_routes = tuple(self.station_to_routes[s] for s in self.station_names)  # 駅番号で引く版
+        self.route_station_ids = tuple(tuple(self.station_index[s] for s in route.stations) for route in self.routes)
+        self.routes = tuple(self.routes)
+        self.route_arrays = tuple(self._compile_route_arrays())
+        # 路線の乗り継ぎグラフ: route_hops[a][b] = 路線 a から路線 b まで乗り換える最小回数（同じ駅を通る路線どうしが隣）
+        self.route_hops = self._compile_route_hops()
+        # 作った後は書き換えない（スレッド間でロックなしに共有するため）。配列も読み取り専用にする
+        for idx, cum, _, _ in self.route_arrays:
+            idx.flags.writeable = False
+            cum.flags.writeable = False
+
+    def _compile_route_arrays(self):
+        """路線ごとに (駅番号の配列, 始発からの累積所要時間, 乗車時の待ち時間, 同じ駅を2回通るか) を作る"""
+        arrays = []
+        for route in self.routes:
+            idx = np.array([self.station_index[s] for s in route.stations], dtype=np.intp)
+            cum = np.array(route.cum_times)
+            wait_cost = (route.interval / 2.0) + 2.0
+            arrays.append((idx, cum, wait_cost, len(set(route.stations)) != len(route.stations)))
+        return arrays
+
+    def _compile_route_hops(self):
+        """路線ごとに幅優先探索（路線数は数十なので全組を持っても小さい）。乗り継げなければ inf"""
+        neighbors = [set() for _ in self.routes]
+        for routes in self.station_routes:
+            for a, _ in routes:
+                neighbors[a].update(r for r, _ in routes if r != a)
+        hops = []
+        for start in range(len(self.routes)):
+            dist = [float('inf')] * len(self.routes)
+            dist[start] = 0
+            frontier = [start]
+            while frontier:
+                nxt = []
+                for a in frontier:
+                    for b in neighbors[a]:
+                        if dist[b] == float('inf'):
+                            dist[b] = dist[a] + 1
+                            nxt.append(b)
+                frontier = nxt
+            hops.append(tuple(dist))
+        return tuple(hops)
+
+    def hops_to(self, station_ids):
+        """各路線から station_ids のどれかを通る路線まで、あと何回乗り換えが要るか（路線番号で引くリスト）"""
+        goal = {r for s in station_ids for r, _ in self.station_routes[s]}
+        return [min((hops[g] for g in goal), default=float('inf')) for hops in self.route_hops]
+
+DEFAULT_NETWORK = Network(data.TOKYO_LINES, data.LINE_CONFIG, data.STATION_LOCATIONS, table=edges.shared_table())
+
+# 既存コードから使っている名前は東京のネットワークを指す
+ALL_ROUTES = DEFAULT_NETWORK.routes
+STATION_TO_ROUTES = DEFAULT_NETWORK.station_to_routes
+STATION_NAMES = DEFAULT_NETWORK.station_names
+STATION_INDEX = DEFAULT_NETWORK.station_index
+ROUTE_STATION_IDS = DEFAULT_NETWORK.route_station_ids
+ROUTE_ARRAYS = DEFAULT_NETWORK.route_arrays
+
+# 場所: 駅名 または (緯度, 経度)。座標なら近くの駅を徒歩で乗り降りする駅として使う
+ACCESS_MAX_KM = 1.5   # 座標から歩いて使う駅の範囲
+ACCESS_LIMIT = 6      # 近い順に最大何駅まで使うか
+GRID_DEG = 0.01       # 駅の格子索引のセル（約1km）
+
+def is_coordinate(place):
+    return isinstance(place, tuple)
+
+def place_key(place):
+    """キャッシュやログで使う文字列（座標は "@緯度,経度"）"""
+    return place if not is_coordinate(place) else f"@{place[0]:.5f},{place[1]:.5f}"
+
+def place_name(place):
+    """経路の表示用の名前"""
+    return place if not is_coordinate(place) else f"地点({place[0]:.4f}, {place[1]:.4f})"
+
+def walk_minutes(distance_km, model=edges.RAPTOR_MODEL):
+    return distance_km / model.walk_speed_kmh * 60
+
+class StationGrid:
+    """駅の座標の格子索引。nearby() はセルを広げながら近い駅だけ距離を計算する"""
+    def __init__(self, network):
+        self.cells = {}
+        self.coords = {}
+        for s_id, name in enumerate(network.station_names):
+            loc = network.locations.get(name)
+            if loc is None: continue
+            self.coords[s_id] = loc
+            self.cells.setdefault(self._cell(*loc), []).append(s_id)
+
+    @staticmethod
+    def _cell(lat, lon):
+        return (int(math.floor(lat / GRID_DEG)), int(math.floor(lon / GRID_DEG)))
+
+    def nearby(self, lat, lon, max_km=ACCESS_MAX_KM, limit=ACCESS_LIMIT):
+        """(駅番号, 距離km) を近い順に。max_km 以内に1駅もなければ一番近い駅だけ返す"""
+        ci, cj = self._cell(lat, lon)
+        # 緯度 0.01度 = 1.11km, 経度 0.01度 = 0.91km（calculate_distance_km と同じ近似）
+        reach = int(math.ceil(max_km / (GRID_DEG * 91.0)))
+        found = []
+        for di in range(-reach, reach + 1):
+            for dj in range(-reach, reach + 1):
+                for s_id in self.cells.get((ci + di, cj + dj), ()):
+                    d = calculate_distance_km(lat, lon, *self.coords[s_id])
+                    if d <= max_km: found.append((d, s_id))
+        if not found and self.coords:
+            found = [min((calculate_distance_km(lat, lon, *loc), s_id) for s_id, loc in self.coords.items())]
+        found.sort()
+        return [(s_id, d) for d, s_id in found[:limit]]
+
+_GRIDS = weakref.WeakKeyDictionary()
+
+def access_seeds(place, network=None):
+    """
+    place から乗り降りできる駅: {駅番号: 徒歩の分}。駅名ならその駅だけ（0分）、未知の駅なら空。
+    座標なら StationGrid で近くの駅を探し、歩く時間を edges.RAPTOR_MODEL の徒歩の速さで出す。
+    """
+    net = network or DEFAULT_NETWORK
+    if not is_coordinate(place):
+        s_id = net.station_index.get(place)
+        return {} if s_id is None else {s_id: 0.0}
+    grid = _GRIDS.get(net)
+    if grid is None:
+        grid = _GRIDS[net] = StationGrid(net)
+    return {s_id: walk_minutes(d) for s_id, d in grid.nearby(place[0], place[1])}
+
+def direct_walk(start, end, network=None):
+    """どちらかが座標で、2点（駅なら駅の座標）が ACCESS_MAX_KM 以内なら歩いた分数、そうでなければ None"""
+    locations = (network or DEFAULT_NETWORK).locations
+    a = start if is_coordinate(start) else locations.get(start)
+    b = end if is_coordinate(end) else locations.get(end)
+    if a is None or b is None or not (is_coordinate(start) or is_coordinate(end)): return None
+    d = calculate_distance_km(a[0], a[1], b[0], b[1])
+    return walk_minutes(d) if d <= ACCESS_MAX_KM else None
 
 
 # --- 2. アルゴリズムの刷新: RAPTOR Lite (Report 2.2) ---
-def find_routes_raptor(start_node, end_node, max_transfers=4):
+class RaptorScratch:
     """
-    ラウンドベース探索により、(乗り換え回数, 所要時間) のパレート最適解を探す。
+    RAPTOR Lite の作業領域（1スレッド・1ネットワーク専用）。クエリのたびに dict や配列を作らず、
+    駅番号で引く配列を使い回す。値は stamp が今の epoch（mark_stamp は tick）と同じときだけ有効なので、
+    epoch を1つ進めるだけで全駅が「未到達」に戻る（O(駅数) の初期化が要らない）。
+    best[s]          : これまでのラウンドを通した最良到着時刻
+    board[s]         : 1つ前のラウンド終了時点の到着時刻（乗車判定用）
+    target_rounds[k] : ラウンド k 終了時点の目的地の最良値（目的地が座標なら降りてから歩く分を含む）
+    target_stations[k]: そのときに降りる駅
     """
-    # 【修正1】同一駅の場合は適切な結果を返す
-    if start_node == end_node:
-        return [{
-            "transfers": 0,
-            "total_time": 0,
-            "path_details": []
-        }]
-
-    # 【修正】defaultdictを使って、未知の駅キーが来ても無限大を返すようにする
-    # best_arrivals[k][station]
-    best_arrivals = [defaultdict(lambda: float('inf')) for _ in range(max_transfers + 1)]
-    best_arrivals[0][start_node] = 0
-    
-    # 経路復元用
-    parents = [{} for _ in range(max_transfers + 1)]
+    __slots__ = ("rounds", "epoch", "tick", "best", "best_stamp", "board", "board_stamp", "mark_stamp",
+                 "reached", "parents", "target_rounds", "target_stations")
 
-    # 探索対象の駅
-    marked_stations = {start_node}
+    STAMP_LIMIT = 2**31 - 2
+
+    def __init__(self, network, rounds):
+        n = len(network.station_names)
+        self.rounds = rounds
+        self.epoch = 0
+        self.tick = 0
+        self.best = array("d", [0.0]) * n
+        self.board = array("d", [0.0]) * n
+        self.best_stamp = array("i", [0]) * n
+        self.board_stamp = array("i", [0]) * n
+        self.mark_stamp = array("i", [0]) * n
+        self.reached = []  # このクエリで到達した駅番号（one-to-all の結果を作る用）
+        self.parents = RouteParents(network.station_names, rounds, network.routes)
+        self.target_rounds = [float('inf')] * rounds
+        self.target_stations = [-1] * rounds
+
+    def begin(self):
+        """新しいクエリを始める（stamp があふれそうなときだけ配列を 0 に戻す）"""
+        if self.epoch >= self.STAMP_LIMIT or self.tick >= self.STAMP_LIMIT - self.rounds:
+            for stamps in (self.best_stamp, self.board_stamp, self.mark_stamp):
+                stamps[:] = array("i", [0]) * len(stamps)
+            self.parents.reset_stamps()
+            self.epoch = self.tick = 0
+        self.epoch += 1
+        self.parents.epoch = self.epoch
+        self.reached.clear()
+        for k in range(self.rounds):
+            self.target_rounds[k] = float('inf')
+            self.target_stations[k] = -1
+
+_LOCAL = threading.local()
+
+def _scratch(network, rounds):
+    """このスレッド用の作業領域（ネットワークごとに1つ。ラウンド数が足りなければ作り直す）"""
+    arenas = getattr(_LOCAL, "arenas", None)
+    if arenas is None:
+        arenas = _LOCAL.arenas = weakref.WeakKeyDictionary()
+    scratch = arenas.get(network)
+    if scratch is None or scratch.rounds < rounds:
+        scratch = arenas[network] = RaptorScratch(network, rounds)
+    return scratch
+
+def _raptor_rounds(start_node, max_transfers, network=None, target=None, upper_bound=None, stats=None, seeds=None):
+    """
+    ラウンド処理本体。結果はこのスレッドの RaptorScratch に書いて返す
+    （同じスレッドの次の探索で上書きされるので、呼び出し側はすぐに値を取り出すこと）。
+    Network は読むだけなので、スレッドごとに別の作業領域を使えばロックなしで並列に探索できる。
+    start_node / target は駅名か座標。座標なら access_seeds の駅を「歩いて着いた時刻」から同時に始め（多始点）、
+    目的地は「降りた駅から歩く分」を足した値で比べる。seeds ({駅番号: 分}) を渡すと start_node の代わりに使う。
+    target を渡すと、その駅の最良値以上になる到着は記録しない（目的地の答えは変わらない）。
+    upper_bound (分) を渡すと、それを超える到着も記録しない（目的地まで upper_bound を超えるなら答えなし）。
+    stats (dict) を渡すとラウンド数・記録したラベル数・枝刈りしたラベル数を書き込む。
+    """
+    net = network or DEFAULT_NETWORK
+    INF = float('inf')
+    scratch = _scratch(net, max_transfers + 1)
+    scratch.begin()
+    epoch = scratch.epoch
+    best, best_stamp = scratch.best, scratch.best_stamp
+    board, board_stamp = scratch.board, scratch.board_stamp
+    mark_stamp, reached, parents = scratch.mark_stamp, scratch.reached, scratch.parents
+    routes, route_station_ids, station_routes = net.routes, net.route_station_ids, net.station_routes
+
+    # 目的地で降りる駅 -> 降りてから歩く分（駅名なら {駅: 0}）
+    egress = access_seeds(target, net) if target is not None else {}
+    min_egress = min(egress.values()) if egress else 0.0
+    # 駅に着いた時刻がこれ以上なら、どの降車駅から歩いても目的地の最良値・上限を超える
+    limit = INF if upper_bound is None else upper_bound - min_egress
+    # 路線 r からあと何回乗り換えれば目的地の駅を通る路線に乗れるか（目的地がなければ全部 0）
+    hops_to_target = net.hops_to(egress) if egress else [0] * len(routes)
+    target_best = INF  # 目的地の全ラウンドを通した最良値（歩く分を含む）
+    bound = INF        # target_best - min_egress
+    labels = pruned = rounds = 0
+
+    if seeds is None: seeds = access_seeds(start_node, net)
+    if not seeds:
+        if stats is not None: stats.update(rounds=0, labels=0, pruned=0)
+        return scratch
+    # 探索対象の駅（駅番号）。座標からは歩いて着いた時刻から始める
+    marked_stations = []
+    for s_id, walk in seeds.items():
+        best[s_id] = walk
+        best_stamp[s_id] = epoch
+        reached.append(s_id)
+        marked_stations.append(s_id)
+        if s_id in egress and walk + egress[s_id] < target_best:
+            # 乗らずに（乗車駅で降りたことにして）歩いて着ける
+            target_best = walk + egress[s_id]
+            bound = target_best - min_egress
 
     # ラウンド（乗り換え回数）ごとのループ
     for k in range(1, max_transfers + 1):
-        # 前のラウンドの結果をコピー
-        # defaultdictなので、到達済みの駅だけコピーすればOK（効率的）
-        for s, t in best_arrivals[k-1].items():
-            best_arrivals[k][s] = t
+        rounds = k
+        # 前のラウンドで更新された駅だけ、乗車判定用の値を写す（他の駅は前のまま有効）
+        for s in marked_stations:
+            board[s] = best[s]
+            board_stamp[s] = epoch
 
-        # 今回スキャンする路線を特定
-        queue_routes = {} # {route_idx: start_station_idx}
+        # 今回スキャンする路線を特定（残りのラウンドで目的地の路線まで乗り継げない路線は飛ばす）
+        queue_routes = {} # {route_idx: [最小の駅idx, 最大の駅idx]}
+        remaining = max_transfers - k
         for s in marked_stations:
-            if s not in STATION_TO_ROUTES: continue
-            for r_idx, s_idx in STATION_TO_ROUTES[s]:
-                if r_idx not in queue_routes or s_idx < queue_routes[r_idx]:
-                    queue_routes[r_idx] = s_idx
+            for r_idx, s_idx in station_routes[s]:
+                if hops_to_target[r_idx] > remaining: continue
+                if r_idx not in queue_routes:
+                    queue_routes[r_idx] = [s_idx, s_idx]
+                else:
+                    bounds = queue_routes[r_idx]
+                    if s_idx < bounds[0]: bounds[0] = s_idx
+                    if s_idx > bounds[1]: bounds[1] = s_idx
 
-        next_marked_stations = set()
+        scratch.tick += 1
+        tick = scratch.tick
+        next_marked_stations = []
 
         # 路線ごとのスキャン
-        for r_idx, start_s_idx in queue_routes.items():
-            route = ALL_ROUTES[r_idx]
-            
-            # === 【修正2】順方向スキャン ===
-            current_trip_start_time = float('inf') 
-            boarding_station = None
-            boarding_idx = -1
-            
-            for i in range(start_s_idx, len(route.stations)):
-                s_curr = route.stations[i]
-                
-                # A. 降車判定
-                if current_trip_start_time != float('inf'):
-                    travel_t = calculate_travel_time(route, boarding_idx, i)
-                    arrival_t = current_trip_start_time + travel_t
-                    
-                    if arrival_t < best_arrivals[k][s_curr]:
-                        best_arrivals[k][s_curr] = arrival_t
-                        parents[k][s_curr] = {
-                            "prev_station": boarding_station,
-                            "line": route.line_name,
-                            "move_time": travel_t,
-                            "wait_time": (current_trip_start_time - best_arrivals[k-1][boarding_station])
-                        }
-                        next_marked_stations.add(s_curr)
+        for r_idx, (start_s_idx, end_s_idx) in queue_routes.items():
+            station_ids = route_station_ids[r_idx]
+            cum = routes[r_idx].cum_times
+            route_wait = (routes[r_idx].interval / 2.0) + 2.0
 
-                # B. 乗車判定
-                prev_t = best_arrivals[k-1][s_curr]
-                if prev_t != float('inf'):
-                    # 【修正】出発駅（k==1 かつ s_curr==start_node）では待ち時間なし
-                    if k == 1 and s_curr == start_node:
-                        wait_cost = 0  # 出発駅では待ち時間なし
-                    else:
-                        wait_cost = (route.interval / 2.0) + 2.0
-                    
-                    if prev_t + wait_cost < current_trip_start_time:
-                        current_trip_start_time = prev_t + wait_cost
-                        boarding_station = s_curr
-                        boarding_idx = i
-            
-            # === 【修正2】逆方向スキャン ===
-            current_trip_start_time = float('inf')
-            boarding_station = None
-            boarding_idx = -1
-            
-            for i in range(start_s_idx, -1, -1):
-                s_curr = route.stations[i]
-                
-                # A. 降車判定
-                if current_trip_start_time != float('inf'):
-                    travel_t = calculate_travel_time(route, boarding_idx, i)
-                    arrival_t = current_trip_start_time + travel_t
-                    
-                    if arrival_t < best_arrivals[k][s_curr]:
-                        best_arrivals[k][s_curr] = arrival_t
-                        parents[k][s_curr] = {
-                            "prev_station": boarding_station,
-                            "line": route.line_name,
-                            "move_time": travel_t,
-                            "wait_time": (current_trip_start_time - best_arrivals[k-1][boarding_station])
-                        }
-                        next_marked_stations.add(s_curr)
+            # 【修正2】順方向は手前の更新駅から、逆方向は一番奥の更新駅から戻る（手前の駅からだと奥の駅で乗れない）
+            for scan in (range(start_s_idx, len(station_ids)), range(end_s_idx, -1, -1)):
+                current_trip_start_time = INF
+                boarding_idx = -1
 
-                # B. 乗車判定
-                prev_t = best_arrivals[k-1][s_curr]
-                if prev_t != float('inf'):
-                    # 【修正】出発駅（k==1 かつ s_curr==start_node）では待ち時間なし
-                    if k == 1 and s_curr == start_node:
-                        wait_cost = 0  # 出発駅では待ち時間なし
-                    else:
-                        wait_cost = (route.interval / 2.0) + 2.0
-                    
-                    if prev_t + wait_cost < current_trip_start_time:
-                        current_trip_start_time = prev_t + wait_cost
-                        boarding_station = s_curr
+                for i in scan:
+                    s_curr = station_ids[i]
+
+                    # A. 降車判定（移動時間は calculate_travel_time と同じ累積所要時間の差）
+                    if current_trip_start_time != INF:
+                        arrival_t = current_trip_start_time + abs(cum[i] - cum[boarding_idx])
+
+                        if best_stamp[s_curr] != epoch or arrival_t < best[s_curr]:
+                            # 目的地の最良値・上限を超える到着からは、目的地の答えを良くできない
+                            if arrival_t >= bound or arrival_t > limit:
+                                pruned += 1
+                            else:
+                                if best_stamp[s_curr] != epoch:
+                                    best_stamp[s_curr] = epoch
+                                    reached.append(s_curr)
+                                best[s_curr] = arrival_t
+                                parents.set(k, s_curr, station_ids[boarding_idx], r_idx, boarding_idx, i)
+                                if mark_stamp[s_curr] != tick:
+                                    mark_stamp[s_curr] = tick
+                                    next_marked_stations.append(s_curr)
+                                labels += 1
+                                if s_curr in egress and arrival_t + egress[s_curr] < target_best:
+                                    target_best = arrival_t + egress[s_curr]
+                                    bound = target_best - min_egress
+
+                    # B. 乗車判定（前のラウンドまでに着いていた駅だけ）
+                    if board_stamp[s_curr] != epoch: continue
+                    # 【修正】出発駅では待ち時間なし（k==1 で乗れるのは出発駅・歩いて着いた駅だけ）
+                    board_t = board[s_curr] + (0 if k == 1 else route_wait)
+
+                    # 乗った時点で目的地の最良値・上限を超えるなら乗らない（その先の到着も全部超える）
+                    if board_t >= bound or board_t > limit: continue
+                    # 【修正】比較は「この駅に今乗っている列車が着く時刻」と行う
+                    # （乗車時刻だけで比べると、手前で早く乗った遅いルートを選んでしまう）
+                    if current_trip_start_time == INF or \
+                       board_t < current_trip_start_time + abs(cum[i] - cum[boarding_idx]):
+                        current_trip_start_time = board_t
                         boarding_idx = i
 
+        for t_id, walk in egress.items():
+            if best_stamp[t_id] == epoch and best[t_id] + walk < scratch.target_rounds[k]:
+                scratch.target_rounds[k] = best[t_id] + walk
+                scratch.target_stations[k] = t_id
         marked_stations = next_marked_stations
         if not marked_stations: break
 
+    if stats is not None:
+        stats.update(rounds=rounds, labels=labels, pruned=pruned)
+    return scratch
+
+def find_routes_raptor(start_node, end_node, max_transfers=4, timetable=None, departure_time=None, departure_window=None,
+                       network=None, upper_bound=None, stats=None):
+    """
+    ラウンドベース探索により、(乗り換え回数, 所要時間) のパレート最適解を探す。
+    timetable (gtfs.Timetable) を渡すと、実際の時刻表で departure_time (秒) 以降の列車を探す。
+    さらに departure_window=(開始, 終了) を渡すと、その間の出発→到着のパレート集合を返す。
+    network (Network) を渡すと東京以外の路線網で探す。
+    upper_bound (分) を渡すと、それより長くかかる経路は探さない（なければ []）。集合場所の探索で
+    「今の最良候補より悪いと分かった候補」を途中で打ち切るのに使う。
+    stats (dict) には rounds / labels / pruned（目的地の最良値・上限で記録しなかったラベル数）が入る。
+    start_node / end_node には (緯度, 経度) も渡せる（時刻表モード以外）。近くの駅まで歩く区間は路線名 "徒歩"、
+    歩いて ACCESS_MAX_KM 以内なら歩くだけの経路も含め、それより遅い経路は返さない。
+    """
+    if timetable is not None:
+        if departure_window is not None:
+            profile = find_profile_raptor(timetable, start_node, departure_window[0], departure_window[1],
+                                          max_transfers, targets=[end_node])
+            return profile.get(end_node, [])
+        return find_routes_timetable(timetable, start_node, end_node, departure_time or 0, max_transfers,
+                                     upper_bound=upper_bound)
+
+    # 【修正1】同一駅の場合は適切な結果を返す
+    if start_node == end_node:
+        if stats is not None: stats.update(rounds=0, labels=0, pruned=0)
+        return [RouteResult(0, 0, [])]
+
+    net = network or DEFAULT_NETWORK
+    walk_only = direct_walk(start_node, end_node, net)
+    if walk_only is not None and upper_bound is not None and walk_only > upper_bound: walk_only = None
+    if walk_only is not None:
+        # 歩くより遅い経路は探さない
+        upper_bound = walk_only if upper_bound is None else min(upper_bound, walk_only)
+    scratch = _raptor_rounds(start_node, max_transfers, net, target=end_node, upper_bound=upper_bound, stats=stats)
+
     # --- 結果の整形 ---
     results = []
-    min_time_so_far = float('inf')
+    min_time_so_far = float('inf') if walk_only is None else walk_only
+    if walk_only is not None:
+        results.append(RouteResult(0, walk_only, [PathSegment("徒歩", place_name(start_node), place_name(end_node), walk_only, 0)]))
 
     for k in range(1, max_transfers + 1):
         # end_node が到達不能なら inf が返る（エラーにならない）
-        t = best_arrivals[k][end_node]
+        t = scratch.target_rounds[k]
         if t == float('inf'): continue
         
         if t < min_time_so_far:
             min_time_so_far = t
-            path_details = reconstruct_path(parents, k, end_node)
-            results.append({
-                "transfers": k - 1,
-                "total_time": t,
-                "path_details": path_details
-            })
+            path_details = reconstruct_path(scratch.parents, k, scratch.target_stations[k])
+            if is_coordinate(start_node) or is_coordinate(end_node):
+                path_details = _with_walks(start_node, end_node, path_details, scratch.target_stations[k], net)
+            results.append(RouteResult(k - 1, t, path_details))
 
     return results
 
-def reconstruct_path(parents, k, current_node):
+def _with_walks(start_node, end_node, path, alight_id, network):
+    """座標の出発地・目的地と乗降駅の間の "徒歩" 区間を経路の前後に足す"""
+    names = network.station_names
+    first = path[0].start if path else names[alight_id]
+    last = path[-1].end if path else names[alight_id]
+    if is_coordinate(start_node):
+        walk = access_seeds(start_node, network)[network.station_index[first]]
+        path.insert(0, PathSegment("徒歩", place_name(start_node), first, walk, 0))
+    if is_coordinate(end_node):
+        walk = access_seeds(end_node, network)[network.station_index[last]]
+        path.append(PathSegment("徒歩", last, place_name(end_node), walk, 0))
+    return path
+
+def find_arrival_times(start_node, max_transfers=4, network=None):
+    """
+    start_node から全駅への最短所要時間（分）を1回の探索で求める（one-to-all）。
+    各駅の値は find_routes_raptor(start_node, 駅) の最短 total_time と一致する。
+    start_node が座標なら、近くの駅まで歩く時間から始めた値（結果は駅だけ）。
+    """
+    net = network or DEFAULT_NETWORK
+    if not is_coordinate(start_node) and start_node not in net.station_to_routes:
+        return {start_node: 0}
+    scratch = _raptor_rounds(start_node, max_transfers, net)
+    names, best = net.station_names, scratch.best
+    times = {names[s]: best[s] for s in scratch.reached}
+    if not is_coordinate(start_node): times[start_node] = 0
+    return times
+
+def find_arrival_times_multi(origins, max_transfers=4, network=None):
+    """
+    origins（駅名のリスト、または {駅名: 出発までの分}）のどれかから出て各駅に着く最短所要時間を
+    1回の多始点探索で求める: 各駅の値は min(origins の各駅からの find_arrival_times + 出発までの分)。
+    戻り値: logic.STATION_NAMES 順の float64 配列（到達不能は inf）。
+    """
+    net = network or DEFAULT_NETWORK
+    if not isinstance(origins, dict): origins = dict.fromkeys(origins, 0.0)
+    seeds = {net.station_index[s]: float(t) for s, t in origins.items() if s in net.station_index}
+    times = np.full(len(net.station_names), np.inf)
+    if not seeds: return times
+    scratch = _raptor_rounds(None, max_transfers, net, seeds=seeds)
+    reached = np.array(scratch.reached, dtype=np.intp)
+    times[reached] = np.frombuffer(scratch.best, dtype=np.float64)[reached]
+    return times
+
+def find_rides(start_node, max_transfers=4, network=None):
+    """
+    start_node から各駅への最短経路で乗る区間: {駅番号: [(路線番号, 乗車位置, 降車位置), ...]}（出発駅は含まない）。
+    経路は find_arrival_times の値を出したもの。運行障害の影響範囲（どの結果がどの区間を通るか）を調べるのに使う。
+    """
+    net = network or DEFAULT_NETWORK
+    scratch = _raptor_rounds(start_node, max_transfers, net)
+    parents = scratch.parents
+    start_id = net.station_index.get(start_node)
+    rides = {}
+    for s in scratch.reached:
+        if s == start_id: continue
+        legs = []
+        curr, depth = s, max_transfers
+        while depth > 0:
+            if parents.has(depth, curr):
+                legs.append((parents.route[depth][curr], parents.board_idx[depth][curr], parents.alight_idx[depth][curr]))
+                curr = parents.prev_station[depth][curr]
+            depth -= 1
+        rides[s] = legs
+    return rides
+
+def find_departure_times(end_node, max_transfers=4, network=None):
+    """
+    全駅から end_node への最短所要時間（分）を1回の逆向き探索で求める（all-to-one）。
+    各駅の値は find_routes_raptor(駅, end_node) の最短 total_time と一致する。
+    end_node が座標なら、近くの駅から歩く時間を足した値（結果は駅だけ。多始点の逆向き探索）。
+    """
+    net = network or DEFAULT_NETWORK
+    if not is_coordinate(end_node) and end_node not in net.station_to_routes:
+        return {end_node: 0}
+    INF = float('inf')
+    # 乗車駅での待ち時間は「最初の乗車以外」にかかるので、ラベルを2種類持つ
+    # charged[s]: s で乗車する路線の待ち時間込み（乗り継ぎ用）
+    # free[s]   : s が出発駅の場合（待ち時間なし = 答え）
+    names = net.station_names
+    charged = {names[s]: walk for s, walk in access_seeds(end_node, net).items()}
+    free = dict(charged)
+    marked_stations = set(charged)
+
+    for k in range(1, max_transfers + 1):
+        prev_charged = dict(charged)
+
+        queue_routes = {}
+        for s in marked_stations:
+            for r_idx, s_idx in net.station_to_routes.get(s, ()):
+                queue_routes.setdefault(r_idx, set()).add(s_idx)
+
+        next_marked_stations = set()
+
+        for r_idx, alight_idxs in queue_routes.items():
+            route = net.routes[r_idx]
+            wait_cost = (route.interval / 2.0) + 2.0
+            n = len(route.stations)
+            # 降車駅 i から遡って乗車駅 j を探す（順方向・逆方向の両方）
+            for indices in (range(max(alight_idxs), -1, -1), range(min(alight_idxs), n)):
+                alight_station = None
+                alight_idx = -1
+                for j in indices:
+                    s_curr = route.stations[j]
+                    if alight_station is not None:
+                        t = calculate_travel_time(route, j, alight_idx) + prev_charged[alight_station]
+                        if t < free.get(s_curr, INF):
+                            free[s_curr] = t
+                        if t + wait_cost < charged.get(s_curr, INF):
+                            charged[s_curr] = t + wait_cost
+                            next_marked_stations.add(s_curr)
+                    prev_t = prev_charged.get(s_curr)
+                    if prev_t is not None:
+                        # より良い降車駅なら乗り換える（距離は加算的なので降車駅の先までの時間で比較）
+                        if alight_station is None or \
+                           prev_t < calculate_travel_time(route, j, alight_idx) + prev_charged[alight_station]:
+                            alight_station = s_curr
+                            alight_idx = j
+
+        marked_stations = next_marked_stations
+        if not marked_stations: break
+
+    return free
+
+def find_arrival_times_batch(origins, max_transfers=4, network=None):
+    """
+    複数の出発駅をまとめて探索する RAPTOR。ラベルを (出発駅数, 駅数) の配列で持ち、
+    各ラウンドで各路線を1回だけ、全出発駅ぶんまとめて NumPy で走査する。
+    戻り値: float32 の (len(origins), len(network.station_names)) 配列（所要時間行列のブロック、到達不能は inf）。
+    値は find_arrival_times と同じ（累積和で計算するので浮動小数の誤差程度の差はある）。
+    """
+    net = network or DEFAULT_NETWORK
+    INF = np.inf
+    n_origins = len(origins)
+    labels = np.full((n_origins, len(net.station_names)), INF)
+    origin_idx = np.array([net.station_index.get(o, -1) for o in origins], dtype=np.intp)
+    rows = np.flatnonzero(origin_idx >= 0)
+    labels[rows, origin_idx[rows]] = 0.0
+
+    # 前のラウンドで（どれかの出発駅について）更新された駅
+    changed = np.zeros(len(net.station_names), dtype=bool)
+    changed[origin_idx[rows]] = True
+
+    for k in range(1, max_transfers + 1):
+        prev = labels
+        labels = prev.copy()
+        for idx, cum, wait_cost, has_duplicates in net.route_arrays:
+            if not changed[idx].any(): continue
+            # 1ラウンド目に乗れるのは出発駅だけで、出発駅では待ち時間なし
+            board = prev[:, idx] + (0.0 if k == 1 else wait_cost)
+
+            # 順方向: 駅 i への到着 = cum[i] + min_{j<i}(board[j] - cum[j])
+            arrival = np.full_like(board, INF)
+            arrival[:, 1:] = np.minimum.accumulate(board - cum, axis=1)[:, :-1] + cum[1:]
+            # 逆方向: 駅 i への到着 = -cum[i] + min_{j>i}(board[j] + cum[j])
+            backward = np.minimum.accumulate((board + cum)[:, ::-1], axis=1)[:, ::-1]
+            np.minimum(arrival[:, :-1], backward[:, 1:] - cum[:-1], out=arrival[:, :-1])
+
+            if has_duplicates:
+                # 都営大江戸線（都庁前を2回通る）は同じ列に2回書くので ufunc.at で最小を取る
+                np.minimum.at(labels, (slice(None), idx), arrival)
+            else:
+                labels[:, idx] = np.minimum(labels[:, idx], arrival)
+
+        changed = (labels < prev).any(axis=0)
+        if not changed.any(): break
+
+    return labels.astype(np.float32)
+
+def reconstruct_path(parents, k, current_id):
+    """ラウンド k で駅番号 current_id に着いた経路を PathSegment のリストで返す"""
     path = []
-    curr = current_node
+    curr = current_id
     depth = k
     
     while depth > 0:
-        p_info = parents[depth].get(curr)
-        if not p_info: break
+        if not parents.has(depth, curr):
+            # このラウンドで更新されていない（前ラウンドの値のコピー）なら1つ前のラウンドを見る
+            depth -= 1
+            continue
         
-        prev = p_info["prev_station"]
-        path.insert(0, {
-            "line": p_info["line"],
-            "start": prev,
-            "end": curr,
-            "time": p_info["move_time"],
-            "wait": p_info["wait_time"]
-        })
-        curr = prev
+        path.append(parents.segment(depth, curr))
+        curr = parents.prev_station[depth][curr]
         depth -= 1
-    return path
\ No newline at end of file
+    path.reverse()
+    return path
+
+
+# --- 3. 時刻表 RAPTOR (GTFS) ---
+class TripParents(RouteParents):
+    """時刻表 RAPTOR 用の経路復元情報。乗った列車と、乗車駅に着いていた時刻（秒）も配列で持つ"""
+    __slots__ = ("patterns", "trip", "prev_arrival")
+
+    def __init__(self, timetable, rounds):
+        super().__init__(timetable.station_names, rounds)
+        self.patterns = timetable.patterns
+        empty = array("i", [-1]) * len(self.names)
+        self.trip = [array("i", empty) for _ in range(rounds)]
+        self.prev_arrival = [array("i", empty) for _ in range(rounds)]
+
+    def segment(self, k, s):
+        pattern = self.patterns[self.route[k][s]]
+        trip = self.trip[k][s]
+        board_t = pattern.departures[self.board_idx[k][s]][trip]
+        arrival_t = pattern.arrivals[self.alight_idx[k][s]][trip]
+        return PathSegment(pattern.line_name, self.names[self.prev_station[k][s]], self.names[s],
+                           (arrival_t - board_t) / 60.0, (board_t - self.prev_arrival[k][s]) / 60.0)
+
+def _timetable_rounds(timetable, start_node, end_node, best_arrivals, best_ever, parents, max_transfers,
+                      arrival_limit=float('inf')):
+    """
+    時刻表 RAPTOR のラウンド処理本体。
+    ラベル（best_arrivals / best_ever / parents）は呼び出し側が持つので、
+    rRAPTOR では出発時刻をまたいでそのまま使い回せる。
+    arrival_limit（秒）より遅い到着は記録しない。
+    """
+    INF = float('inf')
+    patterns = timetable.patterns
+    station_to_patterns = timetable.station_to_patterns
+    station_index = timetable.station_index
+    transfer_sec = timetable.transfer_sec
+    marked_stations = {start_node}
+
+    for k in range(1, max_transfers + 1):
+        prev_round = best_arrivals[k-1]
+        curr_round = best_arrivals[k]
+        # 前のラウンドの結果をコピー（rRAPTOR では前回の出発時刻の値が残っているので小さい方）
+        for s, t in prev_round.items():
+            if t < curr_round.get(s, INF):
+                curr_round[s] = t
+                parents.clear(k, station_index[s])
+
+        queue_patterns = {}
+        for s in marked_stations:
+            for p_idx, s_idx in station_to_patterns.get(s, ()):
+                if p_idx not in queue_patterns or s_idx < queue_patterns[p_idx]:
+                    queue_patterns[p_idx] = s_idx
+
+        next_marked_stations = set()
+
+        for p_idx, start_s_idx in queue_patterns.items():
+            pattern = patterns[p_idx]
+            stations = pattern.stations
+            trip = None
+            boarding_station = None
+            boarding_idx = -1
+
+            for i in range(start_s_idx, len(stations)):
+                s_curr = stations[i]
+
+                # A. 降車判定（目的地の最良値を超える到着は記録しない）
+                if trip is not None:
+                    arrival_t = pattern.arrivals[i][trip]
+                    if arrival_t < best_ever.get(s_curr, INF) and arrival_t < best_ever.get(end_node, INF) \
+                       and arrival_t <= arrival_limit:
+                        curr_round[s_curr] = arrival_t
+                        best_ever[s_curr] = arrival_t
+                        s_id = station_index[s_curr]
+                        parents.set(k, s_id, station_index[boarding_station], p_idx, boarding_idx, i)
+                        parents.trip[k][s_id] = trip
+                        parents.prev_arrival[k][s_id] = prev_round[boarding_station]
+                        next_marked_stations.add(s_curr)
+
+                # B. 乗車判定: より早い列車に乗り換えられるなら二分探索で探す
+                prev_t = prev_round.get(s_curr)
+                if prev_t is None: continue
+                ready_t = prev_t if (k == 1 and s_curr == start_node) else prev_t + transfer_sec
+                if trip is None or ready_t <= pattern.departures[i][trip]:
+                    j = pattern.earliest_trip(i, ready_t)
+                    if j is not None and (trip is None or j < trip):
+                        trip = j
+                        boarding_station = s_curr
+                        boarding_idx = i
+
+        marked_stations = next_marked_stations
+        if not marked_stations: break
+
+def find_routes_timetable(timetable, start_node, end_node, departure_time, max_transfers=4, upper_bound=None):
+    """
+    gtfs.Timetable 上の RAPTOR。各乗車駅で「乗れる最初の列車」を二分探索で見つける。
+    時刻はすべて秒。結果の total_time / time / wait は既存の結果と同じく分で返す。
+    upper_bound (分) を渡すと、それより長くかかる経路は探さない。
+    """
+    if start_node == end_node:
+        return [RouteResult(0, 0, [], departure_time, departure_time)]
+    if start_node not in timetable.station_to_patterns or end_node not in timetable.station_to_patterns:
+        return []
+
+    INF = float('inf')
+    best_arrivals = [{} for _ in range(max_transfers + 1)]
+    best_arrivals[0][start_node] = departure_time
+    best_ever = {start_node: departure_time}  # 全ラウンドを通した最良値（枝刈り用）
+    parents = TripParents(timetable, max_transfers + 1)
+    arrival_limit = INF if upper_bound is None else departure_time + upper_bound * 60
+    _timetable_rounds(timetable, start_node, end_node, best_arrivals, best_ever, parents, max_transfers, arrival_limit)
+
+    results = []
+    min_time_so_far = INF
+    for k in range(1, max_transfers + 1):
+        t = best_arrivals[k].get(end_node, INF)
+        if t == INF: continue
+        if t < min_time_so_far:
+            min_time_so_far = t
+            results.append(RouteResult(k - 1, (t - departure_time) / 60.0,
+                                       reconstruct_path(parents, k, timetable.station_index[end_node]),
+                                       departure_time, t))
+    return results
+
+
+# --- 4. Range RAPTOR (rRAPTOR): 出発時刻の幅をまとめて探索 ---
+def find_profile_raptor(timetable, start_node, window_start, window_end, max_transfers=4, targets=None):
+    """
+    window_start〜window_end (秒) に start_node を出る全列車について、
+    遅い出発時刻から順に RAPTOR を回し、ラベルを使い回して (出発 → 到着) のパレート集合を作る。
+    戻り値: {駅: [RouteResult, ...]}（各リストは出発時刻の昇順）
+    targets を渡すとその駅だけを返し、経路も復元する（それ以外は path_details が None）。
+    """
+    INF = float('inf')
+    departures = set()
+    for p_idx, s_idx in timetable.station_to_patterns.get(start_node, ()):
+        col = timetable.patterns[p_idx].departures[s_idx]
+        j = timetable.patterns[p_idx].earliest_trip(s_idx, window_start)
+        while j is not None and j < len(col) and col[j] <= window_end:
+            departures.add(col[j])
+            j += 1
+
+    wanted = None if targets is None else set(targets)
+    best_arrivals = [{} for _ in range(max_transfers + 1)]
+    best_ever = {}
+    parents = TripParents(timetable, max_transfers + 1)
+    profiles = defaultdict(list)
+    last_arrival = {}
+
+    for dep in sorted(departures, reverse=True):
+        best_arrivals[0][start_node] = dep
+        best_ever[start_node] = dep
+        _timetable_rounds(timetable, start_node, None, best_arrivals, best_ever, parents, max_transfers)
+
+        # 到着が早まった駅だけがパレート集合に加わる（出発が早くて到着が同じなら劣解）
+        for s in (best_ever if wanted is None else wanted):
+            t = best_ever.get(s, INF)
+            if s == start_node or t >= last_arrival.get(s, INF): continue
+            last_arrival[s] = t
+            k = next(k for k in range(1, max_transfers + 1) if best_arrivals[k].get(s, INF) == t)
+            path_details = None
+            if wanted is not None:
+                path_details = reconstruct_path(parents, k, timetable.station_index[s])
+            profiles[s].append(RouteResult(k - 1, (t - dep) / 60.0, path_details, dep, t))
+
+    for entries in profiles.values():
+        entries.reverse()
+    return dict(profiles)
+
+def best_departure(profile):
+    """プロファイルから所要時間が最短の出発を選ぶ（同じなら遅い出発＝待ち時間が少ない方）"""
+    if not profile: return None
+    return min(profile, key=lambda e: (e.total_time, -e.departure_time))
+
+
+# --- 5. McRAPTOR: (所要時間, 乗り換え, 徒歩, 待ち時間) のパレート集合を1回の探索で ---
+class Label:
+    """McRAPTOR のラベル（駅に着いた1通りの行き方）。parent をたどると経路になる。route == -1 は徒歩"""
+    __slots__ = ("time", "walk", "wait", "rides", "station", "parent", "route", "board_idx", "alight_idx")
+
+    def __init__(self, time, walk, wait, rides, station, parent=None, route=-1, board_idx=-1, alight_idx=-1):
+        self.time = time
+        self.walk = walk
+        self.wait = wait
+        self.rides = rides
+        self.station = station
+        self.parent = parent
+        self.route = route
+        self.board_idx = board_idx
+        self.alight_idx = alight_idx
+
+    def dominates(self, other):
+        """全基準で other 以下（乗車回数も含む）"""
+        return (self.time <= other.time and self.walk <= other.walk and self.wait <= other.wait
+                and self.rides <= other.rides)
+
+class McRouteResult(RouteResult):
+    """find_routes_mcraptor の結果1件。walk_time / wait_time は経路中の徒歩・待ち時間の合計（分）"""
+    __slots__ = ("walk_time", "wait_time")
+
+    def __init__(self, transfers, total_time, path_details, walk_time, wait_time):
+        super().__init__(transfers, total_time, path_details)
+        self.walk_time = walk_time
+        self.wait_time = wait_time
+
+def _bag_insert(bag, label, max_bag):
+    """
+    bag（パレート集合）に label を入れる。どれかに支配されていれば入れずに False。
+    label が支配するものは取り除く。max_bag を超えたら所要時間の一番長いものを捨てる（捨てたのが label なら False）。
+    """
+    for other in bag:
+        if other.dominates(label): return False
+    bag[:] = [other for other in bag if not label.dominates(other)]
+    bag.append(label)
+    if len(bag) > max_bag:
+        worst = max(bag, key=lambda l: (l.time, l.walk, l.wait))
+        bag.remove(worst)
+        if worst is label: return False
+    return True
+
+_FOOTPATHS = weakref.WeakKeyDictionary()
+
+def footpaths(network=None, model=edges.RAPTOR_MODEL):
+    """駅番号 -> ((歩いて行ける駅番号, 分), ...)。edges.EdgeTable.walk_edges の近い駅どうし（両方向）"""
+    net = network or DEFAULT_NETWORK
+    cached = _FOOTPATHS.get(net)
+    if cached is not None: return cached
+    table = net.edge_table
+    src, dst, minutes = table.walk_edges(model)
+    paths = [[] for _ in net.station_names]
+    for i, j, t in zip(src.tolist(), dst.tolist(), minutes.tolist()):
+        a, b = net.station_index.get(table.stations[i]), net.station_index.get(table.stations[j])
+        if a is None or b is None: continue
+        paths[a].append((b, t))
+        paths[b].append((a, t))
+    cached = _FOOTPATHS[net] = tuple(tuple(p) for p in paths)
+    return cached
+
+def find_routes_mcraptor(start_node, end_node, max_transfers=4, walking=True, max_bag=8, network=None):
+    """
+    多基準 RAPTOR (McRAPTOR)。(所要時間, 乗り換え回数, 徒歩時間, 待ち時間) のどれかで他に負けない経路を
+    1回の探索で全部返す（McRouteResult のリスト、乗り換え回数・所要時間の順）。
+    walking=True なら近い駅どうし（edges.RAPTOR_MODEL の max_walk_km 以内）を歩いて乗り換えられる。
+    各駅のラベル集合は max_bag 件までに抑える（超えたら所要時間の長いものから捨てるので、応答時間が読める）。
+    walking=False のとき、所要時間・乗り換え回数だけで見た最良の組は find_routes_raptor の結果と同じ。
+    """
+    if start_node == end_node:
+        return [McRouteResult(0, 0, [], 0, 0)]
+    net = network or DEFAULT_NETWORK
+    start_id, target_id = net.station_index.get(start_node), net.station_index.get(end_node)
+    if start_id is None or target_id is None: return []
+    routes, route_station_ids, station_routes = net.routes, net.route_station_ids, net.station_routes
+    walks = footpaths(net) if walking else None
+
+    bags = {start_id: [Label(0.0, 0.0, 0.0, 0, start_id)]}  # 駅番号 -> 全ラウンドを通したパレート集合
+    target_bag = []
+
+    def relax(label):
+        # 目的地のラベルに支配されるなら、その先も良くならない（全基準が単調に増えるので）
+        for t in target_bag:
+            if t.dominates(label): return False
+        if not _bag_insert(bags.setdefault(label.station, []), label, max_bag): return False
+        if label.station == target_id: _bag_insert(target_bag, label, max_bag)
+        return True
+
+    def walk_from(new_labels):
+        # 電車で着いたラベルから1回だけ歩く（歩いた先からさらに歩くことはしない）
+        walked = []
+        for label in new_labels:
+            if label.route == -1 and label.parent is not None: continue
+            for q, minutes in walks[label.station]:
+                w = Label(label.time + minutes, label.walk + minutes, label.wait, label.rides, q, label)
+                if relax(w): walked.append(w)
+        return walked
+
+    # 今のラウンドで乗車できるラベル（前のラウンドで新しくできたもの）
+    frontier = [bags[start_id][0]]
+    if walking: frontier += walk_from(frontier)
+
+    for k in range(1, max_transfers + 1):
+        by_station = {}
+        for label in frontier:
+            by_station.setdefault(label.station, []).append(label)
+        queue_routes = {}
+        for s in by_station:
+            for r_idx, s_idx in station_routes[s]:
+                bounds = queue_routes.setdefault(r_idx, [s_idx, s_idx])
+                if s_idx < bounds[0]: bounds[0] = s_idx
+                if s_idx > bounds[1]: bounds[1] = s_idx
+
+        new_labels = []
+        for r_idx, (lo, hi) in queue_routes.items():
+            station_ids = route_station_ids[r_idx]
+            cum = routes[r_idx].cum_times
+            route_wait = (routes[r_idx].interval / 2.0) + 2.0
+            for sign, scan in ((1, range(lo, len(station_ids))), (-1, range(hi, -1, -1))):
+                # 乗っている列車の集合: [到着時刻の基準 key, 乗車前のラベル, 乗車位置, 待ち時間の合計]
+                # 駅 i への到着 = key + sign * cum[i]（走査の間は key で比べれば到着時刻で比べたのと同じ）
+                route_bag = []
+                for i in scan:
+                    s_curr = station_ids[i]
+                    # A. 降車
+                    for key, prev, b_idx, wait in route_bag:
+                        label = Label(key + sign * cum[i], prev.walk, wait, k, s_curr, prev, r_idx, b_idx, i)
+                        if relax(label): new_labels.append(label)
+                    # B. 乗車（最初の乗車だけ待ち時間なし）
+                    for prev in by_station.get(s_curr, ()):
+                        w = 0.0 if prev.rides == 0 else route_wait
+                        key = prev.time + w - sign * cum[i]
+                        entry = (key, prev, i, prev.wait + w)
+                        if any(e[0] <= key and e[1].walk <= prev.walk and e[3] <= entry[3] for e in route_bag): continue
+                        route_bag = [e for e in route_bag
+                                     if not (key <= e[0] and prev.walk <= e[1].walk and entry[3] <= e[3])]
+                        route_bag.append(entry)
+                        if len(route_bag) > max_bag:
+                            route_bag.remove(max(route_bag, key=lambda e: e[0]))
+
+        # 同じラウンドで後から支配されて集合から外れたラベルは、次のラウンドで乗らない
+        frontier = [l for l in new_labels if any(l is x for x in bags.get(l.station, ()))]
+        if walking: frontier += walk_from(frontier)
+        if not frontier: break
+
+    results = []
+    for label in sorted(target_bag, key=lambda l: (l.rides, l.time, l.walk, l.wait)):
+        path = []
+        node = label
+        while node.parent is not None:
+            prev = node.parent
+            if node.route == -1:
+                path.append(PathSegment("徒歩", net.station_names[prev.station], net.station_names[node.station],
+                                        node.time - prev.time, 0))
+            else:
+                route = routes[node.route]
+                path.append(PathSegment(route.line_name, net.station_names[prev.station],
+                                        net.station_names[node.station],
+                                        calculate_travel_time(route, node.board_idx, node.alight_idx),
+                                        node.wait - prev.wait))
+            node = prev
+        path.reverse()
+        results.append(McRouteResult(max(label.rides - 1, 0), label.time, path, label.walk, label.wait))
+    return results
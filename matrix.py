@@ -0,0 +1,112 @@
+import numpy as np
+import logic
+
+# --- 1. 全駅間の所要時間行列 ---
+class TravelTimeMatrix:
+    """
+    times[i, j] = stations[i] から stations[j] への最短所要時間（分, float32, 到達不能は inf）。
+    値は logic.find_routes_raptor の最短 total_time と同じモデル。
+    row / column / time には (緯度, 経度) も渡せる（近くの駅まで歩く時間 + その駅の行・列の最小値）。
+    """
+    def __init__(self, stations, times):
+        self.stations = list(stations)
+        self.index = {s: i for i, s in enumerate(self.stations)}
+        self.times = times
+        # 並べ替え済みの行・列（閾値アルゴリズムの sorted access 用）は必要になった分だけ作る
+        self._row_order = {}
+        self._col_order = {}
+
+    def time(self, start, end):
+        if logic.is_coordinate(start) or logic.is_coordinate(end):
+            if logic.is_coordinate(end):
+                t = float(np.min(self.row(start) + self._walks(end), initial=np.inf))
+            else:
+                j = self.index.get(end)
+                t = float('inf') if j is None else float(self.row(start)[j])
+            walk = logic.direct_walk(start, end)
+            return t if walk is None else min(t, walk)
+        i, j = self.index.get(start), self.index.get(end)
+        if i is None or j is None: return float('inf')
+        return float(self.times[i, j])
+
+    def _walks(self, place):
+        """place の近くの駅まで歩く時間を行列の駅の並びで（使わない駅は inf）"""
+        walks = np.full(len(self.stations), np.inf, dtype=np.float32)
+        names = logic.DEFAULT_NETWORK.station_names
+        for s_id, walk in logic.access_seeds(place).items():
+            i = self.index.get(names[s_id])
+            if i is not None: walks[i] = walk
+        return walks
+
+    def _nearby(self, place):
+        """[(行列の番号, 歩く分), ...]"""
+        walks = self._walks(place)
+        return [(i, walks[i]) for i in np.flatnonzero(np.isfinite(walks))]
+
+    def row(self, origin):
+        """origin から各駅への所要時間（未知の駅なら全部 inf）"""
+        if logic.is_coordinate(origin):
+            out = np.full(len(self.stations), np.inf, dtype=np.float32)
+            for i, walk in self._nearby(origin): np.minimum(out, self.times[i] + walk, out=out)
+            return out
+        i = self.index.get(origin)
+        if i is None: return np.full(len(self.stations), np.inf, dtype=np.float32)
+        return self.times[i]
+
+    def column(self, dest):
+        """各駅から dest への所要時間"""
+        if logic.is_coordinate(dest):
+            out = np.full(len(self.stations), np.inf, dtype=np.float32)
+            for j, walk in self._nearby(dest): np.minimum(out, self.times[:, j] + walk, out=out)
+            return out
+        j = self.index.get(dest)
+        if j is None: return np.full(len(self.stations), np.inf, dtype=np.float32)
+        return self.times[:, j]
+
+    def replace_rows(self, rows, values):
+        """
+        行番号 rows の行を values に置き換える（運行障害の反映用）。配列ごと作り直して差し替えるので、
+        読んでいる途中の検索は古い配列を最後まで使える。並べ替え済みの行・列は値が変わったものだけ捨てる。
+        """
+        times = self.times.copy()
+        changed_cols = np.flatnonzero((times[rows] != values).any(axis=0))
+        times[rows] = values
+        self.times = times
+        for i in rows: self._row_order.pop(self.stations[i], None)
+        for j in changed_cols: self._col_order.pop(self.stations[j], None)
+
+    def sorted_from(self, origin):
+        """origin から近い順の駅インデックス（座標は運行障害で古くならないよう覚えない）"""
+        if logic.is_coordinate(origin): return np.argsort(self.row(origin), kind="stable")
+        if origin not in self._row_order:
+            self._row_order[origin] = np.argsort(self.row(origin), kind="stable")
+        return self._row_order[origin]
+
+    def sorted_to(self, dest):
+        """dest まで近い順の駅インデックス"""
+        if logic.is_coordinate(dest): return np.argsort(self.column(dest), kind="stable")
+        if dest not in self._col_order:
+            self._col_order[dest] = np.argsort(self.column(dest), kind="stable")
+        return self._col_order[dest]
+
+def time_rows(origins, stations, max_transfers=4, network=None):
+    """origins から stations（行列の列の並び）への所要時間 (len(origins), len(stations))。路線にない駅は inf"""
+    net = network or logic.DEFAULT_NETWORK
+    columns = np.array([net.station_index.get(s, -1) for s in stations], dtype=np.intp)
+    known = columns >= 0
+    rows = np.full((len(origins), len(stations)), np.inf, dtype=np.float32)
+    rows[:, known] = logic.find_arrival_times_batch(origins, max_transfers, net)[:, columns[known]]
+    return rows
+
+def build_time_matrix(stations=None, max_transfers=4, block_size=128, network=None):
+    """
+    複数出発駅の一括 RAPTOR (logic.find_arrival_times_batch) で行列を作る。
+    block_size 駅ずつまとめて探索するので、作業用の配列は block_size × 駅数 に収まる。
+    """
+    if stations is None:
+        stations = list(logic.STATION_NAMES)
+    times = np.full((len(stations), len(stations)), np.inf, dtype=np.float32)
+    for start in range(0, len(stations), block_size):
+        block = stations[start:start + block_size]
+        times[start:start + len(block)] = time_rows(block, stations, max_transfers, network)
+    return TravelTimeMatrix(stations, times)
@@ -0,0 +1,411 @@
+import heapq
+from collections import Counter, OrderedDict
+import numpy as np
+import logic
+
+# --- 1. 結果のレコードと目的関数 ---
+class MeetingResult:
+    """集合場所の候補1件。times は各メンバーの (往路, 復路)、details は表示用の文字列"""
+    __slots__ = ("station", "total_time", "max_time", "times", "details")
+
+    def __init__(self, station, total_time, max_time, times=None, details=None):
+        self.station = station
+        self.total_time = total_time
+        self.max_time = max_time
+        self.times = times
+        self.details = details
+
+class MemberRoutes:
+    """1人分の往路・復路の最短ルート（logic.RouteResult）"""
+    __slots__ = ("name", "outward", "return_route")
+
+    def __init__(self, name, outward, return_route):
+        self.name = name
+        self.outward = outward
+        self.return_route = return_route
+
+
+# 比較キー: 効率重視は (合計, 最大)、公平重視は (最大, 合計)（app.py の並べ替えと同じ）
+def _score_key(objective, total_time, max_time):
+    return (total_time, max_time) if objective == "sum" else (max_time, total_time)
+
+
+# --- 2. 閾値アルゴリズム (Fagin's TA) による上位k件の集合場所探索 ---
+def top_k_meeting(matrix, members, k=3, objective="sum", candidates=None):
+    """
+    各メンバーの「往路（現在地→候補）」「復路（候補→次の予定）」を所要時間順のリストとして
+    先頭から読み進め、未評価の候補がこれ以上良くならないと閾値で証明できた時点で打ち切る。
+
+    members: [{"current": 駅, "next": 駅, ...}, ...]
+    objective: "sum"（合計時間 最小）または "max"（最大時間 最小）
+    candidates: 集合場所にしてよい駅（None なら行列の全駅）
+    戻り値: (ranking, stats)
+        ranking = [MeetingResult, ...]（良い順、times に各メンバーの (往路, 復路)）
+        stats = {"touched": 評価した候補数, "depth": 読み進めた深さ, "candidates": 候補総数}
+    """
+    n = len(matrix.stations)
+    if candidates is None:
+        allowed = np.ones(n, dtype=bool)
+    else:
+        allowed = np.zeros(n, dtype=bool)
+        for s in candidates:
+            i = matrix.index.get(s)
+            if i is not None: allowed[i] = True
+
+    # 2M 本のリスト: (値の配列, 昇順のインデックス)
+    values, orders = [], []
+    for m in members:
+        values.append(matrix.row(m["current"]))
+        orders.append(matrix.sorted_from(m["current"]))
+        values.append(matrix.column(m["next"]))
+        orders.append(matrix.sorted_to(m["next"]))
+
+    seen = np.zeros(n, dtype=bool)
+    top = []  # 符号を反転したキーの最大ヒープ（上位k件のうち最悪のものが先頭）
+    touched = 0
+    depth = 0
+
+    while depth < n:
+        # 1. sorted access: 各リストの depth 番目を読む
+        lower = []
+        for vals, order in zip(values, orders):
+            c = order[depth]
+            # 閾値は候補の採点と同じ float64 で足す（float32 のまま足すと丸めで同点の候補を取りこぼす）
+            lower.append(float(vals[c]))
+            if seen[c] or not allowed[c]: continue
+            seen[c] = True
+
+            # 2. random access: その候補の全メンバーの時間を引いてスコア計算
+            touched += 1
+            times = [(float(values[2*j][c]), float(values[2*j+1][c])) for j in range(len(members))]
+            per_member = [o + r for o, r in times]
+            total_time, max_time = sum(per_member), max(per_member)
+            if total_time == float('inf'): continue
+            key = _score_key(objective, total_time, max_time)
+            item = ((-key[0], -key[1]), matrix.stations[c], total_time, max_time, times)
+            if len(top) < k:
+                heapq.heappush(top, item)
+            elif item[0] > top[0][0]:
+                heapq.heapreplace(top, item)
+        depth += 1
+
+        # 3. 閾値: 未評価の候補は各リストで今読んだ値以上になる
+        bounds = [lower[2*j] + lower[2*j+1] for j in range(len(members))]
+        threshold = _score_key(objective, sum(bounds), max(bounds))
+        if threshold[0] == float('inf'): break
+        if len(top) == k and (-top[0][0][0], -top[0][0][1]) <= threshold: break
+
+    ranking = [MeetingResult(station, total_time, max_time, times)
+               for _, station, total_time, max_time, times in sorted(top, reverse=True)]
+    stats = {"touched": touched, "depth": depth, "candidates": int(allowed.sum())}
+    return ranking, stats
+
+
+# --- 3. 候補を1つずつ評価しながら途中経過を返す探索（時刻表モード用） ---
+class CancelToken:
+    """協調的なキャンセル用の旗。検索条件が変わったら呼び出し側が cancel() する"""
+    __slots__ = ("cancelled",)
+
+    def __init__(self):
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+def stream_meeting(evaluate, candidates, k=3, objective="sum", cancel=None, batch=10):
+    """
+    evaluate(candidate, bound) -> MeetingResult（到達不能なら None）を候補ごとに呼び、
+    batch 件評価するたびに (暫定の上位k件, 評価済み数, 候補総数) を yield する。
+    最後の yield の ranking が最終結果。cancel.cancelled が立ったらその場で止まる。
+    bound は上位k件が埋まった後の「k位の主キー」（objective="sum" なら合計、"max" なら最大）で、
+    それを超える候補は上位に入らないので evaluate は途中で諦めて None を返してよい。
+    """
+    candidates = list(candidates)
+    top = []  # top_k_meeting と同じく、符号を反転したキーの最大ヒープ
+    for idx, candidate in enumerate(candidates):
+        if cancel is not None and cancel.cancelled: return
+        bound = -top[0][0][0] if len(top) == k else None
+        r = evaluate(candidate, bound)
+        if r is not None:
+            key = _score_key(objective, r.total_time, r.max_time)
+            item = ((-key[0], -key[1]), idx, r)
+            if len(top) < k:
+                heapq.heappush(top, item)
+            elif item[0] > top[0][0]:
+                heapq.heapreplace(top, item)
+        if (idx + 1) % batch == 0 or idx + 1 == len(candidates):
+            yield [item[2] for item in sorted(top, reverse=True)], idx + 1, len(candidates)
+
+
+# --- 4. 大人数モード（6人以上） ---
+class ProfileStore:
+    """
+    駅ごとの往路プロファイル（その駅から全駅へ）と復路プロファイル（全駅からその駅へ）を
+    float32 ベクトルで持つ。行列があればその行・列をそのまま使い（コピーなし）、
+    なければ RAPTOR で1本ずつ作って budget_bytes を超えたら古いものから捨てる（LRU）。
+    disk (cache.ResultCache) を渡すと、作ったプロファイルをディスクにも保存して再起動後も使い回す。
+    network を渡すとそのネットワークで作る（運行障害中は DisruptionManager.network）。
+    """
+    def __init__(self, stations, matrix=None, budget_bytes=32 * 1024 * 1024, max_transfers=4, disk=None, network=None):
+        self.stations = list(stations)
+        self.index = {s: i for i, s in enumerate(self.stations)}
+        self.matrix = matrix
+        self.budget_bytes = budget_bytes
+        self.max_transfers = max_transfers
+        self.disk = disk
+        self.network = network
+        self._cache = OrderedDict()  # (向き, 駅) -> ベクトル
+        self.nbytes = 0
+        self._bypass_disk = frozenset()  # 運行障害中でディスクの（平常時の）値を使えない (向き, 駅)
+        # logic.STATION_NAMES 順のベクトルを self.stations 順に並べ替えるための列番号
+        self._columns = np.array([logic.STATION_INDEX.get(s, -1) for s in self.stations], dtype=np.intp)
+        self._known = self._columns >= 0
+
+    def _vector(self, base):
+        """logic.STATION_NAMES 順のベクトルを self.stations 順にする（路線にない駅は inf）"""
+        vec = np.full(len(self.stations), np.inf, dtype=np.float32)
+        vec[self._known] = base[self._columns[self._known]]
+        return vec
+
+    def _compute(self, direction, station):
+        """1駅ぶんのプロファイルを logic.STATION_NAMES 順で作る（ディスクにあればそれを使う）"""
+        # 座標（logic.access_seeds の多始点）はディスクに置かない
+        use_disk = self.disk is not None and (direction, station) not in self._bypass_disk \
+            and not logic.is_coordinate(station)
+        if use_disk:
+            base = self.disk.get_profile(direction, station, self.max_transfers)
+            if base is not None: return base
+        if direction == "out":
+            times = logic.find_arrival_times(station, self.max_transfers, self.network)
+        else:
+            times = logic.find_departure_times(station, self.max_transfers, self.network)
+        base = np.full(len(logic.STATION_NAMES), np.inf, dtype=np.float32)
+        for s, t in times.items():
+            i = logic.STATION_INDEX.get(s)
+            if i is not None: base[i] = t
+        if use_disk: self.disk.put_profile(direction, station, base, self.max_transfers)
+        return base
+
+    def _put(self, key, vec):
+        self._cache[key] = vec
+        self.nbytes += vec.nbytes
+        while self.nbytes > self.budget_bytes and len(self._cache) > 1:
+            _, old = self._cache.popitem(last=False)
+            self.nbytes -= old.nbytes
+
+    def _get(self, direction, station):
+        key = (direction, station)
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            return self._cache[key]
+        vec = self._vector(self._compute(direction, station))
+        self._put(key, vec)
+        return vec
+
+    def prefetch_outward(self, origins):
+        """まだない往路プロファイルを一括 RAPTOR でまとめて作る（路線の走査を出発駅間で共有）"""
+        if self.matrix is not None: return
+        # 一括探索は駅だけ（座標は outward で1つずつ作る）
+        missing = [o for o in dict.fromkeys(origins) if ("out", o) not in self._cache and not logic.is_coordinate(o)]
+        if self.disk is not None:
+            # ディスクにあるものはそのまま読み込み、残りだけ一括で探索する
+            remaining = []
+            for origin in missing:
+                base = None
+                if ("out", origin) not in self._bypass_disk:
+                    base = self.disk.get_profile("out", origin, self.max_transfers)
+                if base is None: remaining.append(origin)
+                else: self._put(("out", origin), self._vector(base))
+            missing = remaining
+        if not missing: return
+        block = logic.find_arrival_times_batch(missing, self.max_transfers, self.network)
+        for origin, row in zip(missing, block):
+            if self.disk is not None and ("out", origin) not in self._bypass_disk:
+                self.disk.put_profile("out", origin, row, self.max_transfers)
+            self._put(("out", origin), self._vector(row))
+
+    def invalidate(self, origins=(), destinations=(), bypass_disk=(), network=None):
+        """
+        運行障害などで変わった往路 (origins)・復路 (destinations) のプロファイルをメモリから捨てる
+        （次に使うときに network で作り直す）。bypass_disk の (向き, 駅) は、ディスクにある
+        平常時の値を読み書きしない（障害が解除されたら空にして呼び直す）。
+        """
+        self.network = network
+        for key in [("out", s) for s in origins] + [("in", s) for s in destinations]:
+            vec = self._cache.pop(key, None)
+            if vec is not None: self.nbytes -= vec.nbytes
+        self._bypass_disk = frozenset(bypass_disk)
+
+    def outward(self, origin):
+        """origin から各駅への所要時間"""
+        if self.matrix is not None: return self.matrix.row(origin)
+        return self._get("out", origin)
+
+    def inward(self, dest):
+        """各駅から dest への所要時間"""
+        if self.matrix is not None: return self.matrix.column(dest)
+        return self._get("in", dest)
+
+def large_group_meeting(store, members, k=3, objective="sum", candidates=None):
+    """
+    大人数向けの集合場所探索。(現在地, 次の予定) が同じメンバーは1つにまとめ（重み付き）、
+    まとめたグループごとに往路+復路のベクトルを足し込んでいく（ストリーミング集計）。
+    保持するのは候補数ぶんの累積ベクトル2本だけなので、人数が増えてもメモリは一定。
+    戻り値: (ranking, stats)  ranking は top_k_meeting と同じ形（times は None）
+    """
+    n = len(store.stations)
+    groups = Counter((m["current"], m["next"]) for m in members)
+
+    store.prefetch_outward([current for current, _ in groups])
+
+    total_acc = np.zeros(n, dtype=np.float64)
+    max_acc = np.zeros(n, dtype=np.float32)
+    for (current, nxt), count in groups.items():
+        t = store.outward(current) + store.inward(nxt)
+        total_acc += count * t.astype(np.float64)
+        np.maximum(max_acc, t, out=max_acc)
+
+    allowed = np.ones(n, dtype=bool) if candidates is None else np.zeros(n, dtype=bool)
+    if candidates is not None:
+        for s in candidates:
+            i = store.index.get(s)
+            if i is not None: allowed[i] = True
+    reachable = np.flatnonzero(allowed & np.isfinite(total_acc))
+
+    # (合計, 最大) または (最大, 合計) の辞書順で上位k件
+    primary, secondary = (total_acc, max_acc) if objective == "sum" else (max_acc, total_acc)
+    order = reachable[np.lexsort((secondary[reachable], primary[reachable]))][:k]
+
+    ranking = [MeetingResult(store.stations[i], float(total_acc[i]), float(max_acc[i])) for i in order]
+    stats = {
+        "members": len(members),
+        "distinct": len(groups),
+        "candidates": int(allowed.sum()),
+        "profile_bytes": store.nbytes
+    }
+    return ranking, stats
+
+
+# --- 5. 1人あたりの上限つき探索（到達圏のビット集合で先に絞り込む） ---
+def capped_meeting(matrix, isochrones, members, max_minutes, k=3, objective="sum", candidates=None):
+    """
+    全員の往復時間が max_minutes 以内の候補から上位k件を選ぶ。
+    まず isochrone.IsochroneIndex のビット列の AND で候補を絞り、残った候補だけ所要時間行列で正確に採点する。
+    戻り値: (ranking, stats)  stats = {"candidates": 候補総数, "filtered": 絞り込み後, "feasible": 上限を満たす数}
+    """
+    n = len(matrix.stations)
+    allowed = np.ones(n, dtype=bool) if candidates is None else np.zeros(n, dtype=bool)
+    if candidates is not None:
+        for s in candidates:
+            i = matrix.index.get(s)
+            if i is not None: allowed[i] = True
+    survivors = np.flatnonzero(allowed & isochrones.candidates_within(members, max_minutes))
+
+    outs = np.array([matrix.row(m["current"])[survivors] for m in members], dtype=np.float64)
+    rets = np.array([matrix.column(m["next"])[survivors] for m in members], dtype=np.float64)
+    per_member = outs + rets
+    feasible = (per_member <= max_minutes).all(axis=0)
+    total_acc, max_acc = per_member.sum(axis=0), per_member.max(axis=0, initial=0.0)
+
+    primary, secondary = (total_acc, max_acc) if objective == "sum" else (max_acc, total_acc)
+    order = np.flatnonzero(feasible)
+    order = order[np.lexsort((secondary[order], primary[order]))][:k]
+    ranking = [MeetingResult(matrix.stations[survivors[c]], float(total_acc[c]), float(max_acc[c]),
+                             [(float(o), float(r)) for o, r in zip(outs[:, c], rets[:, c])]) for c in order]
+    stats = {"candidates": int(allowed.sum()), "filtered": len(survivors), "feasible": int(feasible.sum())}
+    return ranking, stats
+
+
+# --- 6. エリア → 駅の2段階探索（候補駅が非常に多い路線網向け） ---
+def hierarchical_meeting(clusters, members, k=3, objective="sum", refine=3, guarantee=False, candidates=None,
+                         max_transfers=4, network=None):
+    """
+    clusters (clusters.ClusterIndex) のエリアごとに「エリア内のどの駅でもこれより良くならない」下界を出し、
+    下界の良い順にエリアを開いて、中の候補駅だけ logic.find_routes_raptor で正確に採点する
+    （k位の値を上限に打ち切るので、悪い候補の経路探索はすぐ終わる）。
+    refine: 開くエリアの数（速さと精度のつまみ。小さいほど速いが、最適な駅を取りこぼすことがある）
+    guarantee=True なら、まだ開いていないエリアの下界が k位の値以上になるまで開き続ける（上位k件は厳密な最適解）。
+    refine 個で止めても、残りのエリアの下界が k位以上なら stats["proven"] は True。
+    network: 採点に使うネットワーク（運行障害中は DisruptionManager.network。平常時の clusters の下界はそのまま使える）
+    戻り値: (ranking, stats)
+        ranking は top_k_meeting と同じ形（times に各メンバーの (往路, 復路)）
+        stats = {"clusters": 候補のあるエリア数, "refined": 開いたエリア数, "evaluated": 採点した駅数,
+                 "candidates": 候補総数, "proven": 厳密な最適解と証明できたか, "bound": 開いていないエリアの最小の下界}
+    """
+    INF = float('inf')
+    allowed = set(clusters.stations) if candidates is None else {s for s in candidates if s in clusters.index}
+    inside = [[] for _ in range(clusters.n_clusters)]
+    for s in allowed: inside[clusters.cluster_of[clusters.index[s]]].append(s)
+    for stations in inside: stations.sort(key=clusters.index.get)
+
+    # 1. エリアの下界（同じ出発・行き先のメンバーはまとめて重みにする）
+    groups = Counter((m["current"], m["next"]) for m in members)
+    lb_total = np.zeros(clusters.n_clusters, dtype=np.float64)
+    lb_max = np.zeros(clusters.n_clusters, dtype=np.float64)
+    bounds = {}  # (現在地, 次の予定) -> (往路の下界, 復路の下界)
+    for (current, nxt), count in groups.items():
+        bounds[(current, nxt)] = (clusters.outward_bounds(current).astype(np.float64),
+                                  clusters.inward_bounds(nxt).astype(np.float64))
+        per = bounds[(current, nxt)][0] + bounds[(current, nxt)][1]
+        lb_total += count * per
+        np.maximum(lb_max, per, out=lb_max)
+    primary, secondary = (lb_total, lb_max) if objective == "sum" else (lb_max, lb_total)
+    open_clusters = np.flatnonzero(np.isfinite(primary) & np.array([len(s) > 0 for s in inside]))
+    order = open_clusters[np.lexsort((secondary[open_clusters], primary[open_clusters]))]
+
+    # 2. 候補駅の正確な採点（k位の主キーを上限に経路探索を打ち切る）
+    top = []  # top_k_meeting と同じく、符号を反転したキーの最大ヒープ
+    evaluated = 0
+
+    def evaluate(candidate, c):
+        bound = -top[0][0][0] if len(top) == k else None
+        # 下界の大きいメンバーから調べる（早く上限を超えて打ち切れる）
+        todo = sorted(groups.items(), key=lambda g: -(bounds[g[0]][0][c] + bounds[g[0]][1][c]))
+        rest = sum(count * (bounds[g][0][c] + bounds[g][1][c]) for g, count in todo)
+        times, spent, worst = {}, 0.0, 0.0
+        for (current, nxt), count in todo:
+            out_lb, ret_lb = bounds[(current, nxt)][0][c], bounds[(current, nxt)][1][c]
+            rest -= count * (out_lb + ret_lb)
+            # この人の往復に使える時間: 合計なら k位の値から、調べ済みの分と残りの人の下界を引いた分
+            budget = None if bound is None else ((bound - spent - rest) / count if objective == "sum" else bound)
+            outward = logic.find_routes_raptor(current, candidate, max_transfers, network=network,
+                                               upper_bound=None if budget is None else budget - ret_lb)
+            if not outward: return None
+            out_t = min(r.total_time for r in outward)
+            if budget is not None: budget -= out_t
+            ret = logic.find_routes_raptor(candidate, nxt, max_transfers, network=network, upper_bound=budget)
+            if not ret: return None
+            ret_t = min(r.total_time for r in ret)
+            times[(current, nxt)] = (out_t, ret_t)
+            spent += count * (out_t + ret_t)
+            worst = max(worst, out_t + ret_t)
+        return spent, worst, [times[(m["current"], m["next"])] for m in members]
+
+    refined, proven, bound = 0, True, INF
+    for c in order:
+        lower = (primary[c], secondary[c])
+        if len(top) == k and (-top[0][0][0], -top[0][0][1]) <= lower:
+            # 残りのエリアはどれも下界が k位以上（下界の順に開いているので）
+            bound = float(primary[c])
+            break
+        if not guarantee and refined >= refine:
+            proven, bound = False, float(primary[c])
+            break
+        refined += 1
+        for candidate in inside[c]:
+            evaluated += 1
+            r = evaluate(candidate, c)
+            if r is None: continue
+            total_time, max_time, times = r
+            key = _score_key(objective, total_time, max_time)
+            item = ((-key[0], -key[1]), candidate, total_time, max_time, times)
+            if len(top) < k:
+                heapq.heappush(top, item)
+            elif item[0] > top[0][0]:
+                heapq.heapreplace(top, item)
+
+    ranking = [MeetingResult(station, total_time, max_time, times)
+               for _, station, total_time, max_time, times in sorted(top, reverse=True)]
+    stats = {"clusters": len(order), "refined": refined, "evaluated": evaluated, "candidates": len(allowed),
+             "proven": proven, "bound": bound}
+    return ranking, stats
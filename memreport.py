@@ -0,0 +1,73 @@
+import argparse
+import random
+import tracemalloc
+import data
+import logic
+import matrix
+import meeting
+
+# --- tracemalloc によるクエリあたりのメモリ確保レポート ---
+# 使い方: python memreport.py --queries 50
+# 変更の前後で実行して数字を比べる（同じ seed なら同じクエリ列になる）
+
+def _measure(label, fn, queries):
+    """各クエリのピーク確保量を測って平均を出し、1クエリ目の確保元の上位も表示する"""
+    fn(queries[0])  # import 時の初期化やキャッシュ作成を計測から外す
+    tracemalloc.start(1)
+
+    # 1クエリ目だけスナップショットを取って、どの行で確保しているかを見る
+    tracemalloc.reset_peak()
+    base, _ = tracemalloc.get_traced_memory()
+    before = tracemalloc.take_snapshot()
+    result = fn(queries[0])
+    _, peak = tracemalloc.get_traced_memory()
+    top_stats = tracemalloc.take_snapshot().compare_to(before, "lineno")
+    retained = sum(d.size_diff for d in top_stats)
+    del result
+    peaks = [peak - base]
+
+    for q in queries[1:]:
+        tracemalloc.reset_peak()
+        base, _ = tracemalloc.get_traced_memory()
+        fn(q)
+        _, peak = tracemalloc.get_traced_memory()
+        peaks.append(peak - base)
+    tracemalloc.stop()
+
+    peaks.sort()
+    print(f"[{label}] {len(peaks)} クエリ: ピーク確保 平均 {sum(peaks) / len(peaks) / 1024:.1f} KiB"
+          f" / 最大 {peaks[-1] / 1024:.1f} KiB")
+    print(f"  1クエリ目の結果が持っているメモリ: {retained / 1024:.1f} KiB（上位の確保元）")
+    for stat in sorted(top_stats, key=lambda d: -d.size_diff)[:5]:
+        frame = stat.traceback[0]
+        print(f"    {stat.size_diff / 1024:8.1f} KiB  {frame.filename}:{frame.lineno}")
+
+def main():
+    parser = argparse.ArgumentParser(description="クエリあたりのメモリ確保量を tracemalloc で計測する")
+    parser.add_argument("--queries", type=int, default=30)
+    parser.add_argument("--members", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    stations = list(logic.STATION_TO_ROUTES.keys())
+    pairs = [(rng.choice(stations), rng.choice(stations)) for _ in range(args.queries)]
+    groups = [[{"name": f"メンバー{i+1}", "current": rng.choice(stations), "next": rng.choice(stations)}
+               for i in range(args.members)] for _ in range(args.queries)]
+
+    _measure("find_routes_raptor", lambda q: logic.find_routes_raptor(*q), pairs)
+
+    time_matrix = matrix.build_time_matrix()
+    def meeting_query(members):
+        ranking, _ = meeting.top_k_meeting(time_matrix, members, k=3, candidates=data.STATION_LOCATIONS)
+        # app.py と同じく上位の候補だけ経路を復元する
+        routes = []
+        for r in ranking:
+            for m in members:
+                routes.append(logic.find_routes_raptor(m["current"], r.station))
+                routes.append(logic.find_routes_raptor(r.station, m["next"]))
+        return ranking, routes
+    _measure("meeting (top-3 + 経路復元)", meeting_query, groups)
+
+if __name__ == "__main__":
+    main()
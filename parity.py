@@ -0,0 +1,201 @@
+import argparse
+import random
+import sys
+import time
+import numpy as np
+import graph
+import logic
+import matrix
+
+# --- 探索エンジンの一致確認と応答時間の比較 ---
+# 使い方: python parity.py --queries 300 --seed 0
+#         python parity.py --all-pairs        # 全駅ペアで find_routes_raptor と one-to-all の一致だけを確認
+# 同じ乱数のクエリ列を全エンジンに流し、基準のエンジンと所要時間・乗り換え回数が
+# 許容誤差内で一致するかを調べる。不一致があれば終了コード 1（CI でそのまま使える）。
+#
+# RAPTOR 系（logic）とグラフ系（graph）は所要時間の係数が違う（edges.RAPTOR_MODEL / GRAPH_MODEL）ので、
+# それぞれの系の中で一致を確認し、系どうしの差は参考として分布だけ表示する。
+
+class Backend:
+    """
+    比較対象のエンジン1つ。query(start, end) -> (所要時間, 乗り換え回数 or None)。到達不能は (inf, None)。
+    setup() はクエリの前に1回だけ呼ぶ前計算（応答時間には含めない）。
+    reference は一致を確認する相手のエンジン名（None なら自分が基準）。
+    """
+    __slots__ = ("name", "query", "reference", "setup")
+
+    def __init__(self, name, query, reference=None, setup=None):
+        self.name = name
+        self.query = query
+        self.reference = reference
+        self.setup = setup
+
+BACKENDS = []
+
+def register_backend(name, query, reference=None, setup=None):
+    """新しいエンジン（ハブラベル、CH など）はここに登録すれば自動で比較対象になる"""
+    BACKENDS.append(Backend(name, query, reference, setup))
+
+# --- 1. 既存エンジンの登録 ---
+def _raptor(start, end):
+    routes = logic.find_routes_raptor(start, end)
+    if not routes: return float('inf'), None
+    best = min(routes, key=lambda r: r.total_time)
+    return best.total_time, best.transfers
+
+def _mcraptor(start, end):
+    # 徒歩なしなら、所要時間最短の経路は find_routes_raptor と同じ
+    routes = logic.find_routes_mcraptor(start, end, walking=False)
+    if not routes: return float('inf'), None
+    best = min(routes, key=lambda r: (r.total_time, r.transfers))
+    return best.total_time, best.transfers
+
+def _one_to_all(start, end):
+    return logic.find_arrival_times(start).get(end, float('inf')), None
+
+def _all_to_one(start, end):
+    return logic.find_departure_times(end).get(start, float('inf')), None
+
+_state = {}
+
+def _setup_matrix():
+    _state["matrix"] = matrix.build_time_matrix()
+
+def _matrix(start, end):
+    return _state["matrix"].time(start, end), None
+
+def _setup_graph():
+    _state["graph"] = graph.build_graph()
+    _state["landmarks"] = graph.LandmarkIndex(_state["graph"])
+
+def _count_transfers(path, edge_line):
+    lines = [edge_line.get((u, v)) for u, v in zip(path, path[1:])]
+    return sum(1 for a, b in zip(lines, lines[1:]) if a != b)
+
+def _dijkstra(start, end):
+    cost, path = graph.get_shortest_path(_state["graph"], start, end)
+    if not path: return float('inf'), None
+    return cost, _count_transfers(path, _state["landmarks"].edge_line)
+
+def _alt(start, end):
+    cost, path = graph.get_shortest_path_alt(_state["graph"], start, end, _state["landmarks"])
+    if not path: return float('inf'), None
+    return cost, _count_transfers(path, _state["landmarks"].edge_line)
+
+register_backend("raptor", _raptor)
+register_backend("mcraptor", _mcraptor, reference="raptor")
+register_backend("one_to_all", _one_to_all, reference="raptor")
+register_backend("all_to_one", _all_to_one, reference="raptor")
+register_backend("matrix", _matrix, reference="raptor", setup=_setup_matrix)
+register_backend("dijkstra", _dijkstra, setup=_setup_graph)
+register_backend("alt", _alt, reference="dijkstra")
+
+
+# --- 2. 実行と比較 ---
+def run(queries, backends=None, tolerance=1e-3, transfer_tolerance=0):
+    """
+    各エンジンでクエリを流し、(answers, latencies, mismatches) を返す。
+    answers[name] = [(所要時間, 乗り換え回数), ...]、latencies[name] = 秒の配列、
+    mismatches = [(エンジン名, 基準, クエリ, 値, 基準の値), ...]
+    所要時間の差が tolerance（分）を超えるか、乗り換え回数（両方が返すときだけ）の差が
+    transfer_tolerance を超えたら不一致。
+    """
+    backends = BACKENDS if backends is None else backends
+    answers, latencies = {}, {}
+    for b in backends:
+        if b.setup is not None: b.setup()
+        results, lat = [], []
+        for start, end in queries:
+            t0 = time.perf_counter()
+            results.append(b.query(start, end))
+            lat.append(time.perf_counter() - t0)
+        answers[b.name] = results
+        latencies[b.name] = np.array(lat)
+
+    mismatches = []
+    for b in backends:
+        if b.reference is None or b.reference not in answers: continue
+        for q, (t, tr), (ref_t, ref_tr) in zip(queries, answers[b.name], answers[b.reference]):
+            same_time = (t == ref_t) or abs(t - ref_t) <= tolerance
+            same_transfers = tr is None or ref_tr is None or abs(tr - ref_tr) <= transfer_tolerance
+            if not (same_time and same_transfers):
+                mismatches.append((b.name, b.reference, q, (t, tr), (ref_t, ref_tr)))
+    return answers, latencies, mismatches
+
+def report(answers, latencies, mismatches, out=sys.stdout):
+    print(f"{'engine':<12}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'max ms':>10}{'total s':>10}", file=out)
+    for name, lat in latencies.items():
+        p50, p90, p99 = np.percentile(lat, [50, 90, 99]) * 1000
+        print(f"{name:<12}{p50:>10.3f}{p90:>10.3f}{p99:>10.3f}{lat.max() * 1000:>10.3f}{lat.sum():>10.3f}", file=out)
+
+    print(f"\n不一致: {len(mismatches)} 件", file=out)
+    for name, ref, (s, e), got, want in mismatches[:20]:
+        print(f"  {name} vs {ref}: {s} → {e}  {got[0]:.4f} (乗換 {got[1]}) / {want[0]:.4f} (乗換 {want[1]})", file=out)
+
+    # 係数の違う系どうしの差（参考）
+    roots = [name for name in answers if not any(b.name == name and b.reference for b in BACKENDS)]
+    for i, a in enumerate(roots):
+        for b in roots[i + 1:]:
+            ta = np.array([x[0] for x in answers[a]])
+            tb = np.array([x[0] for x in answers[b]])
+            both = np.isfinite(ta) & np.isfinite(tb)
+            if not both.any(): continue
+            d = tb[both] - ta[both]
+            same_tr = [x[1] == y[1] for x, y, ok in zip(answers[a], answers[b], both) if ok]
+            print(f"\n{b} - {a}（参考）: 所要時間の差 中央値 {np.median(d):+.2f} 分 / 平均 {d.mean():+.2f} 分"
+                  f" / 範囲 {d.min():+.2f} ～ {d.max():+.2f} 分、乗り換え回数の一致 {np.mean(same_tr):.0%}"
+                  f"（到達可否の不一致 {int((np.isfinite(ta) != np.isfinite(tb)).sum())} 件）", file=out)
+
+# --- 3. 全駅ペアの確認 ---
+def check_all_pairs(tolerance=1e-3, network=None):
+    """
+    全駅ペアで find_routes_raptor の最短 total_time が、打ち切りのない one-to-all（find_arrival_times）と
+    一致するかを調べる（ランダムなクエリでは当たらないペアも漏らさない）。
+    戻り値: [(出発, 到着, find_routes_raptor の値, find_arrival_times の値), ...]
+    """
+    stations = (network or logic.DEFAULT_NETWORK).station_names
+    mismatches = []
+    for start in stations:
+        arrivals = logic.find_arrival_times(start, network=network)
+        for end in stations:
+            routes = logic.find_routes_raptor(start, end, network=network)
+            t = min((r.total_time for r in routes), default=float('inf'))
+            want = arrivals.get(end, float('inf'))
+            if not (t == want or abs(t - want) <= tolerance):
+                mismatches.append((start, end, t, want))
+    return mismatches
+
+def main():
+    parser = argparse.ArgumentParser(description="探索エンジンの一致確認と応答時間の比較")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--tolerance", type=float, default=1e-3, help="所要時間の許容誤差（分）")
+    parser.add_argument("--transfer-tolerance", type=int, default=0, help="乗り換え回数の許容差")
+    parser.add_argument("--engines", help="カンマ区切りで比較するエンジンを絞る（基準のエンジンも含めること）")
+    parser.add_argument("--all-pairs", action="store_true",
+                        help="全駅ペアで find_routes_raptor と find_arrival_times の一致だけを調べる")
+    args = parser.parse_args()
+
+    if args.all_pairs:
+        t0 = time.perf_counter()
+        mismatches = check_all_pairs(args.tolerance)
+        n = len(logic.STATION_NAMES)
+        print(f"全 {n * n} ペア（{time.perf_counter() - t0:.1f} 秒）: 不一致 {len(mismatches)} 件")
+        for start, end, t, want in mismatches[:20]:
+            print(f"  {start} → {end}  find_routes_raptor {t:.4f} / find_arrival_times {want:.4f}")
+        return 1 if mismatches else 0
+
+    rng = random.Random(args.seed)
+    stations = list(logic.STATION_NAMES)
+    queries = [(rng.choice(stations), rng.choice(stations)) for _ in range(args.queries)]
+    backends = BACKENDS
+    if args.engines:
+        wanted = set(args.engines.split(","))
+        backends = [b for b in BACKENDS if b.name in wanted]
+
+    answers, latencies, mismatches = run(queries, backends, args.tolerance, args.transfer_tolerance)
+    report(answers, latencies, mismatches)
+    return 1 if mismatches else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,42 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+import logic
+
+# --- 複数クエリの並列実行 ---
+# logic.Network は作った後は読むだけで、探索の作業領域（logic.RaptorScratch）はスレッドごとに持つので、
+# 同じネットワークをロックなしで複数のワーカーから同時に探索できる。
+# 作業領域はワーカーが最初に探索したときに1回だけ作られ、以降のクエリでは使い回す。
+
+class QueryPool:
+    """
+    ThreadPoolExecutor の薄いラッパー。
+    pool.map([(出発, 到着), ...]) は logic.find_routes_raptor の結果のリストを入力と同じ順で返す。
+    """
+    def __init__(self, workers=None, network=None, max_transfers=4):
+        self.workers = workers or min(8, os.cpu_count() or 1)
+        self.network = network
+        self.max_transfers = max_transfers
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="hub-finder-query")
+
+    def submit(self, start_node, end_node, **kwargs):
+        kwargs.setdefault("max_transfers", self.max_transfers)
+        kwargs.setdefault("network", self.network)
+        return self._executor.submit(logic.find_routes_raptor, start_node, end_node, **kwargs)
+
+    def map(self, pairs, **kwargs):
+        futures = [self.submit(start, end, **kwargs) for start, end in pairs]
+        return [f.result() for f in futures]
+
+    def arrival_times(self, origins):
+        """出発駅ごとの logic.find_arrival_times を並列に求める"""
+        futures = [self._executor.submit(logic.find_arrival_times, s, self.max_transfers, self.network) for s in origins]
+        return [f.result() for f in futures]
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,71 @@
+import json
+import os
+import threading
+import time
+import logic
+
+# --- 集合場所クエリの記録（任意） ---
+# 環境変数 HUB_FINDER_QUERY_LOG に JSONL ファイルのパスを設定したときだけ記録する。
+# 1行1クエリ: {"ts": 秒, "mode": "ta" | "large" | "capped" | "hierarchical" | "timetable", "objective": "sum" | "max",
+#              "members": [[現在地, 次の予定], ...], "max_minutes": 上限 or null, "elapsed_ms": 応答時間,
+#              "cache_hit": 保存済みの結果を使ったか}
+# hierarchical の記録には "refine" / "guarantee"（2段階探索のつまみ）も入る。
+# メンバー名は残さず、(現在地, 次の予定) の組は並べ替えてから書く（誰がどの駅かは分からない）。
+# 座標の場所は [緯度, 経度] を小数3桁（約100m）に丸めて書く（自宅の位置をそのまま残さない）。
+# replay.py で同じクエリ列を流し直して負荷試験に使う。
+
+LOG_ENV = "HUB_FINDER_QUERY_LOG"
+COORD_DIGITS = 3
+
+class QueryLog:
+    """JSONL への追記（複数スレッドから呼んでも1行ずつ書く）"""
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def record(self, mode, members, objective, elapsed, cache_hit=False, max_minutes=None, options=None):
+        """options: モードのつまみ（hierarchical の refine / guarantee など）。そのまま記録に足す"""
+        entry = {
+            "ts": round(time.time(), 3),
+            "mode": mode,
+            "objective": objective,
+            "members": sorted(([_place(m["current"]), _place(m["next"])] for m in members),
+                              key=lambda pair: [logic.place_key(p) for p in map(_from_log, pair)]),
+            "max_minutes": max_minutes,
+            "elapsed_ms": round(elapsed * 1000, 2),
+            "cache_hit": bool(cache_hit),
+            **(options or {}),
+        }
+        line = json.dumps(entry, ensure_ascii=False) + "\n"
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(line)
+
+def _place(place):
+    return [round(place[0], COORD_DIGITS), round(place[1], COORD_DIGITS)] if logic.is_coordinate(place) else place
+
+def _from_log(place):
+    """JSON では座標がリストになるのでタプルに戻す"""
+    return tuple(place) if isinstance(place, list) else place
+
+def from_env():
+    """HUB_FINDER_QUERY_LOG があれば QueryLog、なければ None（記録しない）"""
+    path = os.environ.get(LOG_ENV)
+    return QueryLog(path) if path else None
+
+def read_log(path):
+    """記録したクエリのリスト（壊れた行は飛ばす）"""
+    entries = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line: continue
+            try:
+                entries.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue
+    return entries
+
+def members_of(entry):
+    """記録の members を meeting / cache が使う形（名前は連番）に戻す"""
+    return [{"name": f"メンバー{i + 1}", "current": _from_log(current), "next": _from_log(nxt)}
+            for i, (current, nxt) in enumerate(entry["members"])]
@@ -0,0 +1,265 @@
+import json
+import os
+import sys
+import threading
+from collections import Counter, OrderedDict, deque
+import data
+import edges
+import logic
+
+# --- 地域ごとの路線網の遅延読み込み ---
+# 東京（data.py）以外の地域は、data.py と同じ形の JSON ファイルで置く:
+#   regions/kansai.json = {"TOKYO_LINES": {...}, "LINE_CONFIG": {...},
+#                          "STATION_LOCATIONS": {...}, "STATION_READINGS": {...},
+#                          "BOUNDARY_STATIONS": [...]}
+# ("TOKYO_LINES" の代わりに "LINES" でもよい。STATION_LOCATIONS の値は [緯度, 経度])
+# BOUNDARY_STATIONS は隣の地域と同じ駅（乗り継げる駅）の名前。地域どうしはこの駅でだけつなぎ、
+# 日本橋・京橋のように名前が同じだけの別の駅は、つないだネットワークでは "日本橋 (kansai)" のように地域名を付けて分ける。
+# 最初にその地域の駅が検索されたときに読み込んで logic.Network を作り、
+# メモリの目安 budget_bytes を超えたら最後に使ったのが古い地域から捨てる。
+# どの駅がどの地域にあるかは regions/index.json（駅名と境界駅だけの索引）から引き、地域ファイルは読まない
+# （索引がないか地域ファイルが更新されていたら、その地域のファイルだけ読んで索引を書き直す）。
+
+REGIONS_DIR = os.environ.get("HUB_FINDER_REGIONS", os.path.join(os.path.dirname(os.path.abspath(__file__)), "regions"))
+DEFAULT_REGION = "tokyo"
+INDEX_FILE = "index.json"
+
+def load_region_file(path):
+    """地域ファイルを data.py と同じ4つの辞書と境界駅のリストにして返す"""
+    with open(path, encoding="utf-8") as f:
+        raw = json.load(f)
+    return {
+        "lines": raw.get("LINES", raw.get("TOKYO_LINES", {})),
+        "line_config": raw.get("LINE_CONFIG", {}),
+        "locations": {s: tuple(loc) for s, loc in raw.get("STATION_LOCATIONS", {}).items()},
+        "readings": raw.get("STATION_READINGS", {}),
+        "boundary": raw.get("BOUNDARY_STATIONS", []),
+    }
+
+def save_region_file(path, lines, line_config, locations, readings=None, boundary=None):
+    """data.py と同じ形の辞書を地域ファイルに書く（data.py から書き出して雛形にする用途など）"""
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"LINES": lines, "LINE_CONFIG": line_config,
+                   "STATION_LOCATIONS": {s: list(loc) for s, loc in locations.items()},
+                   "STATION_READINGS": readings or {}, "BOUNDARY_STATIONS": list(boundary or [])},
+                  f, ensure_ascii=False, indent=1)
+
+def qualified(station, region):
+    """つないだネットワークで、別の地域の同じ名前の駅と区別する駅名"""
+    return f"{station} ({region})"
+
+def split_station(name):
+    """"駅 (地域)" -> (駅, 地域)。地域の付いていない名前は (駅, None)"""
+    if name.endswith(")") and " (" in name:
+        station, region = name[:-1].rsplit(" (", 1)
+        return station, region
+    return name, None
+
+def network_nbytes(network):
+    """Network が持っているメモリの目安（主なコンテナと要素の sys.getsizeof の合計）"""
+    size = sum(idx.nbytes + cum.nbytes for idx, cum, _, _ in network.route_arrays)
+    for route in network.routes:
+        size += sys.getsizeof(route.stations) + sys.getsizeof(route.cum_times) + 24 * len(route.cum_times)
+    size += sys.getsizeof(network.station_to_routes) + sys.getsizeof(network.station_index)
+    size += sum(sys.getsizeof(v) + 64 * len(v) for v in network.station_to_routes.values())
+    size += sum(sys.getsizeof(ids) + 28 * len(ids) for ids in network.route_station_ids)
+    return size
+
+class RegionLoader:
+    """
+    地域名 -> logic.Network を必要になったときに作って持つ。東京は logic.DEFAULT_NETWORK をそのまま使い、捨てない。
+    2つ以上の地域にまたがる検索では、境界駅（BOUNDARY_STATIONS）でつないだネットワークをその場で作る。
+    駅名は "日本橋 (kansai)" のように地域を付けても渡せる。付けなければ東京、次に地域名の順で先の地域の駅。
+    """
+    def __init__(self, directory=REGIONS_DIR, budget_bytes=64 * 1024 * 1024):
+        self.directory = directory
+        self.budget_bytes = budget_bytes
+        self._networks = OrderedDict()  # 地域名（つないだものは "a+b"）-> Network
+        self._sizes = {}
+        self._catalog = None  # 地域名 -> (駅名の集合, 境界駅の集合)（小さいので捨てない）
+        self.nbytes = 0
+        # 複数のセッション（スレッド）で1つのローダーを共有するので、索引・LRU の読み書きとネットワークの作成は
+        # ロックの中で行う（同じ地域を2回作らない。作るのは最初の1回だけなので待つのもそのときだけ）
+        self._lock = threading.RLock()
+
+    def regions(self):
+        names = [DEFAULT_REGION]
+        if os.path.isdir(self.directory):
+            names += sorted(f[:-5] for f in os.listdir(self.directory)
+                            if f.endswith(".json") and f != INDEX_FILE and f[:-5] != DEFAULT_REGION)
+        return names
+
+    def _dataset(self, region):
+        if region == DEFAULT_REGION:
+            return {"lines": data.TOKYO_LINES, "line_config": data.LINE_CONFIG,
+                    "locations": data.STATION_LOCATIONS, "readings": data.STATION_READINGS, "boundary": []}
+        return load_region_file(os.path.join(self.directory, f"{region}.json"))
+
+    def _index(self):
+        """索引（index.json）を読み、ない地域・更新された地域のファイルだけ読み直して書き戻す"""
+        if self._catalog is not None: return self._catalog
+        with self._lock:
+            if self._catalog is None: self._catalog = self._read_index()
+        return self._catalog
+
+    def _read_index(self):
+        path = os.path.join(self.directory, INDEX_FILE)
+        try:
+            with open(path, encoding="utf-8") as f:
+                index = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            index = {}
+        regions = self.regions()[1:]
+        changed = set(index) != set(regions)
+        index = {r: e for r, e in index.items() if r in regions}
+        for region in regions:
+            mtime = os.path.getmtime(os.path.join(self.directory, f"{region}.json"))
+            if region in index and index[region].get("mtime") == mtime: continue
+            d = self._dataset(region)
+            index[region] = {"mtime": mtime, "boundary": sorted(d["boundary"]),
+                             "stations": sorted({s for stations in d["lines"].values() for s in stations})}
+            changed = True
+        if changed:
+            try:
+                with open(path, "w", encoding="utf-8") as f:
+                    json.dump(index, f, ensure_ascii=False)
+            except OSError:  # 書けなくても次回また作るだけ
+                pass
+        catalog = {DEFAULT_REGION: (frozenset(logic.STATION_TO_ROUTES), frozenset())}
+        for region, e in index.items():
+            catalog[region] = (frozenset(e["stations"]), frozenset(e["boundary"]))
+        return catalog
+
+    def stations(self, region):
+        return self._index()[region][0]
+
+    def boundary(self, a, b):
+        """地域 a と b をつなぐ駅（両方にあって、どちらかが境界駅にしている駅）"""
+        catalog = self._index()
+        return (catalog[a][0] & catalog[b][0]) & (catalog[a][1] | catalog[b][1])
+
+    def region_of(self, station):
+        """station を含む地域（境界駅なら複数。"駅 (地域)" ならその地域だけ）"""
+        name, region = split_station(station)
+        if region is not None:
+            return [region] if region in self._index() and name in self.stations(region) else []
+        return [r for r in self.regions() if station in self.stations(r)]
+
+    def _cached(self, key, build):
+        """key のネットワーク（なければ build() で作って入れ、予算を超えたら古いものから捨てる）"""
+        with self._lock:
+            network = self._networks.get(key)
+            if network is not None:
+                self._networks.move_to_end(key)
+                return network
+            network = build()
+            self._put(key, network)
+            return network
+
+    def _put(self, key, network):
+        self._networks[key] = network
+        self._sizes[key] = network_nbytes(network)
+        self.nbytes += self._sizes[key]
+        while self.nbytes > self.budget_bytes and len(self._networks) > 1:
+            old, _ = self._networks.popitem(last=False)
+            self.nbytes -= self._sizes.pop(old)
+
+    def network(self, region):
+        """1つの地域のネットワーク（初回に読み込んで作る）"""
+        if region == DEFAULT_REGION: return logic.DEFAULT_NETWORK
+        def build():
+            d = self._dataset(region)
+            return logic.Network(d["lines"], d["line_config"], d["locations"], name=region)
+        return self._cached(region, build)
+
+    def _region_path(self, start_regions, end_regions):
+        """境界駅でつながる地域どうしを辺とみなし、幅優先で最短の地域の並びを探す"""
+        names = self.regions()
+        prev = {r: None for r in start_regions}
+        queue = deque(start_regions)
+        while queue:
+            r = queue.popleft()
+            if r in end_regions:
+                path = []
+                while r is not None:
+                    path.append(r)
+                    r = prev[r]
+                return path[::-1]
+            for other in names:
+                if other not in prev and self.boundary(r, other):
+                    prev[other] = r
+                    queue.append(other)
+        return None
+
+    def _station_ids(self, regions):
+        """
+        つないだネットワークでの駅名: {地域: {駅名: ネットワークでの駅名}}。
+        境界駅と、1つの地域にしかない駅はそのまま。名前が同じだけの駅は、東京の駅（境界駅でない名前）はそのまま、
+        それ以外は地域名を付ける。
+        """
+        joins = {r: set() for r in regions}
+        for i, a in enumerate(regions):
+            for b in regions[i + 1:]:
+                shared = self.boundary(a, b)
+                joins[a] |= shared
+                joins[b] |= shared
+        joined = set().union(*joins.values())
+        count = Counter(s for r in regions for s in self.stations(r))
+        ids = {}
+        for r in regions:
+            ids[r] = {s: s if count[s] == 1 or s in joins[r] or (r == DEFAULT_REGION and s not in joined)
+                      else qualified(s, r) for s in self.stations(r)}
+        return ids
+
+    def stitched(self, regions):
+        """複数の地域を境界駅でつないだネットワーク（同じ名前の路線が別の駅列なら地域名を付けて分ける）"""
+        regions = sorted(set(regions))
+        if len(regions) == 1: return self.network(regions[0])
+        return self._cached("+".join(regions), lambda: self._build_stitched(regions))
+
+    def _build_stitched(self, regions):
+        ids = self._station_ids(regions)
+        lines, line_config, locations = {}, {}, {}
+        for region in regions:
+            d = self._dataset(region)
+            rename = ids[region]
+            for line, stations in d["lines"].items():
+                stations = [rename[s] for s in stations]
+                name = line if line not in lines or lines[line] == stations else f"{line} ({region})"
+                lines[name] = stations
+                line_config[name] = d["line_config"].get(line, line_config.get(name, edges.DEFAULT_CONF))
+            for s, loc in d["locations"].items():
+                # 境界駅は同じ駅なので、先に読んだ地域の座標を使う
+                if s in rename: locations.setdefault(rename[s], loc)
+        return logic.Network(lines, line_config, locations, name="+".join(regions))
+
+    def network_for(self, *stations):
+        """全部の駅を含むネットワーク（1つの地域で足りなければつなぐ）。つながらなければ None"""
+        needed = []
+        for s in stations:
+            candidates = self.region_of(s)
+            if not candidates: return None
+            if any(r in needed for r in candidates): continue
+            if not needed:
+                needed.append(candidates[0])
+                continue
+            path = self._region_path(needed, set(candidates))
+            if path is None: return None
+            needed += [r for r in path if r not in needed]
+        return self.stitched(needed)
+
+    def _resolve(self, network, station):
+        """network での駅名（地域名を付けた駅が、そのネットワークでは付けない名前のこともある）"""
+        if station in network.station_index: return station
+        name, region = split_station(station)
+        if region is not None: return name
+        for r in self.region_of(station):
+            if qualified(station, r) in network.station_index: return qualified(station, r)
+        return station
+
+    def find_routes(self, start_node, end_node, max_transfers=4):
+        """地域をまたぐ場合も含めて logic.find_routes_raptor で探す"""
+        network = self.network_for(start_node, end_node)
+        if network is None: return []
+        return logic.find_routes_raptor(self._resolve(network, start_node), self._resolve(network, end_node),
+                                        max_transfers, network=network)
@@ -0,0 +1,282 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+import cache
+import clusters
+import data
+import isochrone
+import matrix
+import meeting
+import querylog
+import slowlog
+
+# --- 記録したクエリの再生による負荷試験 ---
+# 使い方:
+#   python replay.py queries.jsonl --concurrency 8 --speedup 10        # ライブラリを直接呼ぶ
+#   python replay.py serve --port 8765                                 # 同じ処理を HTTP で受ける簡易サーバー
+#   python replay.py queries.jsonl --url http://localhost:8765 --concurrency 8
+# queries.jsonl は app.py が HUB_FINDER_QUERY_LOG に書いた記録（querylog.py）。
+# 記録の時刻の間隔を speedup 倍に縮めて投げ（0 なら間隔なしで投げ続ける）、
+# スループット・応答時間の分位点・結果キャッシュのヒット率を集計する。
+
+class Engine:
+    """
+    app.py と同じ手順で集合場所を探す（画面なし）。行列などの前計算は setup() で1回だけ行う。
+    cache_path を渡すとそのファイルを結果キャッシュに使い、None なら一時ファイル、False ならキャッシュなし。
+    slow_log (slowlog.SlowQueryLog) を渡すと、遅かった記録の入力・内訳・cProfile を保存する。
+    """
+    def __init__(self, cache_path=None, details=True, slow_log=None):
+        self.details = details
+        self.slow_log = slow_log or slowlog.SlowQueryLog(None)
+        self.result_cache = None
+        if cache_path is not False:
+            if cache_path is None:
+                cache_path = os.path.join(tempfile.mkdtemp(prefix="hub-finder-replay-"), "cache.sqlite3")
+            self.result_cache = cache.ResultCache(cache_path)
+        self.time_matrix = None
+        self.isochrones = None
+        self.clusters = None
+
+    def setup(self):
+        self.time_matrix = matrix.build_time_matrix()
+        self.isochrones = isochrone.IsochroneIndex(self.time_matrix)
+        self.clusters = clusters.ClusterIndex()
+        return self
+
+    def _cached(self, members, objective, mode, search):
+        """(ranking, キャッシュから返したか)"""
+        if self.result_cache is None: return search(), False
+        key = cache.query_key(members, objective, k=3, mode=mode)
+        ranking = self.result_cache.get_ranking(key)
+        if ranking is not None: return ranking, True
+        ranking = search()
+        self.result_cache.put_ranking(key, ranking)
+        return ranking, False
+
+    def run(self, entry):
+        """
+        記録1件を実行して (ranking, キャッシュから返したか) を返す。
+        時刻表モードの記録は時刻表がないと再現できないので None を返す（集計では「未対応」に数える）。
+        """
+        mode = entry.get("mode", "ta")
+        if mode not in ("capped", "large", "hierarchical", "ta"): return None
+        inputs = {k: entry.get(k) for k in ("mode", "objective", "max_minutes", "members", "refine", "guarantee")
+                  if k in entry}
+        # 2段階探索のつまみ（記録にないときは app.py の既定値）
+        options = {"refine": int(entry.get("refine", 3)), "guarantee": bool(entry.get("guarantee", False))}
+        with self.slow_log.capture("meeting", inputs):
+            return self._run(querylog.members_of(entry), entry.get("objective", "sum"), mode, entry.get("max_minutes"),
+                             options)
+
+    def _run(self, members, objective, mode, max_minutes, options=None):
+        with self.slow_log.stage("ranking"):
+            ranking, hit = self._ranking(members, objective, mode, max_minutes, options)
+        if self.details and ranking:
+            # 画面と同じく、1位の駅までの往路・復路を RAPTOR で復元する（同じ出発・行き先は1回だけ）
+            for current, nxt in {(m["current"], m["next"]) for m in members}:
+                self.slow_log.find_routes_raptor(current, ranking[0].station)
+                self.slow_log.find_routes_raptor(ranking[0].station, nxt)
+        return ranking, hit
+
+    def _ranking(self, members, objective, mode, max_minutes, options=None):
+        if mode == "capped":
+            ranking, _ = meeting.capped_meeting(self.time_matrix, self.isochrones, members, max_minutes,
+                                                k=3, objective=objective, candidates=data.STATION_LOCATIONS)
+            hit = False
+        elif mode == "large":
+            store = meeting.ProfileStore(self.time_matrix.stations, matrix=self.time_matrix)
+            ranking, hit = self._cached(members, objective, mode, lambda: meeting.large_group_meeting(
+                store, members, k=3, objective=objective, candidates=data.STATION_LOCATIONS)[0])
+        elif mode == "hierarchical":
+            # app.py と同じく、つまみごとに別のキーで保存する
+            options = options or {"refine": 3, "guarantee": False}
+            key_mode = f"hierarchical-{options['refine']}-{int(options['guarantee'])}"
+            ranking, hit = self._cached(members, objective, key_mode, lambda: meeting.hierarchical_meeting(
+                self.clusters, members, k=3, objective=objective, candidates=data.STATION_LOCATIONS, **options)[0])
+        else:
+            ranking, hit = self._cached(members, objective, mode, lambda: meeting.top_k_meeting(
+                self.time_matrix, members, k=3, objective=objective, candidates=data.STATION_LOCATIONS)[0])
+        return ranking, hit
+
+
+# --- 1. 簡易 HTTP サーバー（ローカルでの負荷試験用） ---
+def serve(engine, host="127.0.0.1", port=8765):
+    """POST /query に記録1件の JSON を送ると {"ranking": [...], "cache_hit": ...} を返す"""
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            self._reply(200, {"ok": True})
+
+        def do_POST(self):
+            if self.path != "/query":
+                return self._reply(404, {"error": "not found"})
+            entry = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            result = engine.run(entry)
+            if result is None:
+                return self._reply(422, {"error": f"unsupported mode: {entry.get('mode')}"})
+            ranking, hit = result
+            self._reply(200, {"ranking": [{"station": r.station, "total_time": r.total_time, "max_time": r.max_time}
+                                          for r in ranking], "cache_hit": hit})
+
+        def _reply(self, status, payload):
+            body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    print(f"http://{host}:{port}/query で待ち受け中", file=sys.stderr)
+    server.serve_forever()
+
+def http_runner(url, timeout=60):
+    """記録1件を url の /query に送る関数（Engine.run と同じく (ranking, cache_hit) か None を返す）"""
+    endpoint = url.rstrip("/") + "/query"
+
+    def run(entry):
+        request = urllib.request.Request(endpoint, data=json.dumps(entry, ensure_ascii=False).encode("utf-8"),
+                                         headers={"Content-Type": "application/json"})
+        try:
+            with urllib.request.urlopen(request, timeout=timeout) as response:
+                payload = json.loads(response.read())
+        except urllib.error.HTTPError as e:
+            if e.code == 422: return None
+            raise
+        return payload["ranking"], payload["cache_hit"]
+    return run
+
+
+# --- 2. 再生と集計 ---
+class Sample:
+    """1クエリの計測結果。latency は予定時刻から完了まで（待ち行列を含む）、service はその処理だけの時間（秒）"""
+    __slots__ = ("mode", "latency", "service", "cache_hit", "status")
+
+    def __init__(self, mode, latency, service, cache_hit, status):
+        self.mode = mode
+        self.latency = latency
+        self.service = service
+        self.cache_hit = cache_hit
+        self.status = status  # "ok" / "unsupported" / "error"
+
+def replay(entries, run, concurrency=4, speedup=0.0, repeat=1):
+    """
+    entries を記録の時刻順に、間隔を speedup 倍に縮めて run に渡す（0 なら間隔なし）。
+    同時に走らせるのは concurrency 件まで。repeat 回くり返す（2回目以降は結果キャッシュに当たる）。
+    戻り値: (samples, 経過秒)
+    """
+    entries = sorted(entries, key=lambda e: e.get("ts", 0))
+    t0 = entries[0].get("ts", 0) if entries else 0
+    span = (entries[-1].get("ts", 0) - t0) if entries else 0
+    schedule = []
+    for r in range(repeat):
+        for e in entries:
+            offset = ((e.get("ts", 0) - t0) + r * span) / speedup if speedup > 0 else 0.0
+            schedule.append((offset, e))
+
+    samples = []
+    lock = threading.Lock()
+
+    def task(due, entry):
+        started = time.perf_counter()
+        status, hit = "ok", False
+        try:
+            result = run(entry)
+            if result is None: status = "unsupported"
+            else: hit = result[1]
+        except Exception:  # 1件の失敗で試験を止めない（件数だけ数える）
+            status = "error"
+        finished = time.perf_counter()
+        # 間隔なしで投げるときは全部がすぐ待ち行列に入るので、応答時間は処理を始めてからで測る
+        latency = finished - (due if due is not None else started)
+        with lock:
+            samples.append(Sample(entry.get("mode", "ta"), latency, finished - started, hit, status))
+
+    begin = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for offset, entry in schedule:
+            due = begin + offset
+            delay = due - time.perf_counter()
+            if delay > 0: time.sleep(delay)
+            executor.submit(task, due if speedup > 0 else None, entry)
+    return samples, time.perf_counter() - begin
+
+def report(samples, elapsed, entries=None, out=sys.stdout):
+    done = [s for s in samples if s.status == "ok"]
+    print(f"クエリ {len(samples)} 件（成功 {len(done)} / 未対応 {sum(s.status == 'unsupported' for s in samples)}"
+          f" / 失敗 {sum(s.status == 'error' for s in samples)}）、{elapsed:.2f} 秒、"
+          f"スループット {len(done) / elapsed if elapsed > 0 else 0:.1f} 件/秒", file=out)
+    print(f"{'mode':<10}{'件数':>6}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'max ms':>10}"
+          f"{'処理 p50':>10}{'キャッシュ':>10}", file=out)
+    for mode in ["全体"] + sorted({s.mode for s in done}):
+        group = done if mode == "全体" else [s for s in done if s.mode == mode]
+        if not group: continue
+        lat = np.array([s.latency for s in group]) * 1000
+        service = np.array([s.service for s in group]) * 1000
+        p50, p90, p99 = np.percentile(lat, [50, 90, 99])
+        hits = np.mean([s.cache_hit for s in group])
+        print(f"{mode:<10}{len(group):>6}{p50:>10.1f}{p90:>10.1f}{p99:>10.1f}{lat.max():>10.1f}"
+              f"{np.percentile(service, 50):>10.1f}{hits:>10.0%}", file=out)
+    if entries:
+        # 記録したときの応答時間（本番の値）と比べる
+        logged = np.array([e["elapsed_ms"] for e in entries if "elapsed_ms" in e])
+        logged_hits = np.mean([bool(e.get("cache_hit")) for e in entries])
+        if len(logged):
+            p50, p90, p99 = np.percentile(logged, [50, 90, 99])
+            print(f"\n記録時: p50 {p50:.1f} ms / p90 {p90:.1f} ms / p99 {p99:.1f} ms、キャッシュ {logged_hits:.0%}", file=out)
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "serve":
+        parser = argparse.ArgumentParser(prog="replay.py serve", description="負荷試験用の簡易 HTTP サーバー")
+        parser.add_argument("serve")
+        parser.add_argument("--host", default="127.0.0.1")
+        parser.add_argument("--port", type=int, default=8765)
+        parser.add_argument("--cache", help="結果キャッシュのファイル（省略時は一時ファイル）")
+        parser.add_argument("--no-details", action="store_true", help="1位の駅までの経路を復元しない")
+        args = parser.parse_args()
+        serve(Engine(args.cache, details=not args.no_details, slow_log=slowlog.from_env()).setup(), args.host, args.port)
+        return 0
+
+    parser = argparse.ArgumentParser(description="記録したクエリを再生して負荷試験する")
+    parser.add_argument("log", help="querylog.py の JSONL")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--speedup", type=float, default=0.0, help="記録の時刻の間隔を何倍速で再生するか（0 = 間隔なし）")
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--limit", type=int, help="先頭の N 件だけ使う")
+    parser.add_argument("--url", help="ライブラリの代わりに replay.py serve のサーバーに送る")
+    parser.add_argument("--cache", help="結果キャッシュのファイル（省略時は一時ファイル）")
+    parser.add_argument("--no-cache", action="store_true", help="結果キャッシュを使わない")
+    parser.add_argument("--no-details", action="store_true", help="1位の駅までの経路を復元しない")
+    parser.add_argument("--slow-log", help="遅かったクエリの入力・内訳・cProfile を保存するディレクトリ（slowlog.py で集計）")
+    parser.add_argument("--slow-ms", type=float, default=slowlog.DEFAULT_THRESHOLD_MS, help="保存する応答時間（ミリ秒）")
+    args = parser.parse_args()
+
+    entries = querylog.read_log(args.log)[:args.limit]
+    if not entries:
+        print("クエリがありません", file=sys.stderr)
+        return 1
+    if args.url:
+        run = http_runner(args.url)
+    else:
+        t0 = time.perf_counter()
+        slow_log = slowlog.SlowQueryLog(args.slow_log, threshold_ms=args.slow_ms) if args.slow_log else slowlog.from_env()
+        engine = Engine(False if args.no_cache else args.cache, details=not args.no_details, slow_log=slow_log).setup()
+        print(f"前計算: {time.perf_counter() - t0:.2f} 秒（集計に含めない）", file=sys.stderr)
+        run = engine.run
+    samples, elapsed = replay(entries, run, args.concurrency, args.speedup, args.repeat)
+    report(samples, elapsed, entries)
+    return 1 if any(s.status == "error" for s in samples) else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
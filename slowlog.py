@@ -0,0 +1,250 @@
+import argparse
+import cProfile
+import json
+import os
+import pstats
+import random
+import sys
+import threading
+import time
+from contextlib import contextmanager
+import numpy as np
+import logic
+
+# --- 遅いクエリの記録（任意）と cProfile の保存 ---
+# 環境変数 HUB_FINDER_SLOW_LOG にディレクトリを設定したときだけ記録する。
+#   HUB_FINDER_SLOW_MS      : これ以上かかったクエリを保存する（ミリ秒、既定 300）
+#   HUB_FINDER_SLOW_SAMPLE  : 速いクエリもこの割合で保存する（比較用、既定 0）
+#   HUB_FINDER_SLOW_PROFILE : cProfile を有効にするクエリの割合（既定 0.05）
+#   HUB_FINDER_SLOW_KEEP    : 残す件数（古いものから消す、既定 200）
+# 1件ごとに <時刻>-<種類>.json（入力・所要時間・段階ごとの内訳）と .pstats（cProfile）を書く。
+# cProfile は遅くなるかどうか事前に分からないので、対象のクエリは最初から cProfile 下で動かす
+# （記録する時間は cProfile 込みで、json の "profiled" で分かる）。
+# cProfile 下の RAPTOR は3倍近く遅い（find_routes_raptor 1件 0.83 ms が、全部 cProfile だと 2.2 ms、
+# 5% なら平均 1.0 ms）ので、既定では 5% だけ抜き取る。遅いクエリの記録と段階ごとの内訳は cProfile なしでも全部残る。
+# Python 3.12 以降の cProfile はプロセスで同時に1つしか有効にできないので、他のクエリの cProfile 中に
+# 来たクエリは cProfile なしで記録する（並列に動いている他のスレッドの呼び出しも入ることがある）。
+# 集計: python slowlog.py <ディレクトリ> --top 25
+
+LOG_ENV = "HUB_FINDER_SLOW_LOG"
+DEFAULT_THRESHOLD_MS = 300.0
+DEFAULT_KEEP = 200
+DEFAULT_PROFILE_RATE = 0.05
+
+class Capture:
+    """記録中の1クエリ。stages は段階ごとの合計秒数と回数"""
+    __slots__ = ("kind", "inputs", "stages", "profiler")
+
+    def __init__(self, kind, inputs, profiler=None):
+        self.kind = kind
+        self.inputs = inputs
+        self.stages = {}  # 段階名 -> [秒, 回数]
+        self.profiler = profiler
+
+    def add(self, name, seconds):
+        stage = self.stages.get(name)
+        if stage is None: self.stages[name] = [seconds, 1]
+        else:
+            stage[0] += seconds
+            stage[1] += 1
+
+class SlowQueryLog:
+    """
+    capture(kind, inputs) で囲んだ処理が threshold_ms を超えるか sample_rate で選ばれたら保存する。
+    capture の中の capture / stage は外側のクエリの内訳になる（集合場所探索の中の find_routes_raptor など）。
+    directory が None なら何もしない（呼び出し側で有無を分けなくてよい）。
+    """
+    def __init__(self, directory, threshold_ms=DEFAULT_THRESHOLD_MS, sample_rate=0.0, profile_rate=DEFAULT_PROFILE_RATE,
+                 keep=DEFAULT_KEEP, seed=None):
+        self.directory = directory
+        self.threshold_ms = threshold_ms
+        self.sample_rate = sample_rate
+        self.profile_rate = profile_rate
+        self.keep = keep
+        self.saved = 0
+        self._random = random.Random(seed)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        if directory is not None: os.makedirs(directory, exist_ok=True)
+
+    @property
+    def enabled(self):
+        return self.directory is not None
+
+    @contextmanager
+    def capture(self, kind, inputs=None):
+        if not self.enabled or getattr(self._local, "current", None) is not None:
+            # 記録しない、または外側のクエリの一部
+            with self.stage(kind): yield None
+            return
+        with self._lock:
+            profile = self._random.random() < self.profile_rate
+            sampled = self._random.random() < self.sample_rate
+        capture = Capture(kind, inputs, cProfile.Profile() if profile else None)
+        self._local.current = capture
+        started = time.perf_counter()
+        if capture.profiler is not None:
+            try:
+                capture.profiler.enable()
+            except ValueError:  # 他の cProfile が有効
+                capture.profiler = None
+        try:
+            yield capture
+        finally:
+            if capture.profiler is not None: capture.profiler.disable()
+            elapsed = time.perf_counter() - started
+            self._local.current = None
+            slow = elapsed * 1000 >= self.threshold_ms
+            if slow or sampled:
+                self._save(capture, elapsed, "slow" if slow else "sampled")
+
+    @contextmanager
+    def stage(self, name):
+        """記録中のクエリの内訳に name の時間を足す（記録中でなければ何もしない）"""
+        capture = getattr(self._local, "current", None)
+        if capture is None:
+            yield
+            return
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            capture.add(name, time.perf_counter() - started)
+
+    def find_routes_raptor(self, start_node, end_node, **kwargs):
+        """logic.find_routes_raptor を記録つきで呼ぶ（時刻表などの大きな引数は入力に残さない）"""
+        inputs = {"start": start_node, "end": end_node,
+                  **{k: v for k, v in kwargs.items() if isinstance(v, (int, float, str, tuple, type(None)))}}
+        with self.capture("find_routes_raptor", inputs):
+            return logic.find_routes_raptor(start_node, end_node, **kwargs)
+
+    def _save(self, capture, elapsed, reason):
+        now = time.time()
+        with self._lock:
+            self.saved += 1
+            stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(now)) + f"-{int(now * 1000) % 1000:03d}-{self.saved:05d}"
+        base = os.path.join(self.directory, f"{stamp}-{capture.kind}")
+        entry = {
+            "ts": round(now, 3),
+            "kind": capture.kind,
+            "reason": reason,
+            "elapsed_ms": round(elapsed * 1000, 2),
+            "profiled": capture.profiler is not None,
+            "threshold_ms": self.threshold_ms,
+            "stages": {name: {"ms": round(s * 1000, 2), "calls": n} for name, (s, n) in capture.stages.items()},
+            "inputs": capture.inputs,
+        }
+        try:
+            if capture.profiler is not None: capture.profiler.dump_stats(base + ".pstats")
+            with open(base + ".json", "w", encoding="utf-8") as f:
+                json.dump(entry, f, ensure_ascii=False, default=str)
+            self._rotate()
+        except OSError:  # 記録に失敗しても検索は止めない
+            pass
+
+    def _rotate(self):
+        """keep 件を超えたら古いものから消す（ファイル名が時刻順）"""
+        with self._lock:
+            names = sorted(f for f in os.listdir(self.directory) if f.endswith(".json"))
+            for name in names[:max(0, len(names) - self.keep)]:
+                for path in (name, name[:-len(".json")] + ".pstats"):
+                    try: os.remove(os.path.join(self.directory, path))
+                    except FileNotFoundError: pass
+
+def from_env():
+    """HUB_FINDER_SLOW_LOG があれば記録する SlowQueryLog、なければ何もしない SlowQueryLog"""
+    return SlowQueryLog(
+        os.environ.get(LOG_ENV) or None,
+        threshold_ms=float(os.environ.get("HUB_FINDER_SLOW_MS", DEFAULT_THRESHOLD_MS)),
+        sample_rate=float(os.environ.get("HUB_FINDER_SLOW_SAMPLE", 0.0)),
+        profile_rate=float(os.environ.get("HUB_FINDER_SLOW_PROFILE", DEFAULT_PROFILE_RATE)),
+        keep=int(os.environ.get("HUB_FINDER_SLOW_KEEP", DEFAULT_KEEP)),
+    )
+
+
+# --- 2. 集計 CLI ---
+def read_captures(directory, kind=None):
+    """[(記録, pstats のパス or None), ...] を時刻順に"""
+    captures = []
+    for name in sorted(os.listdir(directory)):
+        if not name.endswith(".json"): continue
+        try:
+            with open(os.path.join(directory, name), encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            continue
+        if kind is not None and entry.get("kind") != kind: continue
+        profile = os.path.join(directory, name[:-len(".json")] + ".pstats")
+        captures.append((entry, profile if os.path.exists(profile) else None))
+    return captures
+
+def hot_functions(profiles):
+    """
+    複数の pstats をまとめて {関数: [呼び出し回数, tottime, cumtime, 出てきた記録の数]}。
+    関数は (ファイル名, 行, 名前)（ファイル名はディレクトリを除く）。
+    """
+    functions = {}
+    for path in profiles:
+        try:
+            stats = pstats.Stats(path).stats
+        except (OSError, EOFError, TypeError, ValueError):
+            continue
+        for (filename, line, name), (_, calls, tottime, cumtime, _) in stats.items():
+            f = functions.setdefault((os.path.basename(filename), line, name), [0, 0.0, 0.0, 0])
+            f[0] += calls
+            f[1] += tottime
+            f[2] += cumtime
+            f[3] += 1
+    return functions
+
+def main():
+    parser = argparse.ArgumentParser(description="遅いクエリの記録を集計して、時間を使っている関数を表示する")
+    parser.add_argument("directory", help="HUB_FINDER_SLOW_LOG のディレクトリ")
+    parser.add_argument("--top", type=int, default=25, help="表示する関数の数")
+    parser.add_argument("--sort", default="tottime", choices=["tottime", "cumtime", "calls"])
+    parser.add_argument("--kind", help="この種類の記録だけ（例: meeting, find_routes_raptor）")
+    parser.add_argument("--reason", choices=["slow", "sampled"], help="保存した理由で絞る")
+    args = parser.parse_args()
+
+    captures = [(e, p) for e, p in read_captures(args.directory, args.kind)
+                if args.reason is None or e.get("reason") == args.reason]
+    if not captures:
+        print("記録がありません", file=sys.stderr)
+        return 1
+
+    elapsed = np.array([e["elapsed_ms"] for e, _ in captures])
+    p50, p90, p99 = np.percentile(elapsed, [50, 90, 99])
+    print(f"記録 {len(captures)} 件（遅い {sum(e['reason'] == 'slow' for e, _ in captures)}"
+          f" / 抽出 {sum(e['reason'] == 'sampled' for e, _ in captures)}）: "
+          f"p50 {p50:.1f} ms / p90 {p90:.1f} ms / p99 {p99:.1f} ms / max {elapsed.max():.1f} ms")
+
+    # 段階ごとの内訳（1クエリあたりの平均）
+    stages = {}
+    for e, _ in captures:
+        for name, s in e.get("stages", {}).items():
+            total = stages.setdefault(name, [0.0, 0])
+            total[0] += s["ms"]
+            total[1] += s["calls"]
+    if stages:
+        print(f"\n{'段階':<24}{'平均 ms':>10}{'平均回数':>10}")
+        for name, (ms, calls) in sorted(stages.items(), key=lambda x: -x[1][0]):
+            print(f"{name:<24}{ms / len(captures):>10.1f}{calls / len(captures):>10.1f}")
+
+    # 遅い順に数件（入力を見て再現できるように）
+    print("\n遅いクエリ:")
+    for e, _ in sorted(captures, key=lambda c: -c[0]["elapsed_ms"])[:5]:
+        print(f"  {e['elapsed_ms']:>9.1f} ms  {e['kind']:<20}{json.dumps(e.get('inputs'), ensure_ascii=False)[:120]}")
+
+    profiles = [p for _, p in captures if p is not None]
+    if profiles:
+        functions = hot_functions(profiles)
+        column = {"calls": 0, "tottime": 1, "cumtime": 2}[args.sort]
+        print(f"\ncProfile（{len(profiles)} 件の合計、{args.sort} の多い順）:")
+        print(f"{'calls':>10}{'tottime s':>11}{'cumtime s':>11}{'件数':>6}  関数")
+        for (filename, line, name), f in sorted(functions.items(), key=lambda x: -x[1][column])[:args.top]:
+            where = f" ({filename}:{line})" if filename != "~" else ""  # "~" は組み込み関数
+            print(f"{f[0]:>10}{f[1]:>11.3f}{f[2]:>11.3f}{f[3]:>6}  {name}{where}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
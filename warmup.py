@@ -0,0 +1,87 @@
+import os
+import threading
+import time
+import graph
+import logic
+import matrix
+
+# --- 起動時のウォームアップ ---
+# 再起動直後の最初のクエリだけ遅くならないように、共有データをバックグラウンドで先に作っておく。
+# 作り終わるまでは画面側がこれまでどおりその場で計算する（待たせない）。
+
+def hot_stations(result_cache=None, limit=30):
+    """
+    よく検索される駅。優先順:
+    1. 環境変数 HUB_FINDER_WARM_STATIONS（カンマ区切り）
+    2. 結果キャッシュに残っているクエリに出てくる回数
+    3. 乗り入れ路線の多い駅（ログがまだないとき）
+    """
+    configured = os.environ.get("HUB_FINDER_WARM_STATIONS")
+    if configured:
+        return [s.strip() for s in configured.split(",") if s.strip() in logic.STATION_TO_ROUTES][:limit]
+    stations = result_cache.hot_stations(limit) if result_cache is not None else []
+    if len(stations) < limit:
+        hubs = sorted(logic.STATION_TO_ROUTES, key=lambda s: -len(logic.STATION_TO_ROUTES[s]))
+        stations += [s for s in hubs if s not in stations][:limit - len(stations)]
+    return stations
+
+class WarmUp:
+    """
+    バックグラウンドスレッドで 路線グラフ → 全駅間の所要時間行列 → よく使う駅の並べ替え済みプロファイル
+    の順に作る。出来上がったものから属性に入るので、画面側は None かどうかで使えるか判断する。
+    network を渡すとそのネットワークで行列を作る（運行障害中でも平常時の行列を作りたいとき）。
+    """
+    def __init__(self, stations=None, network=None):
+        self.stations = stations if stations is not None else []
+        self.network = network
+        self.graph = None
+        self.matrix = None
+        self.done = 0
+        self.total = 2 + len(self.stations)
+        self.stage = "待機中"
+        self.error = None
+        self.elapsed = None
+        self._thread = None
+
+    @property
+    def ready(self):
+        return self.done >= self.total
+
+    @property
+    def progress(self):
+        return self.done / self.total
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="hub-finder-warmup", daemon=True)
+            self._thread.start()
+        return self
+
+    def join(self, timeout=None):
+        if self._thread is not None: self._thread.join(timeout)
+
+    def _run(self):
+        started = time.perf_counter()
+        try:
+            self.stage = "路線グラフ"
+            self.graph = graph.build_graph()
+            self.done += 1
+
+            self.stage = "所要時間行列"
+            time_matrix = matrix.build_time_matrix(network=self.network)
+
+            # 閾値アルゴリズムが読む「近い順」の並びを、よく使う駅の分だけ先に作る
+            for s in self.stations:
+                self.stage = f"プロファイル: {s}"
+                time_matrix.sorted_from(s)
+                time_matrix.sorted_to(s)
+                self.done += 1
+            # 並びまで揃ってから公開する（ready になった時点で必ず matrix が使える）
+            self.matrix = time_matrix
+            self.stage = "完了"
+            self.done += 1
+        except Exception as e:  # ウォームアップの失敗で画面を止めない（その場計算に戻るだけ）
+            self.error = e
+            self.stage = "失敗"
+            self.done = self.total
+        self.elapsed = time.perf_counter() - started